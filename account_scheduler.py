@@ -0,0 +1,243 @@
+# account_scheduler.py
+# ==========================================================
+#  Hàng đợi tài khoản DÙNG CHUNG cho mọi AccountRunner (mỗi giả lập 1 runner):
+#  runner xin 1 tài khoản → được "thuê" (lease) có hạn TTL; đang chạy flow thì gia hạn đều,
+#  xong thì trả. Runner/thiết bị chết → lease hết hạn (hoặc release_device) → tài khoản quay
+#  lại hàng đợi cho máy khác. Nhờ vậy 2 máy tick trùng tài khoản không đăng nhập đè nhau.
+#  Phiên đăng nhập: nhớ mỗi máy đang đăng nhập tài khoản nào → lấy lại đúng tài khoản đó thì
+#  bỏ qua logout/login (bước chậm nhất); máy khác thuê tài khoản đó → phiên cũ bị huỷ.
+#  DueQueue: heap mốc đến hạn của từng tài khoản → runner ngủ đúng tới việc sớm nhất, hoặc tới khi
+#  có sự kiện "danh sách tài khoản đổi" (notify_changed) thay vì quét lại + ngủ cứng 1 giờ.
+# ==========================================================
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Hạn thuê mặc định (s); người giữ gia hạn mỗi TTL/3 khi còn "sống"
+LEASE_TTL = 600.0
+
+
+@dataclass
+class Lease:
+    account_id: object
+    device_id: str
+    email: str
+    expires: float
+
+
+class AccountScheduler:
+    """
+    acquire(device_id, candidates) → bản ghi tài khoản đầu tiên (theo thứ tự ưu tiên của người gọi)
+    chưa bị máy KHÁC thuê; renew()/release()/release_device() quản lý lease. An toàn đa luồng.
+    """
+
+    def __init__(self, ttl: float = LEASE_TTL):
+        self.ttl = float(ttl)
+        self._leases: Dict[object, Lease] = {}
+        self._lock = threading.Lock()
+        self.acquired = 0      # số lần cấp tài khoản
+        self.contended = 0     # số lần bỏ qua vì máy khác đang giữ
+        self.expired = 0       # số lease hết hạn bị thu hồi (máy treo/chết)
+        self._t0 = time.monotonic()
+        # sự kiện "dữ liệu tài khoản đổi": đếm thế hệ, runner chờ trên Condition
+        self._changed = threading.Condition()
+        self.generation = 0
+        # phiên đăng nhập hiện tại của từng máy (device_id → khoá tài khoản)
+        self._sessions: Dict[str, object] = {}
+        self.logins = 0
+        self.logins_avoided = 0
+
+    @staticmethod
+    def key_of(rec: dict):
+        return rec.get('id') or rec.get('game_email')
+
+    def _reap(self, now: float):
+        for key in [k for k, ls in self._leases.items() if ls.expires <= now]:
+            self._leases.pop(key)
+            self.expired += 1
+
+    # ---------- cấp / gia hạn / trả ----------
+    def acquire(self, device_id: str, candidates: Iterable[dict]) -> Optional[dict]:
+        now = time.monotonic()
+        with self._lock:
+            self._reap(now)
+            for rec in candidates:
+                key = self.key_of(rec)
+                held = self._leases.get(key)
+                if held is not None and held.device_id != device_id:
+                    self.contended += 1
+                    continue
+                self._leases[key] = Lease(key, device_id, rec.get('game_email', ''), now + self.ttl)
+                self.acquired += 1
+                # máy khác đang "đăng nhập sẵn" tài khoản này sẽ bị đá ra khi máy này đăng nhập
+                for dev, sess in list(self._sessions.items()):
+                    if sess == key and dev != device_id:
+                        self._sessions.pop(dev)
+                return rec
+        return None
+
+    def renew(self, device_id: str, rec: dict) -> bool:
+        """Gia hạn lease; False nếu lease đã mất (hết hạn và máy khác đã lấy)."""
+        key = self.key_of(rec)
+        with self._lock:
+            held = self._leases.get(key)
+            if held is None or held.device_id != device_id:
+                return False
+            held.expires = time.monotonic() + self.ttl
+            return True
+
+    def release(self, device_id: str, rec: dict):
+        key = self.key_of(rec)
+        with self._lock:
+            held = self._leases.get(key)
+            if held is not None and held.device_id == device_id:
+                self._leases.pop(key)
+
+    def release_device(self, device_id: str) -> List[str]:
+        """Trả mọi lease của 1 thiết bị (runner dừng / máy mất kết nối). Trả email đã trả lại."""
+        with self._lock:
+            keys = [k for k, ls in self._leases.items() if ls.device_id == device_id]
+            return [self._leases.pop(k).email for k in keys]
+
+    def holder(self, rec: dict) -> Optional[str]:
+        with self._lock:
+            self._reap(time.monotonic())
+            held = self._leases.get(self.key_of(rec))
+            return held.device_id if held else None
+
+    @contextmanager
+    def keep_alive(self, device_id: str, rec: dict, alive: Optional[Callable[[], bool]] = None):
+        """
+        Giữ lease trong khối with: luồng nền gia hạn mỗi TTL/3 khi alive() còn True
+        (alive=False → ngừng gia hạn, lease tự hết hạn). Ra khỏi khối → trả lease.
+        """
+        stop = threading.Event()
+
+        def _loop():
+            while not stop.wait(self.ttl / 3.0):
+                if alive is not None and not alive():
+                    return
+                if not self.renew(device_id, rec):
+                    return
+
+        t = threading.Thread(target=_loop, name=f"Lease-{device_id}", daemon=True)
+        t.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            self.release(device_id, rec)
+
+    # ---------- phiên đăng nhập theo máy ----------
+    def set_session(self, device_id: str, rec: Optional[dict]):
+        """Ghi tài khoản đang đăng nhập trên máy (None = đã thoát / không chắc chắn)."""
+        with self._lock:
+            if rec is None:
+                self._sessions.pop(device_id, None)
+            else:
+                self._sessions[device_id] = self.key_of(rec)
+
+    def in_session(self, device_id: str, rec: dict) -> bool:
+        with self._lock:
+            return self._sessions.get(device_id) == self.key_of(rec)
+
+    def session_key(self, device_id: str):
+        with self._lock:
+            return self._sessions.get(device_id)
+
+    def note_login(self, avoided: bool):
+        with self._lock:
+            if avoided:
+                self.logins_avoided += 1
+            else:
+                self.logins += 1
+
+    # ---------- sự kiện thay đổi tài khoản ----------
+    def notify_changed(self):
+        """Gọi khi dữ liệu tài khoản đổi (runner vừa cập nhật server, UI tải lại DS) → đánh thức runner đang chờ."""
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wake(self):
+        """Đánh thức runner đang chờ mà không tính là thay đổi (vd: yêu cầu dừng)."""
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_changed(self, seen: int, timeout: float, stop: Optional[threading.Event] = None) -> int:
+        """Chờ tới khi generation khác `seen`, hết timeout hoặc stop được set. Trả generation hiện tại."""
+        end = time.monotonic() + max(0.0, timeout)
+        with self._changed:
+            while self.generation == seen and not (stop is not None and stop.is_set()):
+                left = end - time.monotonic()
+                if left <= 0:
+                    break
+                self._changed.wait(left)
+            return self.generation
+
+    # ---------- thống kê ----------
+    def describe(self) -> str:
+        hours = max((time.monotonic() - self._t0) / 3600.0, 1e-6)
+        with self._lock:
+            active = len(self._leases)
+        return (f"Hàng đợi tài khoản: {self.acquired} lượt cấp ({self.acquired / hours:.1f}/giờ), "
+                f"{active} đang thuê, {self.contended} lần tránh trùng máy khác, {self.expired} lease hết hạn; "
+                f"đăng nhập {self.logins} lần, bỏ qua {self.logins_avoided} lần ({self.logins_avoided / hours:.1f}/giờ)")
+
+
+class DueQueue:
+    """
+    Heap (mốc đến hạn epoch, khoá): set() O(log n), peek() O(1) trừ mục cũ bỏ lười.
+    Khoá = id tài khoản (hoặc mục chung như chúc phúc); set(key, None) = không còn việc.
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._due: Dict[object, float] = {}
+        self._seq = itertools.count()
+
+    def set(self, key, due: Optional[float]):
+        if due is None:
+            self._due.pop(key, None)
+            return
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+
+    def clear(self):
+        self._heap.clear()
+        self._due.clear()
+
+    def peek(self) -> Optional[tuple[float, object]]:
+        heap = self._heap
+        while heap and self._due.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)  # mục đã bị set lại / xoá
+        return (heap[0][0], heap[0][2]) if heap else None
+
+    def due(self, key) -> Optional[float]:
+        return self._due.get(key)
+
+    def is_due(self, key, now: float) -> bool:
+        due = self._due.get(key)
+        return due is not None and due <= now
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+
+_SCHEDULER: Optional[AccountScheduler] = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_account_scheduler() -> AccountScheduler:
+    """Scheduler dùng chung cả tiến trình (mọi runner/thiết bị)."""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = AccountScheduler()
+        return _SCHEDULER
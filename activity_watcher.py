@@ -0,0 +1,149 @@
+# activity_watcher.py
+# ==========================================================
+#  Theo dõi activity foreground theo SỰ KIỆN cho 1 thiết bị:
+#  giữ 1 lệnh `logcat -b events` chạy nền, lọc am_resume_activity / wm_resume_activity,
+#  mỗi lần activity đổi thì cập nhật cache foreground trong module.py và đánh thức
+#  wait_state() → không còn poll `dumpsys` mỗi 250 ms.
+# ==========================================================
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import threading
+from typing import Optional
+
+from adb_client import AdbError, get_client
+from module import _COMP_RE, _device_key, log_wk, publish_foreground, set_foreground_watched
+
+# Tag event log báo activity vừa resume (Android cũ: am_*, Android 10+: wm_*)
+RESUME_TAGS = ("am_resume_activity", "wm_resume_activity")
+_LOGCAT_CMD = ("logcat -b events -v brief -T 1 "
+               + " ".join(f"{t}:I" for t in RESUME_TAGS) + " *:S")
+# Chu kỳ kiểm tra cờ dừng khi logcat im lặng (đứng yên 1 activity thì có thể không có dòng nào hàng giờ)
+STREAM_POLL = 1.0
+
+
+def _wk_log(wk, msg: str):
+    if hasattr(wk, "_log"):
+        wk._log(msg)
+    else:
+        log_wk(wk, msg)
+
+
+def parse_resume_line(line: str) -> Optional[str]:
+    """`I/am_resume_activity( 812): [0,1234,5,com.pkg/.MainActivity]` → 'com.pkg/com.pkg.MainActivity'."""
+    if not any(t in line for t in RESUME_TAGS):
+        return None
+    m = _COMP_RE.search(line.split(":", 1)[-1])
+    if not m:
+        return None
+    comp = m.group(1)
+    pkg, cls = comp.split("/", 1)
+    if cls.startswith("."):
+        cls = pkg + cls
+    return f"{pkg}/{cls}"
+
+
+class ActivityWatcher:
+    """Thread nền đọc logcat events của 1 thiết bị (qua adb server trực tiếp, dự phòng adb.exe)."""
+
+    def __init__(self, wk):
+        self.wk = wk
+        self.key = _device_key(wk)
+        self._stop = threading.Event()
+        self._sock: Optional[socket.socket] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"ActivityWatch-{self.key}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        set_foreground_watched(self.key, False)
+
+    def _lines(self):
+        """Sinh từng dòng output logcat (socket adb server, hoặc adb.exe nếu không nối được)."""
+        try:
+            self._sock = get_client().shell_stream(self.key, _LOGCAT_CMD, read_timeout=STREAM_POLL)
+        except AdbError:
+            self._sock = None
+        if self._sock is not None:
+            buf = b""
+            while not self._stop.is_set():
+                try:
+                    chunk = self._sock.recv(4096)
+                except socket.timeout:
+                    continue  # chỉ là im lặng, không phải mất kết nối
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                for ln in lines:
+                    yield ln.decode("utf-8", "ignore")
+            return
+        adb = getattr(self.wk, "_adb", None)
+        if not adb:
+            return
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self._proc = subprocess.Popen([adb, "-s", self.key, "shell", _LOGCAT_CMD],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                      text=True, encoding='utf-8', errors='ignore',
+                                      startupinfo=startupinfo)
+        for ln in self._proc.stdout:
+            if self._stop.is_set():
+                return
+            yield ln
+
+    def _run(self):
+        set_foreground_watched(self.key, True)
+        try:
+            for line in self._lines():
+                comp = parse_resume_line(line)
+                if comp:
+                    publish_foreground(self.key, comp)
+        except Exception as e:
+            _wk_log(self.wk, f"ActivityWatcher lỗi: {e}")
+        finally:
+            set_foreground_watched(self.key, False)
+        if not self._stop.is_set():
+            _wk_log(self.wk, "ActivityWatcher dừng (mất logcat), quay về probe theo chu kỳ.")
+
+
+def start_activity_watch(wk) -> ActivityWatcher:
+    stop_activity_watch(wk)
+    w = ActivityWatcher(wk)
+    w.start()
+    wk._activity_watcher = w
+    return w
+
+
+def stop_activity_watch(wk):
+    w = getattr(wk, "_activity_watcher", None)
+    if w is not None:
+        wk._activity_watcher = None
+        w.stop()
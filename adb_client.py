@@ -0,0 +1,540 @@
+# adb_client.py
+# ==========================================================
+#  Client ADB thuần Python: nói chuyện trực tiếp với adb server (tcp:5037)
+#  theo giao thức host của ADB thay vì spawn adb.exe cho mỗi lệnh.
+#  Hỗ trợ: host:devices, host:transport, shell: (v2 nếu thiết bị hỗ trợ),
+#  exec:, sync: push/pull, forward / killforward, get-state.
+#  Dùng thay thế trực tiếp wk.adb(*args) / wk.adb_bin(*args):
+#  native_adb(serial, args) trả None nếu lệnh không hỗ trợ / server không kết nối được
+#  → người gọi quay về subprocess như cũ.
+#  Thread có gắn CancelToken (cancel_token.bind): mọi socket mở ra được token theo dõi,
+#  huỷ → đóng socket ngay (lệnh đang chờ thiết bị trả về thoát liền thay vì đợi hết timeout).
+# ==========================================================
+from __future__ import annotations
+
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+from typing import Optional, Sequence
+
+from cancel_token import CANCELLED_CODE, current_token
+
+# Có thể đổi qua biến môi trường giống adb chính chủ
+ADB_SERVER_HOST = os.environ.get("ANDROID_ADB_SERVER_ADDRESS", "127.0.0.1")
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037") or 5037)
+# Tắt nhanh client native (quay về adb.exe) nếu cần
+USE_NATIVE_ADB = os.environ.get("BBT_NATIVE_ADB", "1") != "0"
+# Số socket đã gắn sẵn transport giữ ấm cho mỗi thiết bị
+POOL_WARM_PER_DEVICE = 2
+# Socket ấm giữ quá lâu có thể đã chết (máy ảo khởi động lại) → bỏ
+POOL_MAX_IDLE = 30.0
+# Server không kết nối được → tạm bỏ qua native trong khoảng này (giây)
+SERVER_RETRY_AFTER = 10.0
+
+_SYNC_CHUNK = 64 * 1024
+
+# shell v2: id gói tin
+_V2_STDOUT = 1
+_V2_STDERR = 2
+_V2_EXIT = 3
+
+
+class AdbError(Exception):
+    """Server/thiết bị trả FAIL hoặc giao thức sai."""
+
+
+class AdbUnavailable(AdbError):
+    """Không kết nối được adb server."""
+
+
+class AdbConnectionLost(AdbError):
+    """Kết nối bị đóng giữa chừng (socket đã chết phía server)."""
+
+
+# ================== KẾT NỐI CẤP THẤP ==================
+def _track(sock: socket.socket) -> socket.socket:
+    tok = current_token()
+    return tok.track(sock) if tok is not None else sock
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise AdbConnectionLost("kết nối bị đóng giữa chừng")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_all(sock: socket.socket) -> bytes:
+    parts = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def _send_request(sock: socket.socket, req: str):
+    data = req.encode("utf-8")
+    sock.sendall(b"%04x" % len(data) + data)
+
+
+def _read_hex_block(sock: socket.socket) -> bytes:
+    n = int(_recv_exact(sock, 4), 16)
+    return _recv_exact(sock, n) if n else b""
+
+
+def _read_status(sock: socket.socket):
+    st = _recv_exact(sock, 4)
+    if st == b"OKAY":
+        return
+    if st == b"FAIL":
+        raise AdbError(_read_hex_block(sock).decode("utf-8", "ignore"))
+    raise AdbError(f"phản hồi lạ: {st!r}")
+
+
+class AdbClient:
+    """Kết nối tới adb server; mỗi dịch vụ (shell/exec/sync) dùng 1 socket riêng như adb chuẩn."""
+
+    def __init__(self, host: str = ADB_SERVER_HOST, port: int = ADB_SERVER_PORT, timeout: float = 8.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._pools: dict[str, _DevicePool] = {}
+        self._pools_lock = threading.Lock()
+        self._features: dict[str, set[str]] = {}
+        self._down_until = 0.0
+
+    # ---------- socket ----------
+    def _connect(self, timeout: Optional[float] = None) -> socket.socket:
+        if time.monotonic() < self._down_until:
+            raise AdbUnavailable("adb server chưa sẵn sàng")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=timeout or self.timeout)
+        except OSError as e:
+            self._down_until = time.monotonic() + SERVER_RETRY_AFTER
+            raise AdbUnavailable(str(e)) from e
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return _track(sock)
+
+    def _transport_socket(self, serial: str, service: str, timeout: Optional[float] = None) -> socket.socket:
+        """
+        Socket đã gắn vào thiết bị (host:transport:<serial>) và đã mở `service` (đọc xong OKAY),
+        ưu tiên lấy từ pool. Socket ấm có thể đã bị adb server bỏ (máy ảo khởi động lại, adb reconnect)
+        → hỏng khi gửi yêu cầu thì thử lại 1 lần trên socket mới; FAIL / timeout thì báo lỗi luôn.
+        """
+        sock = self._pool(serial).take()
+        if sock is not None:
+            sock.settimeout(timeout or self.timeout)
+            _track(sock)
+            try:
+                _send_request(sock, service)
+                _read_status(sock)
+                return sock
+            except socket.timeout:
+                sock.close()
+                raise
+            except (OSError, AdbConnectionLost):
+                sock.close()  # socket ấm đã chết → mở socket mới bên dưới
+            except Exception:
+                sock.close()
+                raise
+        sock = self._bind_transport(serial, timeout)
+        try:
+            _send_request(sock, service)
+            _read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _bind_transport(self, serial: str, timeout: Optional[float] = None) -> socket.socket:
+        sock = self._connect(timeout)
+        try:
+            _send_request(sock, f"host:transport:{serial}")
+            _read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _pool(self, serial: str) -> "_DevicePool":
+        with self._pools_lock:
+            pool = self._pools.get(serial)
+            if pool is None:
+                pool = self._pools[serial] = _DevicePool(self, serial)
+            return pool
+
+    def close(self):
+        with self._pools_lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for p in pools:
+            p.close()
+
+    # ---------- host:* ----------
+    def host_query(self, req: str, timeout: Optional[float] = None) -> str:
+        """Yêu cầu host trả về 1 khối có độ dài (host:devices, host-serial:x:get-state, ...)."""
+        sock = self._connect(timeout)
+        try:
+            _send_request(sock, req)
+            _read_status(sock)
+            return _read_hex_block(sock).decode("utf-8", "ignore")
+        finally:
+            sock.close()
+
+    def host_command(self, req: str, timeout: Optional[float] = None, double_status: bool = False):
+        """Yêu cầu host chỉ trả OKAY/FAIL (forward, killforward, ...)."""
+        sock = self._connect(timeout)
+        try:
+            _send_request(sock, req)
+            _read_status(sock)
+            if double_status:
+                # forward trả thêm 1 trạng thái sau khi thiết bị xác nhận
+                sock.settimeout(1.0)
+                try:
+                    _read_status(sock)
+                except socket.timeout:
+                    pass
+        finally:
+            sock.close()
+
+    def version(self) -> int:
+        return int(self.host_query("host:version"), 16)
+
+    def devices(self) -> list[tuple[str, str]]:
+        out = self.host_query("host:devices")
+        res = []
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                res.append((parts[0], parts[1]))
+        return res
+
+    def get_state(self, serial: str) -> str:
+        return self.host_query(f"host-serial:{serial}:get-state").strip()
+
+    def features(self, serial: str) -> set[str]:
+        feats = self._features.get(serial)
+        if feats is None:
+            try:
+                feats = set(self.host_query(f"host-serial:{serial}:features").strip().split(","))
+            except AdbUnavailable:
+                raise
+            except AdbError as e:
+                if "not found" in str(e) or "offline" in str(e):
+                    return set()  # thiết bị chưa gắn → không nhớ, lần sau hỏi lại (có thể hỗ trợ shell_v2)
+                feats = set()
+            self._features[serial] = feats
+        return feats
+
+    def track_devices(self, on_change, stop: threading.Event, poll: float = 1.0):
+        """
+        Giữ stream host:track-devices: server đẩy danh sách mới mỗi khi có thiết bị
+        cắm/rút/đổi trạng thái → gọi on_change({serial: state}). Lần đầu luôn nhận danh sách đầy đủ.
+        Trả về khi stop được set; ném AdbError/AdbUnavailable khi mất kết nối.
+        """
+        sock = self._connect()
+        try:
+            _send_request(sock, "host:track-devices")
+            _read_status(sock)
+            sock.settimeout(poll)
+            buf = b""
+            while not stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise AdbError("adb server đóng stream track-devices")
+                buf += chunk
+                while len(buf) >= 4:
+                    n = int(buf[:4], 16)
+                    if len(buf) < 4 + n:
+                        break
+                    body, buf = buf[4:4 + n].decode("utf-8", "ignore"), buf[4 + n:]
+                    states = {}
+                    for line in body.splitlines():
+                        parts = line.split()
+                        if len(parts) >= 2:
+                            states[parts[0]] = parts[1]
+                    on_change(states)
+        finally:
+            sock.close()
+
+    def forward(self, serial: str, local: str, remote: str):
+        self.host_command(f"host-serial:{serial}:forward:{local};{remote}", double_status=True)
+
+    def killforward(self, serial: str, local: str):
+        self.host_command(f"host-serial:{serial}:killforward:{local}")
+
+    def killforward_all(self, serial: str):
+        self.host_command(f"host-serial:{serial}:killforward-all")
+
+    # ---------- dịch vụ trên thiết bị ----------
+    def shell(self, serial: str, cmd: str, timeout: Optional[float] = None) -> tuple[int, bytes, bytes]:
+        """Chạy lệnh shell. Trả (exit_code, stdout, stderr)."""
+        if "shell_v2" in self.features(serial):
+            sock = self._transport_socket(serial, f"shell,v2,raw:{cmd}", timeout)
+            try:
+                return self._read_shell_v2(sock)
+            finally:
+                sock.close()
+        # adbd cũ: không có exit code → gắn sentinel để lấy $?
+        tag = b"__ADBRC__"
+        sock = self._transport_socket(serial, f"shell:{cmd};echo {tag.decode()}$?", timeout)
+        try:
+            out = _recv_all(sock)
+        finally:
+            sock.close()
+        pos = out.rfind(tag)
+        if pos < 0:
+            return 0, out, b""
+        try:
+            code = int(out[pos + len(tag):].strip() or b"0")
+        except ValueError:
+            code = 0
+        return code, out[:pos], b""
+
+    @staticmethod
+    def _read_shell_v2(sock: socket.socket) -> tuple[int, bytes, bytes]:
+        out, err, code = bytearray(), bytearray(), 0
+        while True:
+            head = sock.recv(5)
+            if not head:
+                break
+            if len(head) < 5:
+                head += _recv_exact(sock, 5 - len(head))
+            pid, n = struct.unpack("<BI", head)
+            data = _recv_exact(sock, n) if n else b""
+            if pid == _V2_STDOUT:
+                out += data
+            elif pid == _V2_STDERR:
+                err += data
+            elif pid == _V2_EXIT:
+                code = data[0] if data else 0
+                break
+        return code, bytes(out), bytes(err)
+
+    def shell_stream(self, serial: str, cmd: str, read_timeout: Optional[float] = None) -> socket.socket:
+        """
+        Mở lệnh shell chạy lâu (logcat ...) và trả socket để đọc dần stdout; người gọi tự đóng.
+        Luồng có thể im lặng rất lâu → bỏ timeout của client sau khi mở; read_timeout: chờ mỗi recv (None = chờ mãi).
+        """
+        sock = self._transport_socket(serial, f"shell:{cmd}")
+        sock.settimeout(read_timeout)
+        return sock
+
+    def exec_out(self, serial: str, cmd: str, timeout: Optional[float] = None) -> bytes:
+        """exec: — stdout nhị phân nguyên vẹn (không qua pty), dùng cho screencap thô."""
+        sock = self._transport_socket(serial, f"exec:{cmd}", timeout)
+        try:
+            return _recv_all(sock)
+        finally:
+            sock.close()
+
+    def _sync_socket(self, serial: str, timeout: Optional[float]) -> socket.socket:
+        return self._transport_socket(serial, "sync:", timeout)
+
+    def push(self, serial: str, local: str, remote: str, mode: Optional[int] = None,
+             timeout: Optional[float] = None):
+        if mode is None:
+            mode = stat.S_IMODE(os.stat(local).st_mode) or 0o644
+        sock = self._sync_socket(serial, timeout)
+        try:
+            spec = f"{remote},{0o100000 | mode}".encode("utf-8")
+            sock.sendall(b"SEND" + struct.pack("<I", len(spec)) + spec)
+            with open(local, "rb") as f:
+                while True:
+                    chunk = f.read(_SYNC_CHUNK)
+                    if not chunk:
+                        break
+                    sock.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+            sock.sendall(b"DONE" + struct.pack("<I", int(os.path.getmtime(local))))
+            head = _recv_exact(sock, 8)
+            if head[:4] == b"FAIL":
+                n = struct.unpack("<I", head[4:])[0]
+                raise AdbError(_recv_exact(sock, n).decode("utf-8", "ignore"))
+            if head[:4] != b"OKAY":
+                raise AdbError(f"push: phản hồi lạ {head[:4]!r}")
+            sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        finally:
+            sock.close()
+
+    def pull(self, serial: str, remote: str, local: str, timeout: Optional[float] = None):
+        sock = self._sync_socket(serial, timeout)
+        tmp = f"{local}.part"
+        try:
+            path = remote.encode("utf-8")
+            sock.sendall(b"RECV" + struct.pack("<I", len(path)) + path)
+            with open(tmp, "wb") as f:
+                while True:
+                    head = _recv_exact(sock, 8)
+                    tag, n = head[:4], struct.unpack("<I", head[4:])[0]
+                    if tag == b"DATA":
+                        f.write(_recv_exact(sock, n))
+                    elif tag == b"DONE":
+                        break
+                    elif tag == b"FAIL":
+                        raise AdbError(_recv_exact(sock, n).decode("utf-8", "ignore"))
+                    else:
+                        raise AdbError(f"pull: phản hồi lạ {tag!r}")
+            os.replace(tmp, local)
+            sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        finally:
+            sock.close()
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+
+class _DevicePool:
+    """
+    Giữ sẵn vài socket đã qua bước host:transport cho 1 thiết bị → lệnh tiếp theo bỏ được
+    1 vòng connect + transport. Mỗi socket chỉ dùng cho 1 dịch vụ (giao thức ADB), lấy ra
+    là tiêu thụ; pool được nạp lại ở thread nền.
+    """
+
+    def __init__(self, client: AdbClient, serial: str, warm: int = POOL_WARM_PER_DEVICE):
+        self.client = client
+        self.serial = serial
+        self.warm = warm
+        self._idle: list[tuple[socket.socket, float]] = []
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._closed = False
+
+    def take(self) -> Optional[socket.socket]:
+        now = time.monotonic()
+        sock, stale = None, []
+        with self._lock:
+            while self._idle:
+                s, t = self._idle.pop()
+                if now - t <= POOL_MAX_IDLE:
+                    sock = s
+                    break
+                stale.append(s)
+        for s in stale:
+            s.close()
+        self._refill_async()
+        return sock
+
+    def _refill_async(self):
+        with self._lock:
+            if self._refilling or self._closed or len(self._idle) >= self.warm:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name=f"AdbPool-{self.serial}", daemon=True).start()
+
+    def _refill(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._idle) >= self.warm:
+                        return
+                try:
+                    sock = self.client._bind_transport(self.serial)
+                except Exception:
+                    return
+                with self._lock:
+                    if self._closed:
+                        sock.close()
+                        return
+                    self._idle.append((sock, time.monotonic()))
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for s, _ in idle:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+
+# ================== DROP-IN CHO wk.adb / wk.adb_bin ==================
+_CLIENT: Optional[AdbClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> AdbClient:
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = AdbClient()
+        return _CLIENT
+
+
+def _decode(b: bytes) -> str:
+    # giống subprocess text=True (universal newlines)
+    return b.decode("utf-8", "ignore").replace("\r\n", "\n") if b else ""
+
+
+def native_adb(serial: Optional[str], args: Sequence[str], timeout: float = 8, text: bool = True):
+    """
+    Thực thi `adb [-s serial] <args>` qua giao thức host. Trả (code, out, err) giống subprocess
+    (str nếu text=True, bytes nếu không); trả None nếu lệnh chưa hỗ trợ hoặc không nối được server
+    để người gọi chạy adb.exe như cũ.
+    """
+    if not USE_NATIVE_ADB or not args:
+        return None
+    args = [str(a) for a in args]
+    cmd, rest = args[0], args[1:]
+    tok = current_token()
+    if tok is not None:
+        if tok.cancelled:
+            return (CANCELLED_CODE, "", "cancelled") if text else (CANCELLED_CODE, b"", b"cancelled")
+        timeout = tok.clamp(timeout)
+    cli = get_client()
+    try:
+        if cmd == "devices" and serial is None and not rest:
+            lines = "".join(f"{s}\t{st}\n" for s, st in cli.devices())
+            out = f"List of devices attached\n{lines}\n"
+            return (0, out, "") if text else (0, out.encode(), b"")
+        if serial is None:
+            return None
+        if cmd == "shell" and rest:
+            code, out, err = cli.shell(serial, " ".join(rest), timeout=timeout)
+        elif cmd == "exec-out" and rest:
+            code, out, err = 0, cli.exec_out(serial, " ".join(rest), timeout=timeout), b""
+        elif cmd == "push" and len(rest) == 2:
+            cli.push(serial, rest[0], rest[1], timeout=timeout)
+            code, out, err = 0, b"", b""
+        elif cmd == "pull" and len(rest) == 2:
+            cli.pull(serial, rest[0], rest[1], timeout=timeout)
+            code, out, err = 0, b"", b""
+        elif cmd == "forward" and rest == ["--remove-all"]:
+            cli.killforward_all(serial)
+            code, out, err = 0, b"", b""
+        elif cmd == "forward" and len(rest) == 2 and rest[0] == "--remove":
+            cli.killforward(serial, rest[1])
+            code, out, err = 0, b"", b""
+        elif cmd == "forward" and len(rest) == 2 and not rest[0].startswith("-"):
+            cli.forward(serial, rest[0], rest[1])
+            code, out, err = 0, b"", b""
+        elif cmd == "get-state" and not rest:
+            code, out, err = 0, cli.get_state(serial).encode() + b"\n", b""
+        else:
+            return None
+    except AdbUnavailable:
+        return None
+    except socket.timeout:
+        return (124, "", "timeout") if text else (124, b"", b"timeout")
+    except (AdbError, OSError) as e:
+        if tok is not None and tok.stopped:
+            return (CANCELLED_CODE, "", "cancelled") if text else (CANCELLED_CODE, b"", b"cancelled")
+        return (1, "", str(e)) if text else (1, b"", str(e).encode())
+    if text:
+        return code, _decode(out), _decode(err)
+    return code, out, err
@@ -0,0 +1,200 @@
+# cancel_token.py
+# ==========================================================
+#  Huỷ + hạn chót cho 1 worker (wk._cancel), thay cho cờ wk._abort + poll 0.2s / 1s:
+#   - sleep(): chờ trên Event → bấm Dừng là thức dậy ngay, runner rảnh không tốn CPU
+#   - deadline(): ngân sách thời gian cho cả 1 flow; hết hạn → aborted(wk) True tới khi ra khỏi khối
+#   - track(): đăng ký tiến trình adb (Popen) / socket adb đang chạy → cancel() giết ngay,
+#     không phải chờ hết timeout 6–10s của lệnh đang treo
+#   - bind(): gắn token vào thread hiện tại → adb_client / run_process tự lấy (current_token())
+# ==========================================================
+from __future__ import annotations
+
+import socket
+import subprocess
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+# Mã trả về khi lệnh bị huỷ giữa chừng (giống 124 = timeout)
+CANCELLED_CODE = 130
+
+
+class CancelToken:
+    """Event huỷ + chồng hạn chót (monotonic) + tập tài nguyên đang chạy cần giết khi huỷ. An toàn đa luồng."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._deadlines: List[float] = []
+        self._live: "weakref.WeakSet" = weakref.WeakSet()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason = ""
+        self.killed = 0          # số tiến trình/socket đã giết khi huỷ
+        self.expired_flows = 0   # số flow bị cắt vì hết ngân sách
+
+    # ---------- huỷ ----------
+    def cancel(self, reason: str = ""):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            live, self._live = list(self._live), weakref.WeakSet()
+            callbacks = list(self._callbacks)
+        for obj in live:
+            if _kill(obj):
+                self.killed += 1
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+    def on_cancel(self, fn: Callable[[], None]):
+        """fn() được gọi (1 lần) khi cancel — dùng để đánh thức chỗ đang chờ Condition riêng."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    @property
+    def stopped(self) -> bool:
+        """Đã bị huỷ hẳn (không tính hết hạn chót)."""
+        return self._event.is_set()
+
+    # ---------- hạn chót ----------
+    def remaining(self) -> Optional[float]:
+        """Số giây còn lại của hạn chót gần nhất; None nếu không có hạn chót."""
+        with self._lock:
+            if not self._deadlines:
+                return None
+            return self._deadlines[-1] - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        left = self.remaining()
+        return left is not None and left <= 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or self.expired
+
+    def clamp(self, timeout: float) -> float:
+        """Rút timeout của 1 lệnh cho không vượt hạn chót (tối thiểu 0.05s để lệnh còn cơ hội trả lỗi gọn)."""
+        left = self.remaining()
+        if left is None:
+            return timeout
+        return max(0.05, min(timeout, left))
+
+    @contextmanager
+    def deadline(self, secs: Optional[float]):
+        """Khối có ngân sách `secs` giây (lồng nhau → lấy hạn sớm hơn). secs=None → không giới hạn thêm."""
+        if secs is None:
+            yield self
+            return
+        with self._lock:
+            end = time.monotonic() + float(secs)
+            if self._deadlines:
+                end = min(end, self._deadlines[-1])
+            self._deadlines.append(end)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._deadlines.pop()
+            if end <= time.monotonic() and not self._event.is_set():
+                self.expired_flows += 1
+
+    # ---------- chờ ----------
+    def sleep(self, secs: float) -> bool:
+        """Ngủ `secs` giây; False nếu bị huỷ / chạm hạn chót trước khi ngủ đủ."""
+        left = self.remaining()
+        if left is not None and left < secs:
+            self._event.wait(max(0.0, left))
+            return False
+        return not self._event.wait(max(0.0, secs))
+
+    # ---------- tài nguyên đang chạy ----------
+    def track(self, obj):
+        """Đăng ký Popen/socket đang chạy; token đã huỷ → giết ngay. Trả lại obj (giữ tham chiếu yếu)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._live.add(obj)
+                return obj
+        if _kill(obj):
+            self.killed += 1
+        return obj
+
+    def describe(self) -> str:
+        return (f"Huỷ: {'có' if self.stopped else 'không'}{f' ({self.reason})' if self.reason else ''}, "
+                f"{self.killed} lệnh đang chạy bị giết, {self.expired_flows} flow hết ngân sách thời gian")
+
+
+def _kill(obj) -> bool:
+    try:
+        if isinstance(obj, subprocess.Popen):
+            if obj.poll() is None:
+                obj.kill()
+                return True
+            return False
+        if isinstance(obj, socket.socket):
+            if obj.fileno() < 0:
+                return False
+            try:
+                obj.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            obj.close()
+            return True
+    except Exception:
+        pass
+    return False
+
+
+# ---------- token theo thread ----------
+_LOCAL = threading.local()
+
+
+def current_token() -> Optional[CancelToken]:
+    return getattr(_LOCAL, "token", None)
+
+
+@contextmanager
+def bind(token: Optional[CancelToken]):
+    """Gắn token cho thread hiện tại trong khối with (adb_client / run_process dùng current_token())."""
+    prev = getattr(_LOCAL, "token", None)
+    _LOCAL.token = token
+    try:
+        yield token
+    finally:
+        _LOCAL.token = prev
+
+
+def run_process(args, timeout: float, token: Optional[CancelToken] = None, **popen_kwargs):
+    """
+    Như subprocess.run(capture_output=True) nhưng tiến trình được token theo dõi: cancel() giết ngay,
+    timeout bị rút theo hạn chót. Trả (returncode, stdout, stderr); hết giờ → ném TimeoutExpired như cũ,
+    bị huỷ → (CANCELLED_CODE, rỗng, "cancelled").
+    """
+    token = token or current_token()
+    text = bool(popen_kwargs.get("text") or popen_kwargs.get("encoding"))
+    empty = "" if text else b""
+    if token is not None:
+        if token.cancelled:
+            return CANCELLED_CODE, empty, "cancelled" if text else b"cancelled"
+        timeout = token.clamp(timeout)
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    if token is not None:
+        token.track(proc)
+    try:
+        out, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    if token is not None and token.stopped and proc.returncode != 0:
+        return CANCELLED_CODE, out or empty, "cancelled" if text else b"cancelled"
+    return proc.returncode, out or empty, err or empty
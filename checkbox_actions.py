@@ -5,6 +5,7 @@ from __future__ import annotations
 import os
 import time
 import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
@@ -21,6 +22,13 @@ from flows_thoat_lien_minh import run_guild_leave_flow
 from flows_xay_dung_lien_minh import run_guild_build_flow
 from flows_vien_chinh import run_guild_expedition_flow
 from flows_chuc_phuc import run_bless_flow
+from frame_source import start_frame_pump, stop_frame_pump
+from input_channel import InputChannel
+from adb_client import native_adb
+from activity_watcher import start_activity_watch, stop_activity_watch
+from module import calibrate_screen, foreground_component, release_ocr_thread, state_simple
+from account_scheduler import DueQueue, get_account_scheduler
+from cancel_token import CancelToken, bind, run_process
 from ui_auth import CloudClient
 from utils_crypto import decrypt
 
@@ -149,21 +157,55 @@ def _expe_cooldown_passed(last_expe_str: str | None, hours: int = 12) -> bool:
     return (datetime.now() - last_expe_dt) >= timedelta(hours=hours)
 
 
-def _scan_eligible_accounts(accounts_selected: List[Dict], features: dict) -> List[Dict]:
-    eligible = []
-    today = _today_str_for_build()
-    for rec in accounts_selected:
-        build_date = rec.get('last_build_date', '')
-        last_leave = rec.get('last_leave_time', '')
-        last_expe = rec.get('last_expedition_time', '')
-        want_build = features.get("build", False)
-        want_expe = features.get("expedition", False)
-        cool_ok = _leave_cooldown_passed(last_leave)
-        build_due = want_build and (build_date != today)
-        expe_due = want_expe and _expe_cooldown_passed(last_expe)
-        if (build_due and cool_ok) or (expe_due and cool_ok):
-            eligible.append(rec)
-    return eligible
+# Chu kỳ các việc (khớp _leave_cooldown_passed / _expe_cooldown_passed)
+LEAVE_COOLDOWN = timedelta(minutes=61)
+EXPE_COOLDOWN = timedelta(hours=12)
+IDLE_RECHECK_SECS = 3600  # không có mốc nào → vẫn làm mới từ server sau chừng này (thay đổi từ máy/người khác)
+_BLESS_KEY = "*bless*"    # mục chung của DueQueue cho kế hoạch Chúc phúc
+# Ngân sách thời gian (s) cho từng flow của 1 tài khoản: quá hạn → aborted(wk) → flow tự thoát, sang bước sau
+FLOW_BUDGETS = dict(login=240, bless=420, join=240, build=300, expedition=420, leave=300)
+
+
+def _next_midnight(now: datetime) -> datetime:
+    return datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+
+
+def _account_due(rec: Dict, features: dict, now: datetime) -> Optional[datetime]:
+    """
+    Mốc sớm nhất tài khoản có việc build (mỗi ngày) / viễn chinh (12h), đã tính cooldown rời LM (61').
+    <= now ⇔ đủ điều kiện như cách quét cũ; None nếu không bật việc nào.
+    """
+    dues = []
+    if features.get("build"):
+        dues.append(now if rec.get('last_build_date', '') != _today_str_for_build() else _next_midnight(now))
+    if features.get("expedition"):
+        last_expe = _parse_datetime_str(rec.get('last_expedition_time'))
+        dues.append(last_expe + EXPE_COOLDOWN if last_expe else now)
+    if not dues:
+        return None
+    due = min(dues)
+    last_leave = _parse_datetime_str(rec.get('last_leave_time'))
+    if last_leave:
+        due = max(due, last_leave + LEAVE_COOLDOWN)
+    return due
+
+
+def _bless_due(config: Dict, targets: List[Dict], now: datetime) -> Optional[datetime]:
+    """Mốc sớm nhất có mục tiêu Chúc phúc đến lượt (cùng điều kiện với _plan_online_blessings)."""
+    per_run = config.get('per_run', 0)
+    if per_run <= 0 or not targets:
+        return None
+    cooldown = timedelta(hours=config.get('cooldown_hours', 0))
+    due = _next_midnight(now)  # đủ lượt hôm nay → sang ngày mới
+    for target in targets:
+        count = len(target.get('blessed_today_by', []))
+        if count >= per_run:
+            continue
+        last_run_dt = _parse_datetime_str(target.get('last_blessed_run_at'))
+        if not last_run_dt or count > 0:
+            return now
+        due = min(due, last_run_dt + cooldown)
+    return due
 
 
 # ====== Wrapper ADB cho flows_* (Đã sửa lỗi) ======
@@ -175,20 +217,25 @@ class SimpleNoxWorker:
         self.game_package = GAME_PKG;
         self.game_activity = GAME_ACT;
         self._log_cb = log_cb
+        self._input: Optional[InputChannel] = None
+        self._input_retry_at = 0.0
 
     def _log(self, s: str):
         self._log_cb(f"{s}")
 
     def _run(self, args: List[str], timeout=8, text=True):
         import subprocess
+        res = native_adb(self._serial, args, timeout=timeout, text=True)
+        if res is not None:
+            return res
         try:
             startupinfo = None
             if os.name == 'nt':
                 startupinfo = subprocess.STARTUPINFO()
                 startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            p = subprocess.run([self._adb, "-s", self._serial, *args], capture_output=True, text=text, timeout=timeout,
+            # run_process: token huỷ của thread (runner) giết được adb.exe đang treo
+            return run_process([self._adb, "-s", self._serial, *args], timeout, text=text,
                                startupinfo=startupinfo, encoding='utf-8', errors='ignore')
-            return p.returncode, p.stdout or "", p.stderr or ""
         except subprocess.TimeoutExpired:
             return 124, "", "timeout"
         except Exception as e:
@@ -196,14 +243,15 @@ class SimpleNoxWorker:
 
     def _run_raw(self, args: List[str], timeout=8):
         import subprocess
+        res = native_adb(self._serial, args, timeout=timeout, text=False)
+        if res is not None:
+            return res
         try:
             startupinfo = None
             if os.name == 'nt':
                 startupinfo = subprocess.STARTUPINFO()
                 startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            p = subprocess.run([self._adb, "-s", self._serial, *args], capture_output=True, timeout=timeout,
-                               startupinfo=startupinfo)
-            return p.returncode, p.stdout, p.stderr
+            return run_process([self._adb, "-s", self._serial, *args], timeout, startupinfo=startupinfo)
         except subprocess.TimeoutExpired:
             return 124, b"", b"timeout"
         except Exception as e:
@@ -215,12 +263,36 @@ class SimpleNoxWorker:
     def adb_bin(self, *args, timeout=8):
         return self._run_raw(list(args), timeout=timeout)
 
+    def start_capture(self):
+        """Chọn backend chụp màn hình cho thiết bị và bật thread chụp nền (grab_screen_np trả frame mới nhất)."""
+        start_frame_pump(self)
+
+    def stop_capture(self):
+        stop_frame_pump(self)
+
+    def input_channel(self) -> Optional[InputChannel]:
+        """Kênh `adb shell` bền cho tap/swipe/keyevent (mở lười; lỗi thì 30s sau mới thử lại)."""
+        ch = self._input
+        if ch is not None and ch.is_open():
+            return ch
+        if time.time() < self._input_retry_at:
+            return None
+        if ch is None:
+            ch = self._input = InputChannel(self._adb, self._serial, self._log)
+        if ch.open():
+            return ch
+        self._input_retry_at = time.time() + 30
+        return None
+
+    def close_input(self):
+        ch, self._input = self._input, None
+        if ch is not None:
+            if ch.sent:
+                self._log(ch.describe())
+            ch.close()
+
     def app_in_foreground(self, pkg: str) -> bool:
-        code, out, _ = self.adb("shell", "cmd", "activity", "get-foreground-activity", timeout=6)
-        if code == 0 and out and "ComponentInfo{" in out:
-            comp = out.split("ComponentInfo{", 1)[1].split("}", 1)[0]
-            return pkg in comp
-        return False
+        return pkg in foreground_component(self)
 
     def start_app(self, package: str, activity: Optional[str] = None) -> bool:
         if activity:
@@ -260,18 +332,31 @@ class AccountRunner(QObject, threading.Thread):
                                   log_cb=lambda s: _ui_log(ctrl, device_id, s))  # Sửa: truyền device_id
         self.stop_evt = threading.Event()
         setattr(self.wk, "_abort", False)
+        # Huỷ + hạn chót cho mọi flow trên worker: sleep chờ Event, lệnh adb đang chạy bị giết khi Dừng
+        self.cancel = CancelToken()
+        self.wk._cancel = self.cancel
+        # Hàng đợi dùng chung mọi thiết bị: mỗi tài khoản chỉ 1 máy chạy tại 1 thời điểm
+        self.scheduler = get_account_scheduler()
+        self._started_at = time.monotonic()
 
     def request_stop(self):
         self.stop_evt.set();
         self._stop.set();
         setattr(self.wk, "_abort", True)
+        self.cancel.cancel("dừng theo yêu cầu")
+        self.scheduler.wake()
 
     def _sleep_coop(self, secs: float):
-        end_time = time.time() + secs
-        while time.time() < end_time:
-            if self.stop_evt.is_set() or self._stop.is_set(): return False
-            time.sleep(min(1.0, end_time - time.time()))
-        return True
+        return self.cancel.sleep(secs)
+
+    @contextmanager
+    def _budget(self, flow: str):
+        """Chạy 1 flow trong ngân sách FLOW_BUDGETS[flow]; hết hạn → flow thấy aborted(wk) và tự thoát."""
+        secs = FLOW_BUDGETS.get(flow)
+        with self.cancel.deadline(secs):
+            yield
+            if self.cancel.expired and not self.cancel.stopped:
+                self.log(f"⏰ Flow {flow} vượt ngân sách {secs}s → dừng flow, chuyển bước sau.")
 
     def log(self, s: str):
         if s != self._last_log: self._last_log = s; _ui_log(self.ctrl, self.device_id, s)
@@ -284,150 +369,241 @@ class AccountRunner(QObject, threading.Thread):
             autoleave=self.ctrl.w.chk_auto_leave.isChecked(),
         )
 
+    def _lease_alive(self) -> bool:
+        # Gia hạn lease khi runner còn chạy VÀ thiết bị còn nhận input gần đây (máy treo → lease tự hết hạn)
+        last = max(getattr(self.wk, "_last_input_ts", None) or 0.0, self._started_at)
+        return not self._stop.is_set() and time.monotonic() - last < self.scheduler.ttl
+
+    def _process_account(self, rec: Dict, features: Dict[str, bool], bless_plan: Dict[str, List[Dict]],
+                         emails_for_build_expe: set) -> bool:
+        """
+        Gom mọi việc đến hạn (chúc phúc / build / viễn chinh / rời LM) của 1 tài khoản vào 1 phiên.
+        Máy đang đăng nhập sẵn đúng tài khoản này (và game còn ở màn chơi) → bỏ qua logout/login;
+        xong việc thì GIỮ phiên, tài khoản khác tới lượt mới logout. False = dừng runner.
+        """
+        account_id = rec.get('id')
+        email = rec.get('game_email', '')
+
+        if self.scheduler.in_session(self.device_id, rec) and state_simple(self.wk) == "gametw":
+            self.scheduler.note_login(avoided=True)
+            self.log(f"♻️ Đang đăng nhập sẵn {email} → bỏ qua logout/login.")
+        elif not self._login(rec):
+            return not self._stop.is_set()
+
+        did_build = False;
+        did_expe = False
+
+        # Chạy Chúc phúc NẾU tài khoản này có trong kế hoạch
+        if email in bless_plan:
+            targets_to_bless_info = bless_plan[email]
+            target_names = [t['name'] for t in targets_to_bless_info]
+            self.log(f"Tài khoản {email} có nhiệm vụ Chúc phúc cho: {', '.join(target_names)}")
+
+            with self._budget("bless"):
+                blessed_ok_names = run_bless_flow(self.wk, target_names, log=self.log)
+
+            if blessed_ok_names:
+                for name in blessed_ok_names:
+                    for target_info in targets_to_bless_info:
+                        if target_info['name'] == name:
+                            try:
+                                self.cloud.record_blessing(target_info['id'], account_id)
+                                self.log(f"📝 [API] Đã ghi lại lịch sử Chúc phúc cho '{name}'.")
+                            except Exception as e:
+                                self.log(f"⚠️ [API] Lỗi ghi lịch sử Chúc phúc: {e}")
+                            break
+
+        # Chạy Build/Expedition NẾU tài khoản này có trong danh sách eligible
+        if email in emails_for_build_expe:
+            if (features.get("build") or features.get("expedition")) and _leave_cooldown_passed(
+                    rec.get('last_leave_time')):
+                with self._budget("join"):
+                    join_guild_once(self.wk, log=self.log)
+
+            if features.get("build") and rec.get('last_build_date') != _today_str_for_build():
+                with self._budget("build"):
+                    did_build = ensure_guild_inside(self.wk, log=self.log) and run_guild_build_flow(self.wk,
+                                                                                                  log=self.log)
+                if did_build:
+                    self.cloud.update_game_account(account_id, {'last_build_date': _today_str_for_build()})
+                    self.log(f"📝 [API] Cập nhật ngày xây dựng.")
+
+            if features.get("expedition") and _expe_cooldown_passed(rec.get('last_expedition_time')):
+                with self._budget("expedition"):
+                    did_expe = ensure_guild_inside(self.wk, log=self.log) and run_guild_expedition_flow(self.wk,
+                                                                                                      log=self.log)
+                if did_expe:
+                    self.cloud.update_game_account(account_id, {'last_expedition_time': _now_dt_str_for_api()})
+                    self.log(f"📝 [API] Cập nhật mốc viễn chinh.")
+
+        if features.get("autoleave") and (did_build or did_expe):
+            with self._budget("leave"):
+                ok_leave = run_guild_leave_flow(self.wk, log=self.log)
+            if ok_leave:
+                self.cloud.update_game_account(account_id, {'last_leave_time': _now_dt_str_for_api()})
+                self.log(f"📝 [API] Cập nhật mốc rời liên minh.")
+
+        return True
+
+    def _login(self, rec: Dict) -> bool:
+        """Logout phiên hiện tại rồi đăng nhập `rec`; thành công → ghi phiên của máy vào scheduler."""
+        email = rec.get('game_email', '')
+        server = str(rec.get('server', ''))
+        try:
+            password = decrypt(rec.get('game_password', ''), self.user_login_email)
+        except Exception as e:
+            self.log(f"⚠️ Lỗi giải mã mật khẩu cho {email}. Bỏ qua. Lỗi: {e}")
+            self._sleep_coop(10)
+            return False
+
+        self.scheduler.set_session(self.device_id, None)  # từ đây không chắc máy đang ở tài khoản nào
+        with self._budget("login"):
+            if not logout_once(self.wk, max_rounds=7):
+                self.log(f"Logout thất bại, sẽ thử lại ở vòng lặp sau.")
+                return False
+
+            if not login_once(self.wk, email, password, server, ""):
+                self.log(f"Login thất bại cho {email}.")
+                return False
+        self.scheduler.set_session(self.device_id, rec)
+        self.scheduler.note_login(avoided=False)
+        return True
+
     def run(self):
-        self.log("Bắt đầu vòng lặp auto liên tục.")
+        # Gắn token huỷ cho thread runner: lệnh adb (native/subprocess) của mọi flow bị giết ngay khi Dừng
+        with bind(self.cancel):
+            self._loop()
+
+        released = self.scheduler.release_device(self.device_id)
+        self.scheduler.set_session(self.device_id, None)  # dừng rồi không còn theo dõi máy → lần sau đăng nhập lại
+        if released:
+            self.log(f"Trả lại hàng đợi: {', '.join(released)}")
+        self.wk.stop_capture()
+        stop_activity_watch(self.wk)
+        self.wk.close_input()
+        release_ocr_thread()  # mỗi runner giữ PyTessBaseAPI riêng → trả lại khi dừng/khởi động lại
+        self.log(self.scheduler.describe())
+        self.log(self.cancel.describe())
+        self.log("Vòng lặp auto đã dừng theo yêu cầu.")
+        self.finished_run.emit()
 
+    def _loop(self):
+        self.log("Bắt đầu vòng lặp auto liên tục.")
+        # Đo độ phân giải 1 lần → REG_*/tap theo 900x1600 tự đổi ra pixel thật của máy
+        calibrate_screen(self.wk, force=True)
+        # Chọn nguồn chụp màn hình (minicap/raw/file) cho thiết bị này một lần khi bắt đầu + bật chụp nền
+        self.wk.start_capture()
+        # Theo dõi activity foreground qua logcat events → wait_state chờ sự kiện thay vì poll dumpsys
+        start_activity_watch(self.wk)
+
+        dues = DueQueue()  # mốc đến hạn theo id tài khoản (+ mục chung Chúc phúc)
+        bless_config, bless_targets = {}, []
+        used_features = None
+        seen_gen = self.scheduler.generation
+        refresh = True
         while not self._stop.is_set():
             try:
-                # Bước 1: Cập nhật lại danh sách tài khoản từ server
-                # Thao tác này đảm bảo mỗi vòng lặp đều có dữ liệu mới nhất
-                try:
-                    self.log("Đang làm mới danh sách tài khoản từ server...")
-                    # Lấy danh sách ID của các tài khoản đã chọn ban đầu
-                    selected_ids = {acc.get('id') for acc in self.master_account_list}
-                    # Tải lại toàn bộ danh sách từ server và chỉ giữ lại những tài khoản đã chọn
-                    all_accounts_fresh = self.cloud.get_game_accounts()
-                    self.master_account_list = [acc for acc in all_accounts_fresh if acc.get('id') in selected_ids]
-                except Exception as e:
-                    self.log(f"Lỗi làm mới danh sách tài khoản: {e}. Tạm nghỉ 1 phút.")
-                    if not self._sleep_coop(60): break
-                    continue
-
-                # Bước 2: Lập kế hoạch độc lập
                 features = self._get_features()
+                if features != used_features:
+                    refresh = True
+                if refresh:
+                    # Bước 1: Cập nhật lại danh sách tài khoản từ server (chỉ khi có thay đổi / vừa tới hạn)
+                    try:
+                        self.log("Đang làm mới danh sách tài khoản từ server...")
+                        # Lấy danh sách ID của các tài khoản đã chọn ban đầu
+                        selected_ids = {acc.get('id') for acc in self.master_account_list}
+                        # Tải lại toàn bộ danh sách từ server và chỉ giữ lại những tài khoản đã chọn
+                        all_accounts_fresh = self.cloud.get_game_accounts()
+                        self.master_account_list = [acc for acc in all_accounts_fresh if acc.get('id') in selected_ids]
+                    except Exception as e:
+                        self.log(f"Lỗi làm mới danh sách tài khoản: {e}. Tạm nghỉ 1 phút.")
+                        if not self._sleep_coop(60): break
+                        continue
+
+                    # Bước 2: Tính mốc đến hạn của từng tài khoản (build/viễn chinh/cooldown rời LM) + Chúc phúc
+                    now = datetime.now()
+                    dues.clear()
+                    for acc in self.master_account_list:
+                        due = _account_due(acc, features, now)
+                        dues.set(acc.get('id'), due.timestamp() if due else None)
+                    if features.get("bless"):
+                        try:
+                            bless_config = self.cloud.get_blessing_config()
+                            bless_targets = self.cloud.get_blessing_targets()
+                            due = _bless_due(bless_config, bless_targets, now)
+                            dues.set(_BLESS_KEY, due.timestamp() if due else None)
+                        except Exception as e:
+                            self.log(f"Lỗi tải dữ liệu Chúc phúc: {e}")
+                    used_features = features
+                    refresh = False
+
+                # Chưa có gì đến hạn → ngủ đúng tới mốc sớm nhất, hoặc tới khi danh sách tài khoản đổi
+                nxt = dues.peek()
+                now_ts = time.time()
+                if nxt is None or nxt[0] > now_ts:
+                    wait = min(nxt[0] - now_ts, IDLE_RECHECK_SECS) if nxt else IDLE_RECHECK_SECS
+                    self.log(f"Không có tài khoản nào đủ điều kiện chạy. Chờ tới "
+                             f"{datetime.fromtimestamp(now_ts + wait):%H:%M:%S} ({wait / 60:.1f} phút) "
+                             f"hoặc tới khi danh sách tài khoản thay đổi...")
+                    seen_gen = self.scheduler.wait_changed(seen_gen, wait + 1.0, self._stop)
+                    refresh = True
+                    continue
 
-                # 2.1 Lập kế hoạch cho Build/Expedition
-                eligible_for_build_expe = _scan_eligible_accounts(self.master_account_list, features)
-                emails_for_build_expe = {acc.get('game_email') for acc in eligible_for_build_expe}
-
-                # 2.2 Lập kế hoạch cho Chúc phúc
+                # Bước 3: Lấy các tài khoản đã đến hạn + lập kế hoạch Chúc phúc nếu tới lượt
+                emails_for_build_expe = {acc.get('game_email') for acc in self.master_account_list
+                                         if dues.is_due(acc.get('id'), now_ts)}
                 bless_plan = {}
-                if features.get("bless"):
+                if features.get("bless") and dues.is_due(_BLESS_KEY, now_ts):
                     self.log("Đang lập kế hoạch Chúc phúc từ dữ liệu server...")
-                    try:
-                        bless_config = self.cloud.get_blessing_config()
-                        bless_targets = self.cloud.get_blessing_targets()
-                        # Ưu tiên các tài khoản đã có nhiệm vụ build/expe
-                        priority_emails = list(emails_for_build_expe)
-                        bless_plan = _plan_online_blessings(self.master_account_list, bless_config, bless_targets,
-                                                            priority_emails)
-                        if bless_plan:
-                            self.log(f"Đã lập kế hoạch Chúc phúc cho {len(bless_plan)} tài khoản.")
-                    except Exception as e:
-                        self.log(f"Lỗi lập kế hoạch Chúc phúc: {e}")
+                    # Ưu tiên các tài khoản đã có nhiệm vụ build/expe
+                    bless_plan = _plan_online_blessings(self.master_account_list, bless_config, bless_targets,
+                                                        list(emails_for_build_expe))
+                    if bless_plan:
+                        self.log(f"Đã lập kế hoạch Chúc phúc cho {len(bless_plan)} tài khoản.")
+                    else:
+                        dues.set(_BLESS_KEY, None)  # không còn tài khoản nào chúc được → chờ lần làm mới sau
 
-                # Bước 3: Tổng hợp danh sách và kiểm tra
                 emails_for_bless = set(bless_plan.keys())
                 all_emails_to_run = emails_for_build_expe.union(emails_for_bless)
-
                 if not all_emails_to_run:
-                    self.log("Không có tài khoản nào đủ điều kiện chạy. Tạm nghỉ 1 giờ...")
-                    if not self._sleep_coop(3600): break
                     continue
 
                 # Bước 4: Tạo danh sách cuối cùng để chạy và chọn tài khoản tiếp theo
                 accounts_to_run_this_loop = [acc for acc in self.master_account_list if
                                              acc.get('game_email') in all_emails_to_run]
 
-                # Ưu tiên tài khoản có cả 2 nhiệm vụ
-                rec = None
-                for acc in accounts_to_run_this_loop:
-                    if acc.get('game_email') in emails_for_build_expe and acc.get('game_email') in emails_for_bless:
-                        rec = acc
-                        break
-                if not rec:
-                    rec = accounts_to_run_this_loop[0]  # Nếu không, lấy tài khoản đầu tiên
+                # Ưu tiên tài khoản có cả 2 nhiệm vụ; tài khoản máy khác đang giữ (lease) thì bỏ qua
+                both = [acc for acc in accounts_to_run_this_loop
+                        if acc.get('game_email') in emails_for_build_expe and acc.get('game_email') in emails_for_bless]
+                ordered = both + [acc for acc in accounts_to_run_this_loop if acc not in both]
+                # Tài khoản máy đang đăng nhập sẵn lên đầu → khỏi logout/login
+                current = self.scheduler.session_key(self.device_id)
+                ordered.sort(key=lambda acc: self.scheduler.key_of(acc) != current)
+                rec = self.scheduler.acquire(self.device_id, ordered)
+                if rec is None:
+                    self.log(f"{len(accounts_to_run_this_loop)} tài khoản có nhiệm vụ đều đang chạy trên máy khác. "
+                             f"Chờ máy khác xong (tối đa 1 phút)...")
+                    seen_gen = self.scheduler.wait_changed(seen_gen, 60, self._stop)
+                    refresh = True
+                    continue
 
                 self.log(
                     f"Tổng hợp: {len(accounts_to_run_this_loop)} tài khoản có nhiệm vụ. Bắt đầu xử lý: {rec.get('game_email')}")
 
-                # --- Thực thi tác vụ cho 1 tài khoản ---
-                account_id = rec.get('id')
-                email = rec.get('game_email', '')
-                encrypted_password = rec.get('game_password', '')
-                server = str(rec.get('server', ''))
-
-                try:
-                    password = decrypt(encrypted_password, self.user_login_email)
-                except Exception as e:
-                    self.log(f"⚠️ Lỗi giải mã mật khẩu cho {email}. Bỏ qua. Lỗi: {e}")
-                    if not self._sleep_coop(10): break
-                    continue
-
-                if not logout_once(self.wk, max_rounds=7):
-                    self.log(f"Logout thất bại, sẽ thử lại ở vòng lặp sau.");
-                    continue
-
-                ok_login = login_once(self.wk, email, password, server, "")
-                if not ok_login:
-                    self.log(f"Login thất bại cho {email}.");
-                    continue
-
-                did_build = False;
-                did_expe = False
-
-                # Chạy Chúc phúc NẾU tài khoản này có trong kế hoạch
-                if email in bless_plan:
-                    targets_to_bless_info = bless_plan[email]
-                    target_names = [t['name'] for t in targets_to_bless_info]
-                    self.log(f"Tài khoản {email} có nhiệm vụ Chúc phúc cho: {', '.join(target_names)}")
-
-                    blessed_ok_names = run_bless_flow(self.wk, target_names, log=self.log)
-
-                    if blessed_ok_names:
-                        for name in blessed_ok_names:
-                            for target_info in targets_to_bless_info:
-                                if target_info['name'] == name:
-                                    try:
-                                        self.cloud.record_blessing(target_info['id'], account_id)
-                                        self.log(f"📝 [API] Đã ghi lại lịch sử Chúc phúc cho '{name}'.")
-                                    except Exception as e:
-                                        self.log(f"⚠️ [API] Lỗi ghi lịch sử Chúc phúc: {e}")
-                                    break
-
-                # Chạy Build/Expedition NẾU tài khoản này có trong danh sách eligible
-                if email in emails_for_build_expe:
-                    if (features.get("build") or features.get("expedition")) and _leave_cooldown_passed(
-                            rec.get('last_leave_time')):
-                        join_guild_once(self.wk, log=self.log)
-
-                    if features.get("build") and rec.get('last_build_date') != _today_str_for_build():
-                        if ensure_guild_inside(self.wk, log=self.log) and run_guild_build_flow(self.wk, log=self.log):
-                            did_build = True
-                            self.cloud.update_game_account(account_id, {'last_build_date': _today_str_for_build()})
-                            self.log(f"📝 [API] Cập nhật ngày xây dựng.")
-
-                    if features.get("expedition") and _expe_cooldown_passed(rec.get('last_expedition_time')):
-                        if ensure_guild_inside(self.wk, log=self.log) and run_guild_expedition_flow(self.wk,
-                                                                                                    log=self.log):
-                            did_expe = True
-                            self.cloud.update_game_account(account_id, {'last_expedition_time': _now_dt_str_for_api()})
-                            self.log(f"📝 [API] Cập nhật mốc viễn chinh.")
-
-                if features.get("autoleave") and (did_build or did_expe):
-                    if run_guild_leave_flow(self.wk, log=self.log):
-                        self.cloud.update_game_account(account_id, {'last_leave_time': _now_dt_str_for_api()})
-                        self.log(f"📝 [API] Cập nhật mốc rời liên minh.")
-
-                logout_once(self.wk, max_rounds=7)
+                # --- Thực thi tác vụ cho 1 tài khoản (giữ lease suốt phiên, xong thì trả) ---
+                with self.scheduler.keep_alive(self.device_id, rec, alive=self._lease_alive):
+                    if not self._process_account(rec, features, bless_plan, emails_for_build_expe):
+                        break
+                # dữ liệu tài khoản vừa đổi → làm mới mốc, báo các runner khác
+                refresh = True
+                self.scheduler.notify_changed()
+                seen_gen = self.scheduler.generation
 
             except Exception as e:
                 self.log(f"Lỗi nghiêm trọng trong vòng lặp: {e}. Tạm nghỉ 5 phút.")
+                refresh = True
                 if not self._sleep_coop(300): break
 
-        self.log("Vòng lặp auto đã dừng theo yêu cầu.")
-        self.finished_run.emit()
-
     def _auto_stop_and_uncheck(self):
         row = _table_row_for_device_id(self.ctrl, self.device_id)
         if row >= 0: _set_checkbox_state_silent(self.ctrl, row, False)
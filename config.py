@@ -22,7 +22,7 @@ EMULATOR_TYPE = "BOTH"
 ADB_PATH = PLATFORM_TOOLS_ADB_PATH
 DEVICE = ""
 
-# ==== Screen size (Android) ====
+# ==== Screen size (Android) — màn THAM CHIẾU; máy khác độ phân giải tự đổi theo `wm size` (screen_space.py) ====
 SCREEN_W, SCREEN_H = 900, 1600
 
 # ==== Tesseract ====
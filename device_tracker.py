@@ -0,0 +1,83 @@
+# device_tracker.py
+# ==========================================================
+#  Theo dõi thiết bị theo SỰ KIỆN: giữ stream `host:track-devices` với adb server,
+#  mỗi lần có máy ảo cắm/rút/đổi trạng thái thì bắn signal cho AppController.
+#  Không còn phải chạy `adb devices` theo chu kỳ trên thread GUI.
+#  Mất kết nối adb server → tạm quét `adb devices` (thread nền) rồi nối lại stream.
+# ==========================================================
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from PySide6.QtCore import QObject, Signal
+
+from adb_client import AdbError, get_client
+from ui_main import emulator_label, is_emulator_serial, list_adb_ports_with_status
+
+# Mất stream → quét dự phòng rồi thử nối lại sau khoảng này (giây)
+TRACK_RETRY_AFTER = 5.0
+
+
+class DeviceTracker(QObject):
+    """
+    Phát signal khi danh sách thiết bị thay đổi (an toàn gọi sang thread GUI: Qt tự queue).
+    Trạng thái giống cột "status" của `adb devices`: device / offline / unauthorized ...
+    """
+    deviceAdded = Signal(str, str)         # device_id, "Tên - trạng thái"
+    deviceRemoved = Signal(str)            # device_id
+    deviceStateChanged = Signal(str, str)  # device_id, trạng thái mới
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._known: dict[str, str] = {}   # device_id -> "Tên - trạng thái"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="DeviceTracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=3.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                get_client().track_devices(self._on_states, self._stop)
+            except (AdbError, OSError) as e:
+                print(f"[DeviceTracker] Mất stream track-devices: {e}. Quét dự phòng…")
+                try:
+                    # spawn adb.exe cũng giúp khởi động lại adb server nếu nó đã tắt
+                    self._apply(list_adb_ports_with_status())
+                except Exception as e2:
+                    print(f"[DeviceTracker] Quét dự phòng lỗi: {e2}")
+                self._stop.wait(TRACK_RETRY_AFTER)
+
+    def _on_states(self, states: dict[str, str]):
+        adb_map = {}
+        for did, st in states.items():
+            if not is_emulator_serial(did):
+                continue
+            name = self._known.get(did, "").split(" - ")[0] or emulator_label(did)
+            adb_map[did] = f"{name} - {st}"
+        self._apply(adb_map)
+
+    def _apply(self, adb_map: dict[str, str]):
+        """So sánh với danh sách cũ rồi bắn signal cho phần thay đổi."""
+        old = self._known
+        self._known = dict(adb_map)
+        for did in sorted(adb_map):
+            full = adb_map[did]
+            if did not in old:
+                self.deviceAdded.emit(did, full)
+            elif old[did] != full:
+                self.deviceStateChanged.emit(did, full.split(' - ')[-1])
+        for did in sorted(set(old) - set(adb_map)):
+            self.deviceRemoved.emit(did)
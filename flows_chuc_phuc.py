@@ -2,7 +2,8 @@
 """
 flows_chuc_phuc.py
 Flow chúc phúc: chỉ dùng phương án 2 (fallback) lặp đến khi thấy bảng xếp hạng.
-Vuốt chậm (dur_ms tăng), delay 1.5s sau các thao tác tap/gesture, OCR bỏ dấu + non-alnum.
+Vuốt chậm (dur_ms tăng), sau mỗi tap/gesture chờ theo điều kiện trên frame (nút kế tiếp hiện / màn đứng yên,
+tối đa bằng độ trễ cố định cũ 1.0–1.5s), OCR bỏ dấu + non-alnum.
 """
 
 from __future__ import annotations
@@ -13,8 +14,9 @@ import unicodedata
 import re
 
 from module import (
-    grab_screen_np, find_on_frame, tap, tap_center, swipe,
-    sleep_coop, free_img, adb_safe, ocr_region,
+    grab_screen_np, find_on_frame, find_many_on_frame, tap, tap_center, swipe,
+    sleep_coop, free_img, adb_safe, ocr_regions, get_ocr_cache,
+    wait_until, tpl_visible, screen_settled, tap_and_settle, aborted,
     log_wk as _log,resource_path,
 )
 
@@ -31,6 +33,7 @@ REG_GUILD_OUT = (581, 1485, 758, 1600)
 REG_RANK = (578, 38, 826, 130)
 REG_BTN_RANK = (6, 678, 280, 811)
 REG_BTN_SERVER = (478, 1431, 696, 1538)
+REG_OCR_LIST = (250, 190, 800, 1200)   # vùng 7 ô tên (chờ hết cuộn trước khi OCR)
 
 # ---------------- OCR slots và toạ độ tap ----------------
 # (region, (tap1_x,tap1_y), (tap2_x,tap2_y))
@@ -95,11 +98,21 @@ def _key_back(wk):
     # Android BACK keycode = 4 (ESC)
     adb_safe(wk, "shell", "input", "keyevent", "4", timeout=3)
 
+def _icons_on(img) -> bool:
+    """Điều kiện trên frame: thấy cả nut-menu & lien-minh-outside (dùng cho wait_until, không log)."""
+    (ok1, _, _), (ok2, _, _) = find_many_on_frame(img, [
+        (IMG_MENU, REG_MENU, THR_MENU),
+        (IMG_GUILD_OUT, REG_GUILD_OUT, THR_GUILD),
+    ])
+    return ok1 and ok2
+
 def _both_icons_present(wk) -> bool:
     img = grab_screen_np(wk)
     try:
-        ok1, pos1, _ = find_on_frame(img, IMG_MENU, region=REG_MENU, threshold=THR_MENU)
-        ok2, pos2, _ = find_on_frame(img, IMG_GUILD_OUT, region=REG_GUILD_OUT, threshold=THR_GUILD)
+        (ok1, pos1, _), (ok2, pos2, _) = find_many_on_frame(img, [
+            (IMG_MENU, REG_MENU, THR_MENU),
+            (IMG_GUILD_OUT, REG_GUILD_OUT, THR_GUILD),
+        ])
         L(wk, f"Check icons → menu: {ok1} pos={pos1} | guild: {ok2} pos={pos2}")
         return ok1 and ok2
     finally:
@@ -110,9 +123,9 @@ def _open_ranking_loop(wk) -> bool:
     """
     Chỉ dùng phương án 2, lặp đến khi thấy bang-xep-hang:
       - Chờ thấy cả nut-menu & lien-minh-outside
-      - bấm nut-menu (ưu tiên theo template; nếu không → tọa độ fallback) → đợi 1.5s
-      - tìm & bấm nut-xep-hang (REG_BTN_RANK) → đợi 1.5s
-      - tìm & bấm lien-server (REG_BTN_SERVER) → đợi 1.5s
+      - bấm nut-menu (ưu tiên theo template; nếu không → tọa độ fallback) → chờ nut-xep-hang (≤1.5s)
+      - bấm nut-xep-hang (REG_BTN_RANK) → chờ lien-server (≤1.5s)
+      - bấm lien-server (REG_BTN_SERVER) → chờ bang-xep-hang (≤1.5s)
       - kiểm tra bang-xep-hang (REG_RANK)
     """
     L(wk, "Open ranking (phương án 2) bắt đầu…")
@@ -123,7 +136,8 @@ def _open_ranking_loop(wk) -> bool:
         t0 = time.time()
         while not _both_icons_present(wk):
             _key_back(wk)
-            if not sleep_coop(wk, 1.0):
+            wait_until(wk, _icons_on, 1.0, label="BACK → cặp icon", baseline=1.0)
+            if aborted(wk):
                 return False
             if time.time() - t0 > WAIT_PAIR_ICONS_SEC:
                 L(wk, "Hết thời gian chờ cặp icon — thử lại.")
@@ -139,31 +153,27 @@ def _open_ranking_loop(wk) -> bool:
             tap(wk, *posm); L(wk, f"Tap MENU tại {posm}")
         else:
             tap(wk, 30, 630); L(wk, "Tap MENU fallback (30,630)")
-        if not sleep_coop(wk, 1.5):  # đợi sau tap
-            return False
 
-        # bấm nut-xep-hang
-        img = grab_screen_np(wk)
-        try:
-            ok, pos, _ = find_on_frame(img, IMG_BTN_RANK, region=REG_BTN_RANK, threshold=THR_BTN)
-            L(wk, f"Find BTN_RANK → ok={ok} pos={pos}")
-        finally:
-            free_img(img)
-        if ok and pos:
+        # bấm nut-xep-hang (chờ nút hiện & đứng yên thay vì ngủ 1.5s)
+        pos = wait_until(wk, tpl_visible(IMG_BTN_RANK, REG_BTN_RANK, THR_BTN, stable=True), 1.5,
+                         region=REG_BTN_RANK, label="MENU → nút xếp hạng", baseline=1.5)
+        if aborted(wk):
+            return False
+        L(wk, f"Find BTN_RANK → ok={pos is not None} pos={pos}")
+        if pos:
             tap(wk, *pos); L(wk, f"Tap 'xếp hạng' tại {pos}")
-            if not sleep_coop(wk, 1.5):  # đợi sau tap
-                return False
 
             # bấm lien-server
-            img = grab_screen_np(wk)
-            try:
-                oks, poss, _ = find_on_frame(img, IMG_BTN_SERVER, region=REG_BTN_SERVER, threshold=THR_BTN)
-                L(wk, f"Find BTN_SERVER → ok={oks} pos={poss}")
-            finally:
-                free_img(img)
-            if oks and poss:
+            poss = wait_until(wk, tpl_visible(IMG_BTN_SERVER, REG_BTN_SERVER, THR_BTN, stable=True), 1.5,
+                              region=REG_BTN_SERVER, label="Xếp hạng → liên server", baseline=1.5)
+            if aborted(wk):
+                return False
+            L(wk, f"Find BTN_SERVER → ok={poss is not None} pos={poss}")
+            if poss:
                 tap(wk, *poss); L(wk, f"Tap 'liên server' tại {poss}")
-                if not sleep_coop(wk, 1.5):  # đợi sau tap
+                wait_until(wk, tpl_visible(IMG_RANK, REG_RANK, THR_RANK), 1.5,
+                           region=REG_RANK, label="Liên server → bảng xếp hạng", baseline=1.5)
+                if aborted(wk):
                     return False
         else:
             L(wk, "Không thấy nút 'xếp hạng' trong REG_BTN_RANK — lặp lại.")
@@ -195,9 +205,9 @@ def _match_target(txt: str, targets_norm: List[str]) -> Optional[str]:
 
 def _ocr_page_and_bless(wk, targets: List[str]) -> List[str]:
     """
-    OCR 7 vùng, nếu tên có trong targets thì nhấn 3 điểm và trả về DANH SÁCH TÊN GỐC đã chúc.
+    OCR 7 vùng (1 lần nhận dạng gộp), nếu tên có trong targets thì nhấn 3 điểm và trả về DANH SÁCH TÊN GỐC đã chúc.
     - So khớp theo dạng đã chuẩn hoá (bỏ dấu + bỏ ký tự không chữ/số) ở CẢ 2 phía.
-    - Tap 3 điểm: tap1 -> tap2 -> (366, 83) với delay 1.0s, 1.0s, 0.5s.
+    - Tap 3 điểm: tap1 -> tap2 -> (366, 83); sau mỗi tap chờ màn đổi & đứng yên (tối đa 1.0s, 1.0s, 0.5s).
     """
     done: List[str] = []
     if not targets:
@@ -208,50 +218,53 @@ def _ocr_page_and_bless(wk, targets: List[str]) -> List[str]:
     loc_norm = [_normalize_name(x) for x in loc_targets]
     L(wk, f"OCR page — targets còn lại: {targets} (norm={loc_norm})")
 
+    # 1 frame, 1 lần OCR cho cả 7 ô (ghép ROI) → so khớp hết rồi mới tap
     img_full = grab_screen_np(wk)
     try:
-        for idx, (reg, tap1, tap2) in enumerate(OCR_SLOTS, start=1):
-            x1, y1, x2, y2 = reg
-            try:
-                txt = ocr_region(img_full, x1, y1, x2, y2, lang="vie", psm=6)
-            except Exception as e:
-                L(wk, f"OCR slot#{idx} reg={reg} → LỖI OCR: {e}")
-                txt = ""
-            txt_show = (txt or "").replace("\n", " ").strip()
-            tnorm = _normalize_name(txt)
-            L(wk, f"OCR slot#{idx} reg={reg} → '{txt_show}' | norm='{tnorm}'")
-
-            # TÌM CHỈ SỐ trong loc_norm để lấy TÊN GỐC
-            found_idx = -1
-            for i, name_norm in enumerate(loc_norm):
-                if tnorm and (tnorm == name_norm or tnorm in name_norm or name_norm in tnorm):
-                    found_idx = i
-                    break
-
-            if found_idx < 0:
-                L(wk, f"Slot#{idx} → không khớp target nào.")
-                continue
-
-            orig_name = loc_targets[found_idx]   # <-- TÊN GỐC trả về
-            L(wk, f"Slot#{idx} → KHỚP: '{orig_name}' | Tap {tap1} → {tap2} → (366, 83)")
-
-            # TAP 3 ĐIỂM với delay yêu cầu
-            tap(wk, *tap1);           sleep_coop(wk, 1.0)
-            tap(wk, *tap2);           sleep_coop(wk, 1.0)
-            tap(wk, 366, 83);         sleep_coop(wk, 0.5)
-
-            done.append(orig_name)
-
-            # Loại mục đã khớp khỏi BẢN SAO CỤC BỘ để tránh nhấn trùng trong cùng trang
-            loc_targets.pop(found_idx)
-            loc_norm.pop(found_idx)
-
-            if not loc_norm:
-                L(wk, "Đã hoàn tất toàn bộ targets trên trang hiện tại.")
-                break
+        try:
+            results = ocr_regions(img_full, [reg for reg, _, _ in OCR_SLOTS], lang_preference="vie", psm=6)
+        except Exception as e:
+            L(wk, f"OCR page → LỖI OCR: {e}")
+            results = [("", 0.0)] * len(OCR_SLOTS)
     finally:
         free_img(img_full)
 
+    hits: List[Tuple[int, str, Tuple[int,int], Tuple[int,int]]] = []
+    for idx, ((reg, tap1, tap2), (txt, conf)) in enumerate(zip(OCR_SLOTS, results), start=1):
+        txt_show = (txt or "").replace("\n", " ").strip()
+        tnorm = _normalize_name(txt)
+        L(wk, f"OCR slot#{idx} reg={reg} → '{txt_show}' (conf={conf:.0f}) | norm='{tnorm}'")
+        if not loc_norm:
+            continue
+
+        # TÌM CHỈ SỐ trong loc_norm để lấy TÊN GỐC
+        found_idx = -1
+        for i, name_norm in enumerate(loc_norm):
+            if tnorm and (tnorm == name_norm or tnorm in name_norm or name_norm in tnorm):
+                found_idx = i
+                break
+
+        if found_idx < 0:
+            L(wk, f"Slot#{idx} → không khớp target nào.")
+            continue
+
+        orig_name = loc_targets[found_idx]   # <-- TÊN GỐC trả về
+        hits.append((idx, orig_name, tap1, tap2))
+        # Loại mục đã khớp khỏi BẢN SAO CỤC BỘ để tránh nhấn trùng trong cùng trang
+        loc_targets.pop(found_idx)
+        loc_norm.pop(found_idx)
+
+    for idx, orig_name, tap1, tap2 in hits:
+        L(wk, f"Slot#{idx} → KHỚP: '{orig_name}' | Tap {tap1} → {tap2} → (366, 83)")
+        # TAP 3 ĐIỂM, mỗi tap chờ UI phản hồi xong (tối đa bằng delay cũ)
+        tap_and_settle(wk, *tap1, timeout=1.0, label="Chúc phúc: mở hồ sơ")
+        tap_and_settle(wk, *tap2, timeout=1.0, label="Chúc phúc: bấm chúc")
+        tap_and_settle(wk, *TAP_THIRD, timeout=0.5, label="Chúc phúc: đóng")
+        done.append(orig_name)
+
+    if hits and not loc_norm:
+        L(wk, "Đã hoàn tất toàn bộ targets trên trang hiện tại.")
+
     L(wk, f"OCR page xong — matched (orig): {done}")
     return done
 
@@ -276,8 +289,10 @@ def run_bless_flow(wk, targets: List[str], log=None, max_scrolls: int = SCROLL_L
         L(wk, "Không thể mở bảng xếp hạng — kết thúc.")
         return []
 
-    # Chờ ổn định rồi OCR
-    if not sleep_coop(wk, 1.0):
+    # Chờ danh sách đứng yên rồi OCR
+    wait_until(wk, screen_settled(REG_OCR_LIST), 1.0, region=REG_OCR_LIST,
+               label="Bảng xếp hạng ổn định", baseline=1.0)
+    if aborted(wk):
         return []
 
     remaining = list(targets)
@@ -306,11 +321,18 @@ def run_bless_flow(wk, targets: List[str], log=None, max_scrolls: int = SCROLL_L
             L(wk, f"ĐÃ ĐỦ {max_scrolls} lần cuộn — dừng lại. Chưa xong: {remaining}")
             break
 
-        # Vuốt chậm & nghỉ 1.5s cho ổn định
+        # Vuốt chậm rồi chờ danh sách đổi trang & đứng yên (tối đa 1.5s)
         L(wk, f"Kéo trang chậm (dur_ms={SWIPE_DUR_MS}) — 446,1256 → 446,190")
+        ref = grab_screen_np(wk, region=REG_OCR_LIST)
         swipe(wk, 446, 1256, 446, 188, dur_ms=SWIPE_DUR_MS)
-        if not sleep_coop(wk, 1.5):
+        wait_until(wk, screen_settled(REG_OCR_LIST, ref=ref), 1.5, region=REG_OCR_LIST,
+                   label="Cuộn bảng xếp hạng", baseline=1.5)
+        free_img(ref)
+        if aborted(wk):
             break
 
     L(wk, f"KẾT THÚC flow chúc phúc — thành công: {blessed_ok} | chưa xong: {remaining}")
+    cache = get_ocr_cache()
+    L(wk, cache.describe())
+    cache.save()
     return blessed_ok
@@ -24,7 +24,10 @@ from module import (
     aborted as _aborted,
     grab_screen_np as _grab_screen_np,
     find_on_frame as _find_on_frame,
+    crop_frame as _crop_frame,
+    point_roi as _point_roi,
     DEFAULT_THR as THR_DEFAULT,
+    wait_until as _wait_until,
     free_img as _free_img,         # NEW: bổ sung trong module.py (xem patch bên dưới)
     mem_relief as _mem_relief,     # NEW: bổ sung trong module.py (xem patch bên dưới)
     resource_path
@@ -47,6 +50,9 @@ IMG_INSIDE    = resource_path("images/lien_minh/lien-minh-inside.png")
 # ================== PARAMS ==================
 ESC_DELAY     = 1.5
 CLICK_DELAY   = 0.5
+OPEN_WAIT     = 3.5    # chờ JOIN/INSIDE sau TAP outside (trước: 0.5s + 5 x 0.6s)
+# Giữ nguyên 15s giữa các lần xin vào: đó là chờ server (liên minh đầy / chờ duyệt), không phải chờ UI
+JOIN_RETRY_DELAY = 15.0
 
 # ---- ngưỡng màu (có thể tinh chỉnh theo log) ----
 # "xanh" (enable): hue ~ 35..85, S/V đủ cao
@@ -60,8 +66,7 @@ def _sleep(s: float):
 
 # ================== (ĐẶC THÙ) Kiểm tra màu enable/disable ==================
 def _crop_np(img, reg):
-    x1, y1, x2, y2 = reg
-    return img[y1:y2, x1:x2].copy()
+    return _crop_frame(img, reg, copy=True)
 
 def _classify_join_color(wk) -> str | None:
     """
@@ -79,9 +84,7 @@ def _classify_join_color(wk) -> str | None:
         roi = _crop_np(img, REG_JOIN_COLOR)
         if roi is None or roi.size == 0:
             # fallback: lấy 3x3 quanh điểm PT_JOIN_COLOR
-            x, y = PT_JOIN_COLOR
-            x1, y1, x2, y2 = max(0, x-1), max(0, y-1), x+2, y+2
-            roi = img[y1:y2, x1:x2]
+            roi = _point_roi(img, *PT_JOIN_COLOR)
 
         hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
         h = float(np.mean(hsv[...,0]))
@@ -107,10 +110,18 @@ def _classify_join_color(wk) -> str | None:
         return None
 
 # ------------------ Core: mở UI Liên minh ------------------
+def _join_or_inside(img) -> str | None:
+    """Điều kiện trên frame: 'join' nếu thấy nút Gia nhập, 'inside' nếu đã ở trong Liên minh."""
+    ok_join, _, _ = _find_on_frame(img, IMG_JOIN, region=REG_JOIN_BTN, threshold=THR_DEFAULT)
+    if ok_join:
+        return "join"
+    ok_in, _, _ = _find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
+    return "inside" if ok_in else None
+
 def _open_guild_ui(wk) -> str:
     """
     - Lặp: nếu chưa thấy OUTSIDE trong REG_OUTSIDE -> BACK + đợi -> thử lại
-    - Khi thấy -> ESC -> đợi 1s -> TAP outside -> kiểm tra JOIN/INSIDE tối đa 5 lần
+    - Khi thấy -> ESC -> đợi 1s -> TAP outside -> chờ JOIN/INSIDE trên từng frame mới (tối đa OPEN_WAIT)
       * 'join'   -> return "join"
       * 'inside' -> return "inside"
       * 'abort'  -> khi bị hủy
@@ -125,7 +136,7 @@ def _open_guild_ui(wk) -> str:
             if _aborted(wk):
                 _log(wk, "⛔ Hủy theo yêu cầu (open_guild_ui/inner).")
                 return "abort"
-            img = _grab_screen_np(wk)
+            img = _grab_screen_np(wk, region=REG_OUTSIDE)
             ok_out, _, _ = _find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE, threshold=THR_DEFAULT)
             _free_img(img)
             if ok_out:
@@ -140,31 +151,20 @@ def _open_guild_ui(wk) -> str:
         if not _sleep_coop(wk, 1.0):
             return "abort"
         _tap_center(wk, REG_OUTSIDE)
-        if not _sleep_coop(wk, CLICK_DELAY):
-            return "abort"
 
         # kiểm tra join/inside
-        tries = 0
-        while tries < 5:
-            if _aborted(wk):
-                _log(wk, "⛔ Hủy theo yêu cầu (wait join/inside).")
-                return "abort"
-            img_now = _grab_screen_np(wk)
-            ok_join, _, _ = _find_on_frame(img_now, IMG_JOIN, region=REG_JOIN_BTN, threshold=THR_DEFAULT)
-            if ok_join:
-                _free_img(img_now)
-                _log(wk, "🟩 Đã hiển thị nút 'Gia nhập liên minh'.")
-                return "join"
-            ok_in, _, _ = _find_on_frame(img_now, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
-            _free_img(img_now)
-            if ok_in:
-                _log(wk, "🟩 Đã ở giao diện Liên minh (inside).")
-                return "inside"
-            tries += 1
-            if not _sleep_coop(wk, 0.6):
-                return "abort"
+        state = _wait_until(wk, _join_or_inside, OPEN_WAIT, label="Mở giao diện Liên minh", baseline=OPEN_WAIT)
+        if _aborted(wk):
+            _log(wk, "⛔ Hủy theo yêu cầu (wait join/inside).")
+            return "abort"
+        if state == "join":
+            _log(wk, "🟩 Đã hiển thị nút 'Gia nhập liên minh'.")
+            return "join"
+        if state == "inside":
+            _log(wk, "🟩 Đã ở giao diện Liên minh (inside).")
+            return "inside"
 
-        _log(wk, "↩️ 5 lần chưa thấy 'Gia nhập'/'Inside' → quay lại bấm Outside.")
+        _log(wk, f"↩️ {OPEN_WAIT:.1f}s chưa thấy 'Gia nhập'/'Inside' → quay lại bấm Outside.")
 
 # ------------------ Public: gia nhập liên minh ------------------
 def join_guild_once(wk, log=print) -> bool:
@@ -200,7 +200,7 @@ def join_guild_once(wk, log=print) -> bool:
             _mem_relief()
             return False
 
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_JOIN_BTN)
         ok_join, pt, _ = _find_on_frame(img, IMG_JOIN, region=REG_JOIN_BTN, threshold=THR_DEFAULT)
         _free_img(img)
         if not ok_join or not pt:
@@ -223,7 +223,7 @@ def join_guild_once(wk, log=print) -> bool:
         if join_state == "full":
             _log(wk, "🚧 Nút xin vào đang XÁM (đã đủ người). ESC đóng giao diện, đợi 15s rồi thử lại…")
             _adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)  # ESC
-            if not _sleep_coop(wk, 15.0):
+            if not _sleep_coop(wk, JOIN_RETRY_DELAY):
                 _mem_relief()
                 return False
             # quay lại mở giao diện từ đầu
@@ -261,7 +261,7 @@ def join_guild_once(wk, log=print) -> bool:
 
         # Nếu quay lại vẫn là 'join' → có thể đang chờ duyệt: đợi rồi thử lại
         _log(wk, "🤔 Chưa xác nhận được — đợi 15s rồi thử lại.")
-        if not _sleep_coop(wk, 15.0):
+        if not _sleep_coop(wk, JOIN_RETRY_DELAY):
             _mem_relief()
             return False
 
@@ -277,7 +277,7 @@ def ensure_guild_inside(wk, log=print) -> bool:
             _mem_relief()
             return False
 
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_INSIDE)
         ok_in, _, _ = _find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
         _free_img(img)
         if ok_in:
@@ -285,7 +285,7 @@ def ensure_guild_inside(wk, log=print) -> bool:
             _mem_relief()
             return True
 
-        img2 = _grab_screen_np(wk)
+        img2 = _grab_screen_np(wk, region=REG_OUTSIDE)
         ok_out, _, _ = _find_on_frame(img2, IMG_OUTSIDE, region=REG_OUTSIDE, threshold=THR_DEFAULT)
         _free_img(img2)
         if not ok_out:
@@ -16,10 +16,16 @@ from module import (
     aborted as _aborted,
     grab_screen_np as _grab_screen_np,
     find_on_frame,
+    find_many_on_frame,
+    point_roi,
     DEFAULT_THR as _THR_DEFAULT,
     type_text as _type_text,
     back as _back,
     state_simple as _state_simple,
+    wait_until as _wait_until,
+    tpl_visible as _tpl_visible,
+    tpl_gone as _tpl_gone,
+    any_of as _any_of,
     free_img,resource_path
 )
 
@@ -60,9 +66,7 @@ def _is_pixel_gray(img: np.ndarray, x: int, y: int) -> tuple[bool, str]:
     if img is None:
         return False, "Không có ảnh"
     try:
-        y1, x1 = max(0, y - 1), max(0, x - 1)
-        y2, x2 = min(img.shape[0], y + 2), min(img.shape[1], x + 2)
-        roi = img[y1:y2, x1:x2]
+        roi = point_roi(img, x, y)
         hsv_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
         avg_saturation = np.mean(hsv_roi[:, :, 1])
         msg = f"Kiểm tra bảo trì tại ({x},{y}): Độ bão hòa màu = {avg_saturation:.1f}"
@@ -97,7 +101,7 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
     _pre_login_taps(wk)
     if _aborted(wk): return False
     # 1) Clear & nhập email
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_CLEAR_EMAIL_X)
     ok, pt, sc = find_on_frame(img, IMG_CLEAR_EMAIL_X, region=REG_CLEAR_EMAIL_X, threshold=0.86)
     free_img(img)
     if ok and pt:
@@ -109,7 +113,7 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
     if not _sleep_coop(wk, 0.2): return False
 
     # 2) Clear & nhập password
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_CLEAR_PASSWORD_X)
     ok, pt, sc = find_on_frame(img, IMG_CLEAR_PASSWORD_X, region=REG_CLEAR_PASSWORD_X, threshold=0.86)
     free_img(img)
     if ok and pt:
@@ -127,23 +131,29 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
     if _aborted(wk): return False
 
     # 4) Nhấn Login
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_LOGIN_BUTTON)
     ok, pt, sc = find_on_frame(img, IMG_LOGIN_BUTTON, region=REG_LOGIN_BUTTON, threshold=0.86)
     free_img(img)
     if ok and pt:
         _tap(wk, *pt)
     else:
         _tap_center(wk, REG_LOGIN_BUTTON)
-    if not _sleep_coop(wk, 1.0): return False
+    # Chờ màn kế (nút 'đã đăng nhập' / thông báo / xác nhận) thay vì ngủ cố định 1s
+    _wait_until(wk, _any_of(_tpl_visible(IMG_DA_DANG_NHAP, REG_DA_DANG_NHAP, 0.86),
+                            _tpl_visible(IMG_THONG_BAO, REG_THONG_BAO, 0.86),
+                            _tpl_visible(IMG_XAC_NHAN_DANG_NHAP, REG_XAC_NHAN_DANG_NHAP, 0.86)),
+                1.0, label="Login → màn vào game", baseline=1.0)
+    if _aborted(wk): return False
 
     # ===== 5) PHA "VÀO GAME" (LOGIC ĐÚNG) =====
     pressed_once = False
     phase_deadline = time.time() + 60
 
     def _both_buttons(img_now):
-        ok_da, _, sc_da = find_on_frame(img_now, IMG_DA_DANG_NHAP, region=REG_DA_DANG_NHAP, threshold=0.86)
-        ok_game, pt_game, sc_game = find_on_frame(img_now, IMG_GAME_LOGIN_BUTTON, region=REG_GAME_LOGIN_BUTTON,
-                                                  threshold=0.86)
+        (ok_da, _, sc_da), (ok_game, pt_game, sc_game) = find_many_on_frame(img_now, [
+            (IMG_DA_DANG_NHAP, REG_DA_DANG_NHAP, 0.86),
+            (IMG_GAME_LOGIN_BUTTON, REG_GAME_LOGIN_BUTTON, 0.86),
+        ])
         return ok_da, ok_game, pt_game
 
     while time.time() < phase_deadline:
@@ -166,7 +176,9 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
                 _tap(wk, *pt_game);
                 pressed_once = True
                 free_img(img);
-                if not _sleep_coop(wk, 2.0): return False
+                _wait_until(wk, _tpl_gone(IMG_GAME_LOGIN_BUTTON, REG_GAME_LOGIN_BUTTON, 0.86), 2.0,
+                            region=REG_GAME_LOGIN_BUTTON, label="Vào game → rời màn chọn", baseline=2.0)
+                if _aborted(wk): return False
                 continue
 
         # (LOGIC ĐẦY ĐỦ) Xử lý các popup khi 2 nút chính không có
@@ -175,14 +187,18 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
             if ok_tb:
                 _tap(wk, 443, 1300);
                 free_img(img)
-                if not _sleep_coop(wk, 1.5): return False
+                _wait_until(wk, _tpl_gone(IMG_THONG_BAO, REG_THONG_BAO, 0.86), 1.5,
+                            region=REG_THONG_BAO, label="Đóng thông báo", baseline=1.5)
+                if _aborted(wk): return False
                 continue
 
             ok_xn, pt_xn, _ = find_on_frame(img, IMG_XAC_NHAN_DANG_NHAP, region=REG_XAC_NHAN_DANG_NHAP, threshold=0.86)
             if ok_xn and pt_xn:
                 _tap(wk, *pt_xn);
                 free_img(img)
-                if not _sleep_coop(wk, 1.0): return False
+                _wait_until(wk, _tpl_gone(IMG_XAC_NHAN_DANG_NHAP, REG_XAC_NHAN_DANG_NHAP, 0.86), 1.0,
+                            region=REG_XAC_NHAN_DANG_NHAP, label="Xác nhận đăng nhập", baseline=1.0)
+                if _aborted(wk): return False
                 continue
 
             # Nếu đã từng bấm nút "Vào Game" thì thoát vòng lặp
@@ -193,17 +209,15 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
         free_img(img)
         if not _sleep_coop(wk, 0.5): return False
 
-    # ===== 6) Kiểm tra 'xác nhận offline' =====
-    for _ in range(5):
+    # ===== 6) Kiểm tra 'xác nhận offline' (tối đa ~2.5s như 5 nhịp x 0.5s cũ) =====
+    pt = _wait_until(wk, _tpl_visible(IMG_XAC_NHAN_OFFLINE, REG_XAC_NHAN_OFFLINE, 0.86, stable=True), 2.5,
+                     region=REG_XAC_NHAN_OFFLINE)
+    if _aborted(wk): return False
+    if pt:
+        _tap(wk, *pt)
+        _wait_until(wk, _tpl_gone(IMG_XAC_NHAN_OFFLINE, REG_XAC_NHAN_OFFLINE, 0.86), 1.0,
+                    region=REG_XAC_NHAN_OFFLINE, label="Xác nhận offline", baseline=1.0)
         if _aborted(wk): return False
-        img = _grab_screen_np(wk)
-        ok, pt, sc = find_on_frame(img, IMG_XAC_NHAN_OFFLINE, region=REG_XAC_NHAN_OFFLINE, threshold=0.86)
-        free_img(img)
-        if ok and pt:
-            _tap(wk, *pt)
-            if not _sleep_coop(wk, 1.0): return False
-            break
-        if not _sleep_coop(wk, 0.5): return False
 
     # ===== 7) Đợi vào game =====
     end = time.time() + 60
@@ -211,11 +225,12 @@ def login_once(wk, email: str, password: str, server: str = "", date: str = "")
         if _aborted(wk): return False
         st = _state_simple(wk, package_hint=GAME_PKG)
         if st == "gametw":
-            img = _grab_screen_np(wk)
-            ok, _, sc = find_on_frame(img, IMG_ICON_LIEN_MINH, region=REG_ICON_LIEN_MINH, threshold=0.86)
-            free_img(img)
-            if ok:
+            # đang ở activity game → chờ icon Liên minh trên frame (thấy là trả ngay, không đợi hết 1s)
+            if _wait_until(wk, _tpl_visible(IMG_ICON_LIEN_MINH, REG_ICON_LIEN_MINH, 0.86), 1.0,
+                           region=REG_ICON_LIEN_MINH):
                 return True
+            if _aborted(wk): return False
+            continue
         if not _sleep_coop(wk, 1.0): return False
 
     return False
\ No newline at end of file
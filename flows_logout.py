@@ -16,7 +16,11 @@ from module import (
     pt_in_region,
     esc_soft_clear,
     is_green_pixel,
-    wait_state,resource_path
+    wait_state,
+    wait_until,
+    tpl_visible,
+    any_of,
+    tap_and_settle,resource_path
 )
 
 USE_CV = True  # cần opencv-python
@@ -60,7 +64,7 @@ def _grace_check_need_login(wk, secs: float = 2.0) -> bool:
 # ================= ĐẶC THÙ FLOW =================
 def _try_click_da_dang_nhap(wk) -> bool:
     log(wk, "Tìm nút 'ĐÃ ĐĂNG NHẬP'…")
-    img = grab_screen_np(wk)
+    img = grab_screen_np(wk, region=REG_DA_DANG_NHAP)
     ok, pt, sc = find_on_frame(img, IMG_DA_DANG_NHAP, region=REG_DA_DANG_NHAP, threshold=0.85)
     free_img(img)
     log(wk, f"KQ 'da-dang-nhap': ok={ok}, score={sc:.3f}, pt={pt}")
@@ -71,17 +75,14 @@ def _try_click_da_dang_nhap(wk) -> bool:
 
 def _confirm_thoat_on_frame(wk, tries=6) -> bool:
     log(wk, "Chờ 'XÁC NHẬN THOÁT'…")
-    for t in range(1, tries+1):
-        img = grab_screen_np(wk)
-        ok, pt, sc = find_on_frame(img, IMG_XAC_NHAN_THOAT, region=REG_XAC_NHAN_THOAT, threshold=0.85)
-        if not ok:
-            ok, pt, sc = find_on_frame(img, IMG_XAC_NHAN_THOAT, region=None, threshold=0.85)
-        log(wk, f"[Try {t}/{tries}] xac-nhan-thoat: ok={ok}, sc={sc:.3f}, pt={pt}")
-        free_img(img)
-        if ok and pt:
-            tap(wk, *pt)
-            return True
-        time.sleep(0.25)
+    # mỗi frame mới: thử đúng vùng rồi cả màn; tối đa bằng `tries` nhịp 0.25s cũ
+    pt = wait_until(wk, any_of(tpl_visible(IMG_XAC_NHAN_THOAT, REG_XAC_NHAN_THOAT, 0.85),
+                               tpl_visible(IMG_XAC_NHAN_THOAT, None, 0.85)),
+                    tries * 0.25, label="Chờ 'xác nhận thoát'", baseline=tries * 0.25)
+    log(wk, f"KQ 'xac-nhan-thoat': pt={pt}")
+    if pt:
+        tap(wk, *pt)
+        return True
     return False
 
 def _menu_settings_switch_menuimg(wk) -> bool:
@@ -110,11 +111,12 @@ def _menu_settings_switch_menuimg(wk) -> bool:
         if not ok or not pt_in_region(pt, MENU_REGION):
             return False
 
-    # bấm menu → đợi → tìm 'cài đặt'
+    # bấm menu → chờ 'cài đặt' hiện (thay cho ngủ cố định 1.5s)
     tap(wk, *pt)
-    time.sleep(1.5)
-    # Chờ grace need_login ngắn trước khi dò ảnh (đề phòng UI vừa nhảy ra màn login)
-    if _grace_check_need_login(wk, 1.0):
+    seen = wait_until(wk, tpl_visible(IMG_CAI_DAT, REG_CAI_DAT, 0.90, stable=True), 1.5, region=REG_CAI_DAT,
+                      label="Menu → 'cài đặt'", baseline=1.5)
+    # Chưa thấy → grace need_login ngắn trước khi dò tiếp (đề phòng UI vừa nhảy ra màn login)
+    if not seen and _grace_check_need_login(wk, 1.0):
         mem_relief()
         return True
 
@@ -129,7 +131,7 @@ def _menu_settings_switch_menuimg(wk) -> bool:
             return True
         log(wk, "Không thấy 'cai-dat' đúng vùng → ESC x3 rồi thử lại…")
         esc_soft_clear(wk, times=3, wait_each=1.0)
-        img = grab_screen_np(wk)
+        img = grab_screen_np(wk, region=REG_CAI_DAT)
         ok, pt, sc = find_on_frame(img, IMG_CAI_DAT, region=REG_CAI_DAT, threshold=0.90)
         free_img(img)
         if not ok or not pt_in_region(pt, REG_CAI_DAT):
@@ -137,14 +139,12 @@ def _menu_settings_switch_menuimg(wk) -> bool:
 
     # ===== Chuỗi TAP phụ trước khi logout cũ =====
     log(wk, "↪ Gặp 'cài đặt' — thực hiện chuỗi tap phụ trước khi tiếp tục logout cũ…")
-    tap(wk, 131, 870)
-    time.sleep(1.0)
+    tap_and_settle(wk, 131, 870, timeout=1.0, label="Cài đặt: tab phụ")
 
     if not is_green_pixel(wk, 180, 720):
         tap(wk, 180, 720)
 
-    tap(wk, 623, 1166)
-    time.sleep(1.0)
+    tap_and_settle(wk, 623, 1166, timeout=1.0, label="Cài đặt: đổi tài khoản nhanh")
     tap(wk, 623, 948)
 
     if wait_state(wk, target="need_login", timeout=2):
@@ -153,9 +153,10 @@ def _menu_settings_switch_menuimg(wk) -> bool:
         return True
     # ===== /Chuỗi TAP phụ =====
 
-    # (tiếp tục) — bấm 'cài đặt'
+    # (tiếp tục) — bấm 'cài đặt' → chờ 'đổi tài khoản'
     tap(wk, *pt)
-    time.sleep(0.25)
+    wait_until(wk, tpl_visible(IMG_DOI_TAI_KHOAN, REG_DOI_TAI_KHOAN, 0.88), 0.25, region=REG_DOI_TAI_KHOAN,
+               label="Cài đặt → 'đổi tài khoản'", baseline=0.25)
 
     # Đổi tài khoản
     img = grab_screen_np(wk)
@@ -167,7 +168,8 @@ def _menu_settings_switch_menuimg(wk) -> bool:
     if not ok or not pt:
         return False
     tap(wk, *pt)
-    time.sleep(0.25)
+    wait_until(wk, tpl_visible(IMG_XAC_NHAN_DOI_TK, REG_XAC_NHAN_DOI_TK, 0.88), 0.25, region=REG_XAC_NHAN_DOI_TK,
+               label="Đổi tài khoản → 'xác nhận'", baseline=0.25)
 
     # Xác nhận đổi TK
     img = grab_screen_np(wk)
@@ -211,7 +213,6 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
 
         # 1) 'ĐÃ ĐĂNG NHẬP'
         if _try_click_da_dang_nhap(wk):
-            time.sleep(0.2)
             if _confirm_thoat_on_frame(wk, tries=6):
                 # Chờ need_login dài tiêu chuẩn
                 if wait_state(wk, "need_login", timeout=6):
@@ -224,7 +225,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                     return True
 
         # 2) Thử thấy 'menu'
-        img = grab_screen_np(wk)
+        img = grab_screen_np(wk, region=MENU_REGION)
         ok_menu, pt_menu, _ = find_on_frame(img, IMG_NUT_MENU, region=MENU_REGION, threshold=0.88)
         free_img(img)
         if ok_menu and pt_in_region(pt_menu, MENU_REGION):
@@ -235,7 +236,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                     return True
         else:
             # 3a) Có 'phu-de' → ESC 1.5s cho tới khi thấy menu
-            img = grab_screen_np(wk)
+            img = grab_screen_np(wk, region=REG_PHU_DE)
             ok_phude, _, _ = find_on_frame(img, IMG_PHU_DE, region=REG_PHU_DE, threshold=0.88)
             free_img(img)
             if ok_phude:
@@ -246,7 +247,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                         mem_relief()
                         return True
                     esc_soft_clear(wk, times=1, wait_each=1.5)
-                    img = grab_screen_np(wk)
+                    img = grab_screen_np(wk, region=MENU_REGION)
                     ok_menu, pt_menu, _ = find_on_frame(img, IMG_NUT_MENU, region=MENU_REGION, threshold=0.88)
                     free_img(img)
                     if ok_menu and pt_in_region(pt_menu, MENU_REGION):
@@ -258,7 +259,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                 continue
 
             # 3b) Có 'nut-quay-lai' → ESC 1.0s cho tới khi thấy menu
-            img = grab_screen_np(wk)
+            img = grab_screen_np(wk, region=REG_NUT_QUAY_LAI)
             ok_back_btn, _, _ = find_on_frame(img, IMG_NUT_QUAY_LAI, region=REG_NUT_QUAY_LAI, threshold=0.88)
             free_img(img)
             if ok_back_btn:
@@ -269,7 +270,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                         mem_relief()
                         return True
                     esc_soft_clear(wk, times=1, wait_each=1.0)
-                    img = grab_screen_np(wk)
+                    img = grab_screen_np(wk, region=MENU_REGION)
                     ok_menu, pt_menu, _ = find_on_frame(img, IMG_NUT_MENU, region=MENU_REGION, threshold=0.88)
                     free_img(img)
                     if ok_menu and pt_in_region(pt_menu, MENU_REGION):
@@ -296,8 +297,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
             return True
 
         esc_soft_clear(wk, times=1, wait_each=1.0)
-        tap(wk, 38, 36)
-        time.sleep(1.0)
+        tap_and_settle(wk, 38, 36, timeout=1.0, label="PA2: mở hồ sơ")
 
         # Tìm nút 'cài đặt' trong vùng REG_NUT_CAI_DAT
         for _ in range(12):
@@ -311,7 +311,8 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
             free_img(img)
             if ok and pt and pt_in_region(pt, REG_NUT_CAI_DAT):
                 tap(wk, *pt)    # vào Cài đặt
-                time.sleep(0.25)
+                wait_until(wk, tpl_visible(IMG_DOI_TAI_KHOAN, REG_DOI_TAI_KHOAN, 0.88), 0.25,
+                           region=REG_DOI_TAI_KHOAN, label="PA2: Cài đặt → 'đổi tài khoản'", baseline=0.25)
 
                 img = grab_screen_np(wk)
                 ok2, pt2, _ = find_on_frame(img, IMG_DOI_TAI_KHOAN, region=REG_DOI_TAI_KHOAN, threshold=0.88)
@@ -321,7 +322,8 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
                 if not ok2 or not pt2:
                     break
                 tap(wk, *pt2)
-                time.sleep(0.25)
+                wait_until(wk, tpl_visible(IMG_XAC_NHAN_DOI_TK, REG_XAC_NHAN_DOI_TK, 0.88), 0.25,
+                           region=REG_XAC_NHAN_DOI_TK, label="PA2: Đổi tài khoản → 'xác nhận'", baseline=0.25)
 
                 img = grab_screen_np(wk)
                 ok3, pt3, _ = find_on_frame(img, IMG_XAC_NHAN_DOI_TK, region=REG_XAC_NHAN_DOI_TK, threshold=0.88)
@@ -338,8 +340,7 @@ def logout_once(wk, max_rounds: int = 5) -> bool:
 
             # chưa thấy → làm lại chu trình
             esc_soft_clear(wk, times=1, wait_each=1.0)
-            tap(wk, 38, 36)
-            time.sleep(1.0)
+            tap_and_settle(wk, 38, 36, timeout=1.0, label="PA2: mở hồ sơ")
 
         log(wk, "PA2 chưa thành công, lặp lại…")
         mem_relief()
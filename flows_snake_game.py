@@ -1,10 +1,13 @@
 # File: flows_snake_game.py
 # Bot tự động chơi game rắn săn mồi, phiên bản cuối cùng.
-# - Sử dụng nhận diện bằng hình ảnh (Template Matching).
+# - Nhận diện bàn chơi: Template Matching ở đầu mỗi màn → hiệu chỉnh chữ ký màu ô từ chính bàn đó
+#   → theo dõi đầu rắn bằng phân loại từng ô theo màu (analyze_scene_grid), nhanh hơn nhiều.
 # - Tích hợp chiến lược "Vòng lặp khép kín" thông minh.
+# - Thực thi nước đi kiểu đường ống (MoveExecutor): không chờ xác nhận từng nước, chỉ lập lại khi đi lệch.
 # - Tương thích hoàn toàn với cấu trúc project của bạn.
 
 from __future__ import annotations
+import threading
 import time
 import cv2
 import numpy as np
@@ -15,15 +18,24 @@ from module import (
     log_wk,
     adb_safe,
     grab_screen_np,
+    grab_frame,
     find_on_frame,
+    find_all_many_on_frame,
+    crop_frame,
+    frame_scale,
+    RegionFrame,
+    get_template,
     tap,
     swipe,
     sleep_coop,
     aborted,
     free_img,
     mem_relief,
+    wait_until,
+    screen_settled,
     resource_path
 )
+from snake_planner import plan_route
 
 # ==============================================================================
 # ## --- CẤU HÌNH --- (PHẦN BẠN CẦN CHỈNH SỬA)
@@ -44,8 +56,27 @@ SNAKE_IMAGES = {
 }
 # Ngưỡng nhận diện (có thể tinh chỉnh nếu cần)
 TEMPLATE_THRESHOLD = 0.85
-
-# 4. Tọa độ các cửa (theo ô lưới, bắt đầu từ 0)
+# Dò ứng viên trên ảnh xám 1/2 rồi xác minh màu ở full-res (phân tích bàn chơi vài ms thay vì vài trăm ms)
+DETECT_COARSE = 0.5
+
+# Phân loại theo ô: cạnh ô vuông lấy mẫu màu ở TÂM mỗi ô (px theo màn 900x1600)
+GRID_SAMPLE = 13
+# Khoảng cách đặc trưng (B, G, R, tương phản) tối đa tới chữ ký GẦN NHẤT để nhận lớp đó (xa mọi chữ ký → ô lạ, coi là trống)
+SIGNATURE_TOL = 40.0
+# Đầu rắn đổi hướng / lệch nửa px thì mắt trong vùng tâm đổi chỗ → nới hơn; chỉ lấy 1 ô gần nhất, sau khi đã qua kiểm tra bàn
+HEAD_TOL = 60.0
+# Tỉ lệ ô bên trong (bỏ viền) gần màu ô trống tối thiểu để coi frame là bàn chơi (màn khác → không nhận gì)
+BOARD_MIN_EMPTY = 0.35
+
+# 4. Thực thi nước đi: gửi trước tối đa MOVE_LOOKAHEAD nước so với vị trí đầu rắn đã thấy trên frame
+MOVE_LOOKAHEAD = 3
+MOVE_STALL_TIMEOUT = 2.0   # s không thấy đầu rắn tiến thêm ô nào → dừng kế hoạch
+MAX_REPLANS = 3            # số lần lập lại kế hoạch trong 1 màn khi rắn đi lệch
+SWIPE_CENTER = (450, 800)
+SWIPE_DISTANCE = 150       # Có thể cần tinh chỉnh
+_SWIPE_VEC = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}
+
+# 5. Tọa độ các cửa (theo ô lưới, bắt đầu từ 0)
 #   Hàng và cột 7,8,9 tương ứng với index 6,7,8 trong lập trình
 GATES = {
     'LEFT': [(7, 0), (8, 0), (9, 0)],
@@ -59,15 +90,41 @@ GATES = {
 # ## --- CÁC HÀM CỐT LÕI CỦA BOT (Thuật toán và Phân tích) ---
 # ==============================================================================
 
-def analyze_scene_with_templates(image, grid_dims, game_area):
-    """Phân tích ảnh bằng Template Matching, trả về grid và vị trí các đối tượng."""
+# Tên template → khoá trong `objects` (thứ tự = ưu tiên khi 2 loại rơi cùng 1 ô)
+_OBJECT_KEYS = {'head': 'snake_head', 'food': 'food', 'wall': 'wall'}
+
+
+def points_to_cells(points, game_area, grid_dims) -> np.ndarray:
+    """Tâm (x, y) theo toạ độ màn hình → ô (hàng, cột) bằng số nguyên; bỏ điểm nằm ngoài lưới."""
+    if not points:
+        return np.empty((0, 2), dtype=int)
+    x1, y1, x2, y2 = game_area
+    rows, cols = grid_dims
+    pts = np.asarray([(p[0], p[1]) for p in points], dtype=np.int64)
+    c = (pts[:, 0] - x1) * cols // (x2 - x1)
+    r = (pts[:, 1] - y1) * rows // (y2 - y1)
+    ok = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+    return np.stack([r[ok], c[ok]], axis=1)
+
+
+def _at_reference(image, game_area):
+    """
+    Frame chụp thu nhỏ (scale < 1): cắt vùng lưới rồi phóng về độ phân giải tham chiếu để khớp template
+    full-res với ngưỡng như cũ (template thu nhỏ theo frame mất chi tiết, băng ở 1/2 chỉ còn ~0.80 điểm).
+    """
+    if frame_scale(image) >= 1.0:
+        return image
+    area = crop_frame(image, game_area)
+    if area is None or area.size == 0:
+        return image
     x1, y1, x2, y2 = game_area
-    game_img = image[y1:y2, x1:x2]
+    return RegionFrame(cv2.resize(np.asarray(area), (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR),
+                       (x1, y1), 1.0)
 
-    h, w, _ = game_img.shape
-    cell_w = w / grid_dims[1]
-    cell_h = h / grid_dims[0]
 
+def analyze_scene_with_templates(image, grid_dims, game_area):
+    """Phân tích ảnh bằng Template Matching, trả về grid và vị trí các đối tượng."""
+    image = _at_reference(image, game_area)
     grid = np.zeros(grid_dims, dtype=int)
     objects = {'snake_head': None, 'snake_body': [], 'food': [], 'wall': []}
 
@@ -77,53 +134,196 @@ def analyze_scene_with_templates(image, grid_dims, game_area):
     grid[:, 0] = 1
     grid[:, grid_dims[1] - 1] = 1
 
-    for name, path in SNAKE_IMAGES.items():
-        template = cv2.imread(path, cv2.IMREAD_COLOR)
-        if template is None:
-            log_wk(None, f"LỖI: Không thể tải ảnh mẫu: {path}")
-            continue
-
-        # Dùng hàm find_on_frame của bạn để tìm tất cả các vị trí khớp
-        # (Lưu ý: find_on_frame chỉ trả về 1 kết quả, cần sửa đổi để trả về nhiều)
-        # Tạm thời, chúng ta sẽ quét thủ công để tìm nhiều đối tượng
-        res = cv2.matchTemplate(game_img, template, cv2.TM_CCOEFF_NORMED)
-        loc = np.where(res >= TEMPLATE_THRESHOLD)
-
-        for pt in zip(*loc[::-1]):  # pt là (x, y) của góc trên trái
-            center_x = pt[0] + template.shape[1] / 2
-            center_y = pt[1] + template.shape[0] / 2
-
-            grid_c = int(center_x / cell_w)
-            grid_r = int(center_y / cell_h)
-            pos = (grid_r, grid_c)
-
-            # Tránh thêm trùng lặp vị trí
-            is_duplicate = False
-            for obj_list in objects.values():
-                if isinstance(obj_list, list) and pos in obj_list:
-                    is_duplicate = True
-                    break
-            if pos == objects['snake_head']: is_duplicate = True
-            if is_duplicate: continue
-
-            if name == 'snake_head':
-                objects['snake_head'] = pos
-            else:
-                objects[name].append(pos)
-                if name == 'wall':
-                    grid[pos] = 1
+    # template lấy từ kho dùng chung; đỉnh + NMS làm bằng numpy trong module.find_all_many_on_frame
+    all_hits = find_all_many_on_frame(
+        image,
+        [(SNAKE_IMAGES[name], game_area, TEMPLATE_THRESHOLD, 1 if key == 'snake_head' else None)
+         for name, key in _OBJECT_KEYS.items()],
+        grayscale=False, coarse=DETECT_COARSE)
+
+    taken = np.zeros(grid_dims, dtype=bool)  # 1 ô chỉ nhận 1 đối tượng
+    for key, hits in zip(_OBJECT_KEYS.values(), all_hits):
+        for r, c in points_to_cells(hits, game_area, grid_dims):
+            if taken[r, c]:
+                continue
+            taken[r, c] = True
+            pos = (int(r), int(c))
+            if key == 'snake_head':
+                objects['snake_head'] = pos  # hits đã sort theo score → lấy đỉnh tốt nhất
+                break
+            objects[key].append(pos)
+            if key == 'wall':
+                grid[pos] = 1
 
     # Thân rắn sẽ được suy luận từ vị trí đầu rắn và đường đi
     return grid, objects
 
 
+# ---- Phân loại theo ô (không quét template) ----
+# Thứ tự hàng trong mảng chữ ký (5, 4)
+SIG_EMPTY, SIG_HEAD, SIG_FOOD, SIG_WALL, SIG_BODY = range(5)
+_SIGNATURES: dict[float, np.ndarray] = {}
+
+
+def _center_feature(img: np.ndarray, side: int) -> np.ndarray:
+    """(B, G, R, độ tương phản) của ô vuông cạnh `side` ở tâm ảnh."""
+    h, w = img.shape[:2]
+    y0, x0 = max(0, (h - side) // 2), max(0, (w - side) // 2)
+    px = img[y0:y0 + side, x0:x0 + side].reshape(-1, 3).astype(np.float32)
+    return np.append(px.mean(axis=0), px.std(axis=0).mean())
+
+
+def _ring_feature(img: np.ndarray, k: int = 3) -> np.ndarray:
+    """(B, G, R, độ tương phản) của dải viền rộng k px: màu trung vị, tương phản ước lượng bền (MAD)."""
+    m = np.zeros(img.shape[:2], dtype=bool)
+    m[:k, :] = m[-k:, :] = m[:, :k] = m[:, -k:] = True
+    px = img[m].reshape(-1, 3).astype(np.float32)
+    med = np.median(px, axis=0)
+    return np.append(med, 1.4826 * np.median(np.abs(px - med), axis=0).mean())
+
+
+def cell_signatures(scale: float = 1.0) -> np.ndarray:
+    """
+    Chữ ký MẶC ĐỊNH (5, 4) = (B, G, R, độ tương phản) lấy từ template (vốn cắt từ ảnh chụp bàn thật),
+    cache theo scale: trống = nền bàn quanh mồi (viền bait), đầu = tâm head (mắt: sáng + tương phản cao),
+    mồi/băng = tâm template, thân = da rắn (viền head). Bàn đang chơi có chữ ký riêng → calibrate_signatures().
+    """
+    sig = _SIGNATURES.get(scale)
+    if sig is None:
+        side = max(3, int(GRID_SAMPLE * scale))
+        tpl = {name: get_template(SNAKE_IMAGES[name], grayscale=False, scale=scale)
+               for name in ('head', 'food', 'wall')}
+        missing = np.full(4, np.inf)
+        rows = [
+            _ring_feature(tpl['food']) if tpl['food'] is not None else missing,
+            _center_feature(tpl['head'], side) if tpl['head'] is not None else missing,
+            _center_feature(tpl['food'], side) if tpl['food'] is not None else missing,
+            _center_feature(tpl['wall'], side) if tpl['wall'] is not None else missing,
+            _ring_feature(tpl['head']) if tpl['head'] is not None else missing,
+        ]
+        sig = _SIGNATURES[scale] = np.asarray(rows, dtype=np.float32)
+    return sig
+
+
+def _cell_features(image, grid_dims, game_area) -> np.ndarray | None:
+    """
+    (B, G, R, độ tương phản) vùng tâm mọi ô trong 1 phép numpy (chỉ ~15x15x13x13 pixel)
+    → (rows, cols, 4) | None. Độ tương phản tách đầu rắn (mắt) khỏi nền bàn dù màu TB gần nhau.
+    """
+    rows, cols = grid_dims
+    area = crop_frame(image, game_area)
+    if area is None or area.ndim != 3:
+        return None
+    area = np.asarray(area)
+    ah, aw = area.shape[:2]
+    side = max(3, min(int(GRID_SAMPLE * frame_scale(image)), ah // rows, aw // cols))
+    # tâm ô tính bằng số thực (cạnh ô không chia hết, vd 756/15 = 50.4 px) → cửa sổ không trôi dần
+    off = np.arange(side) - side // 2
+    ys = np.clip(((np.arange(rows) + 0.5) * ah / rows).astype(int)[:, None] + off, 0, ah - 1)
+    xs = np.clip(((np.arange(cols) + 0.5) * aw / cols).astype(int)[:, None] + off, 0, aw - 1)
+    # lấy mẫu mọi ô cùng lúc: (rows, side, cols, side, 3) → TB / độ lệch chuẩn theo 2 trục cửa sổ
+    px = area[ys[:, :, None, None], xs[None, None, :, :]].astype(np.float32)
+    return np.concatenate([px.mean(axis=(1, 3)), px.std(axis=(1, 3)).mean(axis=-1, keepdims=True)], axis=-1)
+
+
+def _interior_mask(grid_dims) -> np.ndarray:
+    inner = np.zeros(grid_dims, dtype=bool)
+    inner[1:-1, 1:-1] = True
+    return inner
+
+
+def _gate_mask(grid_dims) -> np.ndarray:
+    gates = np.zeros(grid_dims, dtype=bool)
+    for cells in GATES.values():
+        for r, c in cells:
+            if r < grid_dims[0] and c < grid_dims[1]:
+                gates[r, c] = True
+    return gates
+
+
+def calibrate_signatures(image, objects, grid_dims, game_area) -> np.ndarray | None:
+    """
+    Chữ ký của CHÍNH bàn đang chơi từ 1 lần phân tích đáng tin (quét template): đặc trưng ô đầu rắn,
+    trung vị ô mồi / băng, trung vị các ô trong còn lại (ô trống). Thân rắn giữ chữ ký da lấy từ template.
+    Trả None nếu chưa thấy đầu rắn (không hiệu chỉnh được).
+    """
+    head = objects.get('snake_head')
+    feats = _cell_features(image, grid_dims, game_area)
+    if head is None or feats is None:
+        return None
+    sig = cell_signatures(frame_scale(image)).copy()
+    sig[SIG_HEAD] = feats[head]
+    taken = np.zeros(grid_dims, dtype=bool)
+    r, c = head
+    taken[max(0, r - 1):r + 2, max(0, c - 1):c + 2] = True  # quanh đầu có thể là thân → không lấy làm ô trống
+    for key, row in (('food', SIG_FOOD), ('wall', SIG_WALL)):
+        cells = objects.get(key) or []
+        if cells:
+            idx = tuple(np.asarray(cells).T)
+            sig[row] = np.median(feats[idx], axis=0)
+            taken[idx] = True
+    free = _interior_mask(grid_dims) & ~taken
+    if free.any():
+        sig[SIG_EMPTY] = np.median(feats[free], axis=0)
+    return sig
+
+
+def analyze_scene_grid(image, grid_dims, game_area, signatures=None):
+    """
+    Phân loại từng ô thay vì quét template: so (màu TB, độ tương phản) vùng tâm ô với chữ ký
+    (signatures của bàn hiện tại từ calibrate_signatures; None → chữ ký mặc định từ template).
+    Không đủ ô trống → không phải bàn chơi → không nhận gì. Đầu rắn chỉ ở ô trong hoặc ô cửa.
+    Trả (grid, objects) cùng cấu trúc analyze_scene_with_templates.
+    """
+    rows, cols = grid_dims
+    grid = np.zeros(grid_dims, dtype=int)
+    objects = {'snake_head': None, 'snake_body': [], 'food': [], 'wall': []}
+    grid[0, :] = 1
+    grid[rows - 1, :] = 1
+    grid[:, 0] = 1
+    grid[:, cols - 1] = 1
+
+    feats = _cell_features(image, grid_dims, game_area)
+    if feats is None:
+        return grid, objects
+    sig = signatures if signatures is not None else cell_signatures(frame_scale(image))
+    dist = np.linalg.norm(feats[:, :, None, :] - sig[None, None], axis=-1)  # (rows, cols, 5)
+    label = dist.argmin(axis=-1)
+    known = dist.min(axis=-1) <= np.where(label == SIG_HEAD, HEAD_TOL, SIGNATURE_TOL)
+
+    inner = _interior_mask(grid_dims)
+    if ((label == SIG_EMPTY) & known)[inner].mean() < BOARD_MIN_EMPTY:
+        return grid, objects  # không phải bàn chơi (màn khác / đang chuyển cảnh)
+    label[~known] = SIG_EMPTY
+
+    head_cells = np.argwhere((label == SIG_HEAD) & (inner | _gate_mask(grid_dims)))
+    if head_cells.size:
+        best = int(dist[head_cells[:, 0], head_cells[:, 1], SIG_HEAD].argmin())
+        objects['snake_head'] = tuple(int(v) for v in head_cells[best])
+    objects['snake_body'] = [tuple(int(v) for v in rc) for rc in np.argwhere((label == SIG_BODY) & inner)]
+    objects['food'] = [tuple(int(v) for v in rc) for rc in np.argwhere((label == SIG_FOOD) & inner)]
+    walls = (label == SIG_WALL) & inner
+    objects['wall'] = [tuple(int(v) for v in rc) for rc in np.argwhere(walls)]
+    grid[walls] = 1
+    return grid, objects
+
+
+def analyze_scene(image, grid_dims, game_area, signatures=None):
+    """Có chữ ký của bàn hiện tại → phân loại theo ô (nhanh); chưa có / không thấy đầu rắn → quét template."""
+    if signatures is not None:
+        grid, objects = analyze_scene_grid(image, grid_dims, game_area, signatures)
+        if objects['snake_head'] is not None:
+            return grid, objects
+    return analyze_scene_with_templates(image, grid_dims, game_area)
+
+
 # Các hàm heuristic, a_star_pathfinding, path_to_moves giữ nguyên
 def heuristic(a, b): return abs(a[0] - b[0]) + abs(a[1] - b[1])
 
 
-def a_star_pathfinding(grid, start, end, snake_body=[]):
+def a_star_pathfinding(grid, start, end, snake_body=None):
     temp_grid = grid.copy()
-    for pos in snake_body:
+    for pos in snake_body or ():
         temp_grid[pos] = 1  # Coi thân rắn là tường
 
     neighbors = [(0, 1), (0, -1), (1, 0), (-1, 0)]
@@ -172,48 +372,108 @@ def path_to_moves(path):
 
 
 def plan_circular_route(grid, snake_start, all_food, entry_gate_side):
-    """Lập kế hoạch ăn hết mồi và quay về cửa vào."""
-    full_path = []
-    current_pos = snake_start
-    snake_body = []  # Giả lập thân rắn mọc dài ra
-    remaining_food = all_food.copy()
-
-    # Giai đoạn 1: Ăn hết mồi
-    while remaining_food:
-        remaining_food.sort(key=lambda f: heuristic(current_pos, f))
-        target_food = None
-        path_segment = None
-
-        # Tìm miếng mồi gần nhất có đường đi tới
-        for food in remaining_food:
-            path_segment = a_star_pathfinding(grid, current_pos, food, snake_body)
-            if path_segment:
-                target_food = food
-                break
-
-        if not target_food:
+    """
+    Lập kế hoạch ăn hết mồi và quay về cửa vào (snake_planner: BFS mọi cặp + NN/2-opt).
+    Trả danh sách ô đi qua (không gồm ô xuất phát) hoặc None.
+    """
+    gates = GATES[entry_gate_side]
+    path = plan_route(grid, snake_start, all_food, gates)
+    if path is None:
+        # chẩn đoán: kẹt ở mồi hay ở cửa ra
+        if plan_route(grid, snake_start, all_food, ()) is None:
             log_wk(None, "CẢNH BÁO: Không tìm thấy đường đến bất kỳ miếng mồi nào.")
             return None
-
-        full_path.extend(path_segment[1:])
-        current_pos = target_food
-
-        # Cập nhật thân rắn (đơn giản hóa)
-        snake_body = path_segment[:-1]
-        remaining_food.remove(target_food)
-
-    # Giai đoạn 2: Quay về cửa vào
-    exit_gates = GATES[entry_gate_side]
-    exit_gates.sort(key=lambda g: heuristic(current_pos, g))
-    target_gate = exit_gates[0]
-
-    path_to_exit = a_star_pathfinding(grid, current_pos, target_gate, snake_body)
-    if path_to_exit:
-        full_path.extend(path_to_exit[1:])
-    else:
         log_wk(None, f"CẢNH BÁO: Ăn xong nhưng không tìm thấy đường ra cửa {entry_gate_side}.")
-
-    return full_path
+        return plan_route(grid, snake_start, all_food, ())
+    return path
+
+
+class MoveExecutor:
+    """
+    Gửi chuỗi nước đi theo kiểu đường ống: luồng gửi bắn swipe kế tiếp ngay khi kênh input báo xong
+    swipe trước (tối đa `lookahead` nước đi trước vị trí đã xác nhận), còn luồng gọi run() đọc frame
+    liên tục, dò đầu rắn và đối chiếu với lộ trình. Trả về khi xong / lệch / đứng yên / bị huỷ.
+    Dò đầu rắn bằng phân loại theo ô khi có chữ ký của bàn hiện tại, không có thì quét template.
+    """
+
+    def __init__(self, wk, path, moves, lookahead: int = MOVE_LOOKAHEAD, signatures=None):
+        self.wk = wk
+        self.signatures = signatures
+        self.path = list(path)          # [ô xuất phát] + các ô sẽ đi qua, len = len(moves) + 1
+        self.moves = list(moves)
+        self.lookahead = max(1, int(lookahead))
+        self.sent = 0                   # số swipe đã được kênh input xác nhận
+        self.confirmed = 0              # chỉ số ô trong path đã thấy đầu rắn tới
+        self._cond = threading.Condition()
+        self._stop = False
+
+    def _send_loop(self):
+        cx, cy = SWIPE_CENTER
+        for i, move in enumerate(self.moves):
+            with self._cond:
+                while not self._stop and i - self.confirmed >= self.lookahead:
+                    self._cond.wait(0.2)
+                if self._stop or aborted(self.wk):
+                    return
+            dx, dy = _SWIPE_VEC[move]
+            swipe(self.wk, cx, cy, cx + dx * SWIPE_DISTANCE, cy + dy * SWIPE_DISTANCE, dur_ms=100)
+            with self._cond:
+                self.sent = i + 1
+
+    def _halt(self, sender: threading.Thread):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        sender.join(timeout=5)
+
+    def run(self) -> tuple[str, tuple]:
+        """→ (trạng_thái, ô đầu rắn cuối cùng thấy được); trạng thái: done / diverged / stalled / aborted."""
+        wk = self.wk
+        head = self.path[0]
+        sender = threading.Thread(target=self._send_loop, name=f"SnakeMoves-{getattr(wk, 'port', '')}",
+                                  daemon=True)
+        t_start = last_progress = last_ts = time.monotonic()
+        off_path = None  # ô lệch lộ trình thấy ở frame trước: phải thấy lại mới coi là lệch thật
+        sender.start()
+        try:
+            while self.confirmed < len(self.moves):
+                if aborted(wk):
+                    return 'aborted', head
+                if time.monotonic() - last_progress > MOVE_STALL_TIMEOUT:
+                    # nước cuối đưa rắn ra cửa (khỏi lưới) → không còn thấy đầu, coi như xong
+                    done = self.sent == len(self.moves) and self.confirmed >= len(self.moves) - 1
+                    return ('done' if done else 'stalled'), head
+                img, ts = grab_frame(wk, newer_than=last_ts, timeout=1.0, region=GAME_AREA_COORDS)
+                if img is None:
+                    continue
+                last_ts = ts
+                if self.signatures is not None:
+                    seen = analyze_scene_grid(img, GRID_DIMENSIONS, GAME_AREA_COORDS, self.signatures)[1]['snake_head']
+                else:
+                    seen = analyze_scene_with_templates(img, GRID_DIMENSIONS, GAME_AREA_COORDS)[1]['snake_head']
+                free_img(img)
+                if seen is None or seen == head:
+                    continue
+                # đầu rắn chỉ có thể ở các ô từ vị trí đã xác nhận tới nước vừa gửi
+                upto = min(self.sent, len(self.moves))
+                k = next((j for j in range(self.confirmed + 1, upto + 1) if self.path[j] == seen), None)
+                if k is None:
+                    if seen != off_path:
+                        off_path = seen  # 1 frame lẻ (chuyển cảnh, hiệu ứng ăn mồi) chưa đủ để lập lại kế hoạch
+                        continue
+                    log_wk(wk, f"  Rắn lệch lộ trình: thấy đầu ở {seen}, dự kiến {self.path[self.confirmed]}"
+                               f"…{self.path[upto]}.")
+                    return 'diverged', seen
+                head = seen
+                off_path = None
+                last_progress = time.monotonic()
+                with self._cond:
+                    self.confirmed = k
+                    self._cond.notify_all()
+            log_wk(wk, f"  Đã đi {len(self.moves)} nước trong {time.monotonic() - t_start:.1f}s.")
+            return 'done', head
+        finally:
+            self._halt(sender)
 
 
 # ==============================================================================
@@ -230,13 +490,21 @@ def run_snake_game_flow(wk) -> bool:
 
     # Xác định cửa vào ban đầu, mặc định là TRÁI
     entry_side = 'LEFT'
+    replans = 0  # > 0: đang lập lại kế hoạch giữa màn (rắn đi lệch), không chờ tải màn
+    board_ref = None  # bàn cờ lúc vừa đi xong màn trước: màn mới phải KHÁC nó rồi đứng yên
+    signatures = None  # chữ ký màu ô của màn đang chơi (hiệu chỉnh từ lần quét template đầu màn)
 
     try:
         while not aborted(wk):
-            log_wk(wk, f"\n================ Chuẩn bị màn chơi mới (Vào từ cửa: {entry_side}) ================")
-
-            # Chờ một chút để màn chơi tải xong
-            if not sleep_coop(wk, 2.0): return False
+            if not replans:
+                log_wk(wk, f"\n================ Chuẩn bị màn chơi mới (Vào từ cửa: {entry_side}) ================")
+
+                # Chờ màn chơi tải xong: bàn cờ đổi (so với màn trước) rồi đứng yên, tối đa 2s như cũ
+                wait_until(wk, screen_settled(GAME_AREA_COORDS, ref=board_ref), 2.0, region=GAME_AREA_COORDS,
+                           label="Rắn: tải màn", baseline=2.0)
+                free_img(board_ref)
+                board_ref = None
+                if aborted(wk): return False
 
             log_wk(wk, "Chụp và phân tích màn chơi...")
             screenshot = grab_screen_np(wk)
@@ -245,18 +513,24 @@ def run_snake_game_flow(wk) -> bool:
                 if not sleep_coop(wk, 5): return False
                 continue
 
-            grid, objects = analyze_scene_with_templates(screenshot, GRID_DIMENSIONS, GAME_AREA_COORDS)
+            # đầu màn luôn quét template (bàn mới, chưa có chữ ký); lập lại giữa màn thì dùng chữ ký đã hiệu chỉnh
+            grid, objects = analyze_scene(screenshot, GRID_DIMENSIONS, GAME_AREA_COORDS,
+                                          signatures if replans else None)
             snake_head = objects.get('snake_head')
             all_food = objects.get('food', [])
+            if snake_head and not replans:
+                signatures = calibrate_signatures(screenshot, objects, GRID_DIMENSIONS, GAME_AREA_COORDS)
 
             free_img(screenshot)
 
             if not snake_head:
                 log_wk(wk, "Không tìm thấy đầu rắn bằng ảnh mẫu. Kiểm tra lại file 'head.png' và ngưỡng nhận diện.")
+                replans = 0
+                signatures = None
                 if not sleep_coop(wk, 5): return False
                 continue
 
-            if not all_food:
+            if not all_food and not replans:
                 log_wk(wk, "Không tìm thấy mồi. Có thể đã qua màn. Chờ 5 giây.")
                 if not sleep_coop(wk, 5): return False
                 entry_side = 'RIGHT' if entry_side == 'LEFT' else 'LEFT'  # Đảo cửa cho màn tiếp theo
@@ -268,51 +542,24 @@ def run_snake_game_flow(wk) -> bool:
             master_path = plan_circular_route(grid, snake_head, all_food, entry_side)
             if not master_path:
                 log_wk(wk, "Không thể lập kế hoạch cho màn này. Bỏ qua.")
+                replans = 0
                 if not sleep_coop(wk, 5): return False
                 continue
 
             all_moves = path_to_moves([snake_head] + master_path)
             log_wk(wk, f"Đã lập kế hoạch hoàn chỉnh với {len(all_moves)} nước đi.")
 
-            # Thực thi kế hoạch
-            current_head_pos = snake_head
-            for i, move in enumerate(all_moves):
-                if aborted(wk): return False
-
-                center_x, center_y = 450, 800
-                end_x, end_y = center_x, center_y
-                distance = 150  # Có thể cần tinh chỉnh
-                if move == 'UP':
-                    end_y -= distance
-                elif move == 'DOWN':
-                    end_y += distance
-                elif move == 'LEFT':
-                    end_x -= distance
-                elif move == 'RIGHT':
-                    end_x += distance
-                swipe(wk, center_x, center_y, end_x, end_y, dur_ms=100)
-
-                # Chờ cho đến khi rắn di chuyển xong
-                start_wait = time.time()
-                moved = False
-                while time.time() - start_wait < 2:
-                    new_img = grab_screen_np(wk)
-                    if new_img is None: continue
-                    # Chỉ cần tìm đầu rắn để xác nhận di chuyển
-                    _, new_objects = analyze_scene_with_templates(new_img, GRID_DIMENSIONS, GAME_AREA_COORDS)
-                    new_head_pos = new_objects.get('snake_head')
-                    free_img(new_img)
-
-                    if new_head_pos and new_head_pos != current_head_pos:
-                        log_wk(wk, f"  ({i + 1}/{len(all_moves)}) Di chuyển {move} thành công -> {new_head_pos}")
-                        current_head_pos = new_head_pos
-                        moved = True
-                        break
-                    if not sleep_coop(wk, 0.1): return False
-
-                if not moved:
-                    log_wk(wk, "LỖI: Rắn không di chuyển! Hủy bỏ kế hoạch.")
-                    break
+            # Thực thi kế hoạch: gửi nước đi liên tục, chỉ lập lại kế hoạch khi rắn đi lệch
+            status, _ = MoveExecutor(wk, [snake_head] + master_path, all_moves, signatures=signatures).run()
+            if status == 'aborted':
+                return False
+            if status == 'diverged' and replans < MAX_REPLANS:
+                replans += 1
+                log_wk(wk, f"Lập lại kế hoạch từ vị trí hiện tại (lần {replans}/{MAX_REPLANS})...")
+                continue
+            if status == 'stalled':
+                log_wk(wk, "LỖI: Rắn không di chuyển! Hủy bỏ kế hoạch.")
+            replans = 0
 
             log_wk(wk, "Hoàn thành kế hoạch! Chờ màn chơi tiếp theo...")
 
@@ -326,7 +573,11 @@ def run_snake_game_flow(wk) -> bool:
             elif entry_side == 'DOWN':
                 entry_side = 'UP'
 
-            if not sleep_coop(wk, 5): return False  # Đợi 5 giây để game chuyển màn
+            # Đợi game chuyển màn: bàn cờ đổi khỏi màn vừa xong rồi đứng yên (tối đa 5 giây như cũ)
+            board_ref = grab_screen_np(wk, region=GAME_AREA_COORDS)
+            wait_until(wk, screen_settled(GAME_AREA_COORDS, ref=board_ref), 5.0, region=GAME_AREA_COORDS,
+                       label="Rắn: chuyển màn", baseline=5.0)
+            if aborted(wk): return False
 
     except Exception as e:
         log_wk(wk, f"Đã xảy ra lỗi nghiêm trọng trong flow game rắn: {e}")
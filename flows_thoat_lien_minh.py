@@ -5,7 +5,8 @@ Tự rời (thoát) Liên minh
 
 — BỔ SUNG THEO YÊU CẦU —
 • Mỗi vòng lặp: chụp frame KIỂM TRA KÉP (ưu tiên 'kiem-tra-chung' trước, rồi tới 'inside').
-• Sau khi TAP vào Liên minh (outside): sleep 1.5s rồi KIỂM TRA KÉP; nếu chưa rõ thì poll 3–4 nhịp (0.3s/nhịp), ưu tiên 'kiem-tra-chung' trước.
+• Sau khi TAP vào Liên minh (outside): KIỂM TRA KÉP trên từng frame mới (wait_until) tới khi rõ 'kiem-tra-chung'/'inside'
+  (trước: ngủ cố định 1.5s rồi poll 3–4 nhịp 0.3s), ưu tiên 'kiem-tra-chung' trước.
 • Bất kỳ chỗ nào trước đây chỉ dò 'inside' để quyết định bước tiếp -> thay bằng dò 'kiem-tra-chung' trước rồi mới 'inside'.
 • Không tự ghi file ở flow; chỉ return True khi thấy 'kiem-tra-chung'. Việc cập nhật last_leave do runner lo.
 
@@ -16,7 +17,7 @@ Tự rời (thoát) Liên minh
 Quy trình tổng:
 1) Đầu mỗi vòng: kiểm tra kép (kiem-tra-chung / inside).
 2) Đảm bảo vào Liên minh (inside) và dọn popup (có kiểm tra kép sau TAP outside).
-3) Vuốt ngang phải→trái để tìm 'sanh-lien-minh' rồi TAP; đợi 2 giây.
+3) Vuốt ngang phải→trái để tìm 'sanh-lien-minh' rồi TAP; chờ tới khi thấy 'Động thái' (tối đa 2 giây).
 4) Vào 'Động thái', rồi fling dọc để tìm 'Rời khỏi liên minh' + xác nhận.
 5) Kiểm tra rời thành công (ưu tiên 'kiem-tra-chung' trước).
 """
@@ -27,9 +28,10 @@ import time
 # ====== IMPORT TOÀN BỘ HÀM DÙNG CHUNG TỪ module.py ======
 from module import (
     log_wk, adb_safe,
-    grab_screen_np, find_on_frame,
+    grab_screen_np, find_on_frame, roi_memo,
     tap, tap_center, swipe,
     aborted, sleep_coop,
+    wait_until, tpl_visible, tpl_gone, screen_settled,
     free_img, mem_relief,resource_path
 )
 
@@ -41,6 +43,7 @@ REG_SANH            = (186, 485, 848, 568)         # sanh-lien-minh.png
 REG_DONG_THAI       = (28, 1381, 266, 1483)        # dong-thai.png
 REG_BTN_ROI         = (621, 1293, 840, 1390)       # roi-khoi-lien-minh.png
 REG_XAC_NHAN_ROI    = (521, 911, 773, 1011)        # xac-nhan-roi-lm.png
+REG_FEED_LIST       = (28, 120, 872, 1380)         # danh sách Động thái (chờ hết cuộn quán tính)
 
 # ===== IMAGES =====
 IMG_INSIDE          = resource_path("images/lien_minh/lien-minh-inside.png")
@@ -57,21 +60,23 @@ THR_DEFAULT = 0.86
 ESC_DELAY   = 1.0
 CLICK_DELAY = 0.4
 MAX_ROUNDS  = 30
+OPEN_WAIT   = 2.7   # chờ 'kiem-tra-chung'/'inside' sau TAP outside (trước: 1.5s + 4 x 0.3s)
 
 
 # ========= tiện ích kiểm tra kép =========
-def _check_left_or_inside_from_img(img) -> str | None:
+def _check_left_or_inside_from_img(img, memo=None) -> str | None:
     """
     Ưu tiên dò 'kiem-tra-chung' trước, sau đó 'inside'.
+    memo: roi_memo(wk) khi poll liên tục (frame không đổi → khỏi khớp lại).
     Trả về:
       - 'left'   : đã rời (hoặc bị kick)
       - 'inside' : vẫn đang trong Liên minh
       - None     : không xác định từ frame hiện tại
     """
-    ok_left, _, _ = find_on_frame(img, IMG_KIEM_TRA_CHUNG, region=None)
+    ok_left, _, _ = find_on_frame(img, IMG_KIEM_TRA_CHUNG, region=None, memo=memo)
     if ok_left:
         return "left"
-    ok_in, _, _ = find_on_frame(img, IMG_INSIDE, region=REG_INSIDE)
+    ok_in, _, _ = find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, memo=memo)
     if ok_in:
         return "inside"
     return None
@@ -85,6 +90,13 @@ def _check_left_or_inside(wk) -> str | None:
 
 # ================= core =================
 
+def _wait_feed(wk) -> bool:
+    """Sau TAP sảnh: chờ 'dong-thai' hiện (tối đa 2s như trước). False nếu bị hủy."""
+    wait_until(wk, tpl_visible(IMG_DONG_THAI, REG_DONG_THAI), 2.0, region=REG_DONG_THAI,
+               label="Vào Sảnh Liên minh", baseline=2.0)
+    return not aborted(wk)
+
+
 def _ensure_inside_clean(wk) -> str | bool:
     """
     ESC tới khi thấy OUTSIDE → TAP OUTSIDE → đợi & KIỂM TRA KÉP.
@@ -99,7 +111,7 @@ def _ensure_inside_clean(wk) -> str | bool:
         # ESC cho đến khi nhìn thấy outside
         while True:
             if aborted(wk): return False
-            img = grab_screen_np(wk)
+            img = grab_screen_np(wk, region=REG_OUTSIDE)
             ok_out, _, _ = find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE)
             free_img(img)
             if ok_out:
@@ -107,36 +119,20 @@ def _ensure_inside_clean(wk) -> str | bool:
             adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)  # ESC
             if not sleep_coop(wk, ESC_DELAY): return False
 
-        # TAP outside
+        # TAP outside → kiểm tra kép trên từng frame mới, ưu tiên 'kiem-tra-chung'
         tap_center(wk, REG_OUTSIDE)
-
-        # — bổ sung: chờ 1.5s rồi kiểm tra kép —
-        if not sleep_coop(wk, 1.5): return False
-        img2 = grab_screen_np(wk)
-        state = _check_left_or_inside_from_img(img2) if img2 is not None else None
-        free_img(img2)
+        state = wait_until(wk, lambda img: _check_left_or_inside_from_img(img, roi_memo(wk)), OPEN_WAIT,
+                           label="Mở Liên minh", baseline=OPEN_WAIT)
+        if aborted(wk): return False
         if state == "left":
             log_wk(wk, "✅ Thấy 'kiem-tra-chung' sau khi mở Liên minh — coi như đã rời.")
             return "left"
         if state == "inside":
             log_wk(wk, "✅ Đang ở Liên minh (inside).")
-            if not sleep_coop(wk, 0.6): return False
+            wait_until(wk, screen_settled(), 0.6, label="Liên minh ổn định", baseline=0.6)
+            if aborted(wk): return False
             return "inside"
 
-        # nếu chưa xác định → poll 3–4 nhịp (0.3s/nhịp), ưu tiên 'kiem-tra-chung'
-        for _ in range(4):
-            if not sleep_coop(wk, 0.3): return False
-            img3 = grab_screen_np(wk)
-            state = _check_left_or_inside_from_img(img3) if img3 is not None else None
-            free_img(img3)
-            if state == "left":
-                log_wk(wk, "✅ Thấy 'kiem-tra-chung' — coi như đã rời.")
-                return "left"
-            if state == "inside":
-                log_wk(wk, "✅ Đang ở Liên minh (inside).")
-                if not sleep_coop(wk, 0.6): return False
-                return "inside"
-
         # không thấy inside sau khi tap → ESC và lặp lại
         adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
         if not sleep_coop(wk, ESC_DELAY): return False
@@ -145,15 +141,15 @@ def _ensure_inside_clean(wk) -> str | bool:
 def _open_guild_hall(wk) -> bool:
     """
     Vuốt NGANG (phải→trái) 3–4 lần để tìm 'sanh-lien-minh.png' rồi TAP.
-    Sau khi TAP Sảnh → đợi 2s rồi mới kiểm tra 'Động thái'.
+    Sau khi TAP Sảnh → chờ 'Động thái' hiện (tối đa 2s) rồi mới kiểm tra.
     """
     # thử tìm ngay
-    img = grab_screen_np(wk)
+    img = grab_screen_np(wk, region=REG_SANH)
     ok, pt, _ = find_on_frame(img, IMG_SANH, region=REG_SANH)
     free_img(img)
     if ok and pt:
         tap(wk, *pt)
-        if not sleep_coop(wk, 2.0): return False
+        if not _wait_feed(wk): return False
         return True
 
     # vuốt phải→trái, mỗi lần thử lại
@@ -161,12 +157,12 @@ def _open_guild_hall(wk) -> bool:
         if aborted(wk): return False
         swipe(wk, 280, 980, 0, 980, dur_ms=450)
         if not sleep_coop(wk, 0.3): return False
-        img = grab_screen_np(wk)
+        img = grab_screen_np(wk, region=REG_SANH)
         ok, pt, _ = find_on_frame(img, IMG_SANH, region=REG_SANH)
         free_img(img)
         if ok and pt:
             tap(wk, *pt)
-            if not sleep_coop(wk, 2.0): return False
+            if not _wait_feed(wk): return False
             return True
     return False
 
@@ -189,7 +185,7 @@ def _enter_hall_until_feed(wk) -> bool:
         free_img(img)
         if ok_sanh and pt_sanh:
             tap(wk, *pt_sanh)
-            if not sleep_coop(wk, 2.0): return False
+            if not _wait_feed(wk): return False
             continue
         if (i % 5) == 0: mem_relief()
         return False
@@ -200,7 +196,7 @@ def _fling_and_find_leave(wk) -> bool:
     """
     Ở trang 'Động thái':
       - Vuốt dọc 2 lần (478,1345)->(478,1)
-      - Đợi 1s, tìm 'roi-khoi-lien-minh' & 'xac-nhan-roi-lm'
+      - Chờ danh sách hết cuộn (tối đa 1s), tìm 'roi-khoi-lien-minh' & 'xac-nhan-roi-lm'
       - Nếu chưa thấy, tiếp tục các vòng fling + tìm cho tới khi thấy hoặc bị hủy
     """
     tap(wk, 540, 1000)
@@ -212,26 +208,26 @@ def _fling_and_find_leave(wk) -> bool:
         swipe(wk, 478, 1345, 478, 1, dur_ms=450)
         if not sleep_coop(wk, 0.15): return False
 
-    if not sleep_coop(wk, 1.0): return False
+    wait_until(wk, screen_settled(REG_FEED_LIST), 1.0, region=REG_FEED_LIST,
+               label="Cuộn Động thái", baseline=1.0)
+    if aborted(wk): return False
 
     # kiểm tra nút rời
     def _try_click_leave():
-        img = grab_screen_np(wk)
+        img = grab_screen_np(wk, region=REG_BTN_ROI)
         ok_roi, pt_roi, _ = find_on_frame(img, IMG_ROI, region=REG_BTN_ROI)
         free_img(img)
         if ok_roi and pt_roi:
             tap(wk, *pt_roi)
             # đợi & bấm xác nhận rời
-            for _ in range(12):
-                if aborted(wk): return False
-                img2 = grab_screen_np(wk)
-                ok_xn, pt_xn, _ = find_on_frame(img2, IMG_XN_ROI, region=REG_XAC_NHAN_ROI)
-                free_img(img2)
-                if ok_xn and pt_xn:
-                    tap(wk, *pt_xn)
-                    if not sleep_coop(wk, 0.4): return False
-                    return True
-                if not sleep_coop(wk, 0.2): return False
+            pt_xn = wait_until(wk, tpl_visible(IMG_XN_ROI, REG_XAC_NHAN_ROI, stable=True), 2.4,
+                               region=REG_XAC_NHAN_ROI)
+            if aborted(wk): return False
+            if pt_xn:
+                tap(wk, *pt_xn)
+                wait_until(wk, tpl_gone(IMG_XN_ROI, REG_XAC_NHAN_ROI), 0.4, region=REG_XAC_NHAN_ROI,
+                           label="Xác nhận rời", baseline=0.4)
+                return not aborted(wk)
         return None  # chưa thấy
 
     got = _try_click_leave()
@@ -249,7 +245,9 @@ def _fling_and_find_leave(wk) -> bool:
             if aborted(wk): return False
             swipe(wk, 478, 1345, 478, 1, dur_ms=450)
             if not sleep_coop(wk, 0.12): return False
-        if not sleep_coop(wk, 1.0): return False
+        wait_until(wk, screen_settled(REG_FEED_LIST), 1.0, region=REG_FEED_LIST,
+                   label="Cuộn Động thái", baseline=1.0)
+        if aborted(wk): return False
 
         got = _try_click_leave()
         if got is True:
@@ -258,7 +256,7 @@ def _fling_and_find_leave(wk) -> bool:
             return False
 
         # vẫn chưa thấy nút rời → đảm bảo còn ở trang Động thái (tùy chọn)
-        img = grab_screen_np(wk)
+        img = grab_screen_np(wk, region=REG_DONG_THAI)
         ok_feed, _, _ = find_on_frame(img, IMG_DONG_THAI, region=REG_DONG_THAI)
         free_img(img)
         if not ok_feed:
@@ -276,36 +274,29 @@ def _verify_left(wk) -> bool:
       - Nếu thấy INSIDE ⇒ CHƯA rời; False
       - Nếu chưa rõ → poll tiếp (ưu tiên 'kiem-tra-chung' trước)
     """
+    memo = roi_memo(wk)
     # ESC cho tới khi thấy outside
     while True:
         if aborted(wk): return False
-        img = grab_screen_np(wk)
-        ok_out, _, _ = find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE)
+        img = grab_screen_np(wk, region=REG_OUTSIDE)
+        ok_out, _, _ = find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE, memo=memo)
         free_img(img)
         if ok_out:
             break
         adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
         if not sleep_coop(wk, ESC_DELAY): return False
 
-    # TAP outside → kiểm tra
+    # TAP outside → kiểm tra kép trên từng frame mới (trước: 1.5s + 12 x 0.25s), ƯU TIÊN 'kiem-tra-chung'
     tap_center(wk, REG_OUTSIDE)
-    if not sleep_coop(wk, 1.5): return False
-
-    # Kiểm tra kép nhiều nhịp, ƯU TIÊN 'kiem-tra-chung'
-    for _ in range(12):
-        if aborted(wk): return False
-        img2 = grab_screen_np(wk)
-        state = _check_left_or_inside_from_img(img2) if img2 is not None else None
-        free_img(img2)
-
-        if state == "left":
-            log_wk(wk, "✅ Đã rời Liên minh (thấy 'kiem-tra-chung').")
-            return True
-        if state == "inside":
-            log_wk(wk, "⚠️ Vẫn thấy Liên minh (inside) → chưa rời được.")
-            return False
-
-        if not sleep_coop(wk, 0.25): return False
+    state = wait_until(wk, lambda img: _check_left_or_inside_from_img(img, memo), 4.5,
+                       label="Kiểm tra đã rời", baseline=1.5)
+    if aborted(wk): return False
+    if state == "left":
+        log_wk(wk, "✅ Đã rời Liên minh (thấy 'kiem-tra-chung').")
+        return True
+    if state == "inside":
+        log_wk(wk, "⚠️ Vẫn thấy Liên minh (inside) → chưa rời được.")
+        return False
 
     log_wk(wk, "ℹ️ Không xác nhận được trạng thái rời. Sẽ thử lại quy trình rời.")
     return False
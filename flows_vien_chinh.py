@@ -19,9 +19,16 @@ from module import (
     grab_screen_np as _grab_screen_np,
     # (SỬA LỖI) Thêm find_on_frame vào danh sách import
     find_on_frame,
+    find_many_on_frame,
     DEFAULT_THR as THR_DEFAULT,
     free_img as _free_img,
-    mem_relief as _mem_relief,resource_path
+    mem_relief as _mem_relief,
+    wait_until as _wait_until,
+    tpl_visible as _tpl_visible,
+    tpl_gone as _tpl_gone,
+    screen_settled as _screen_settled,
+    any_of as _any_of,
+    resource_path
 )
 
 # ===== REGIONS =====
@@ -46,6 +53,8 @@ IMG_DONG = resource_path("images/lien_minh/nut-dong.png")
 # ===== PARAMS =====
 ESC_DELAY = 1.0
 CLICK_DELAY = 0.4
+OPEN_WAIT = 2.8       # tap outside → chờ INSIDE (= 0.8s + 10 nhịp 0.2s cũ)
+TRINH_SAT_WAIT = 4.4  # tap 'viễn chinh' → chờ 'trinh-sat' (= CLICK_DELAY + 20 nhịp 0.2s cũ)
 
 
 # ================= core =================
@@ -59,43 +68,54 @@ def _ensure_inside_hard(wk) -> bool:
     # 1) nếu đang inside → ESC đến khi mất inside
     while True:
         if _aborted(wk): return False
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_INSIDE)
         ok_in, _, _ = find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
         _free_img(img)
         if not ok_in:
             break
         _adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)  # ESC
-        if not _sleep_coop(wk, ESC_DELAY): return False
+        _wait_until(wk, _tpl_gone(IMG_INSIDE, REG_INSIDE, THR_DEFAULT), ESC_DELAY, region=REG_INSIDE,
+                    label="Viễn chinh: ESC rời INSIDE", baseline=ESC_DELAY)
 
     # 2) mở lại từ outside
     while True:
         if _aborted(wk): return False
         img = _grab_screen_np(wk)
 
-        ok_in, _, _ = find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
+        (ok_in, _, _), (ok_out, _, _) = find_many_on_frame(img, [
+            (IMG_INSIDE, REG_INSIDE, THR_DEFAULT),
+            (IMG_OUTSIDE, REG_OUTSIDE, THR_DEFAULT),
+        ])
+        _free_img(img)
         if ok_in:
-            _free_img(img)
             return True
 
-        ok_out, _, _ = find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE, threshold=THR_DEFAULT)
-        _free_img(img)
         if ok_out:
             _tap_center(wk, REG_OUTSIDE)
-            if not _sleep_coop(wk, 0.8): return False
-            # chờ INSIDE xuất hiện tối đa 10 nhịp
-            for _ in range(10):
-                if _aborted(wk): return False
-                img2 = _grab_screen_np(wk)
-                ok_in2, _, _ = find_on_frame(img2, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
-                _free_img(img2)
-                if ok_in2:
-                    return True
-                if not _sleep_coop(wk, 0.2): return False
+            # chờ INSIDE xuất hiện trên frame mới
+            if _wait_until(wk, _tpl_visible(IMG_INSIDE, REG_INSIDE, THR_DEFAULT), OPEN_WAIT, region=REG_INSIDE,
+                           label="Viễn chinh: mở Liên minh", baseline=OPEN_WAIT):
+                return True
             continue
 
         # không thấy cả 2 → ESC 1 cái rồi tìm tiếp outside
         _adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
-        if not _sleep_coop(wk, ESC_DELAY): return False
+        _wait_until(wk, _any_of(_tpl_visible(IMG_INSIDE, REG_INSIDE, THR_DEFAULT),
+                                _tpl_visible(IMG_OUTSIDE, REG_OUTSIDE, THR_DEFAULT)),
+                    ESC_DELAY, label="Viễn chinh: ESC dọn popup", baseline=ESC_DELAY)
+
+
+def _wait_trinh_sat(wk) -> bool:
+    """Sau khi vừa TAP 'viễn chinh': chờ 'trinh-sat' xuất hiện trên frame mới."""
+    return bool(_wait_until(wk, _tpl_visible(IMG_TRINH_SAT, REG_TRINH_SAT, THR_DEFAULT), TRINH_SAT_WAIT,
+                            region=REG_TRINH_SAT, label="Viễn chinh: chờ 'trinh-sat'",
+                            baseline=TRINH_SAT_WAIT))
+
+
+def _swipe_settle(wk, x1, y1, x2, y2):
+    """Vuốt danh sách rồi chờ vùng tìm đứng yên (hết cuộn quán tính) thay vì ngủ cố định 0.3s."""
+    _swipe(wk, x1, y1, x2, y2, dur_ms=450)
+    _wait_until(wk, _screen_settled(REG_FIND), 0.3, region=REG_FIND, label="Viễn chinh: vuốt", baseline=0.3)
 
 
 def _open_expedition(wk) -> bool:
@@ -111,30 +131,18 @@ def _open_expedition(wk) -> bool:
             return False
 
         # 0) thử tìm ngay khi chưa vuốt
-        img0 = _grab_screen_np(wk)
+        img0 = _grab_screen_np(wk, region=REG_FIND)
         ok0, pt0, _ = find_on_frame(img0, IMG_VIEN_CHINH, region=REG_FIND, threshold=THR_DEFAULT)
         _free_img(img0)
         if ok0 and pt0:
             _tap(wk, *pt0)
-            if not _sleep_coop(wk, CLICK_DELAY): return False
-            # đợi trinh-sat xuất hiện
-            for _ in range(20):
-                if _aborted(wk): return False
-                imgts = _grab_screen_np(wk)
-                okt, _, _ = find_on_frame(imgts, IMG_TRINH_SAT, region=REG_TRINH_SAT, threshold=THR_DEFAULT)
-                _free_img(imgts)
-                if okt: return True
-                if not _sleep_coop(wk, 0.2): return False
+            if _wait_trinh_sat(wk): return True
+            if _aborted(wk): return False
 
         # helper: sau khi vừa TAP 'viễn chinh' xong, chờ 'trinh-sat'
         def _wait_trinh_sat_after_tap() -> bool:
-            for _ in range(20):
-                if _aborted(wk): return False
-                imgts = _grab_screen_np(wk)
-                okt, _, _ = find_on_frame(imgts, IMG_TRINH_SAT, region=REG_TRINH_SAT, threshold=THR_DEFAULT)
-                _free_img(imgts)
-                if okt: return True
-                if not _sleep_coop(wk, 0.2): return False
+            if _wait_trinh_sat(wk): return True
+            if _aborted(wk): return False
             # không thấy → ESC để rời màn hiện tại rồi vòng lại
             _adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
             if not _sleep_coop(wk, ESC_DELAY): return False
@@ -145,26 +153,24 @@ def _open_expedition(wk) -> bool:
             if _aborted(wk): return False
 
             # check trước swipe
-            img1 = _grab_screen_np(wk)
+            img1 = _grab_screen_np(wk, region=REG_FIND)
             ok1, pt1, _ = find_on_frame(img1, IMG_VIEN_CHINH, region=REG_FIND, threshold=THR_DEFAULT)
             _free_img(img1)
             if ok1 and pt1:
                 _tap(wk, *pt1)
-                if not _sleep_coop(wk, CLICK_DELAY): return False
                 if _wait_trinh_sat_after_tap(): return True
                 break  # quay vòng ngoài để làm lại
 
             # swipe 1 cái
-            _swipe(wk, 280, 980, 880, 980, dur_ms=450)  # trong màn → gần mép phải
-            if not _sleep_coop(wk, 0.3): return False
+            _swipe_settle(wk, 280, 980, 880, 980)  # trong màn → gần mép phải
+            if _aborted(wk): return False
 
             # check ngay sau swipe
-            img2 = _grab_screen_np(wk)
+            img2 = _grab_screen_np(wk, region=REG_FIND)
             ok2, pt2, _ = find_on_frame(img2, IMG_VIEN_CHINH, region=REG_FIND, threshold=THR_DEFAULT)
             _free_img(img2)
             if ok2 and pt2:
                 _tap(wk, *pt2)
-                if not _sleep_coop(wk, CLICK_DELAY): return False
                 if _wait_trinh_sat_after_tap(): return True
                 break
 
@@ -176,26 +182,24 @@ def _open_expedition(wk) -> bool:
             if _aborted(wk): return False
 
             # check trước swipe
-            img3 = _grab_screen_np(wk)
+            img3 = _grab_screen_np(wk, region=REG_FIND)
             ok3, pt3, _ = find_on_frame(img3, IMG_VIEN_CHINH, region=REG_FIND, threshold=THR_DEFAULT)
             _free_img(img3)
             if ok3 and pt3:
                 _tap(wk, *pt3)
-                if not _sleep_coop(wk, CLICK_DELAY): return False
                 if _wait_trinh_sat_after_tap(): return True
                 break
 
             # swipe 1 cái
-            _swipe(wk, 880, 980, 280, 980, dur_ms=450)  # gần mép phải → trong màn
-            if not _sleep_coop(wk, 0.3): return False
+            _swipe_settle(wk, 880, 980, 280, 980)  # gần mép phải → trong màn
+            if _aborted(wk): return False
 
             # check ngay sau swipe
-            img4 = _grab_screen_np(wk)
+            img4 = _grab_screen_np(wk, region=REG_FIND)
             ok4, pt4, _ = find_on_frame(img4, IMG_VIEN_CHINH, region=REG_FIND, threshold=THR_DEFAULT)
             _free_img(img4)
             if ok4 and pt4:
                 _tap(wk, *pt4)
-                if not _sleep_coop(wk, CLICK_DELAY): return False
                 if _wait_trinh_sat_after_tap(): return True
                 break
 
@@ -229,7 +233,7 @@ def _do_trinh_sat_12_times(wk):
     done = 0
     while done < 12 and not _aborted(wk):
         # 1) xác nhận có 'Trinh sát'
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_TRINH_SAT)
         ok_ts, pt_ts, _ = find_on_frame(img, IMG_TRINH_SAT, region=REG_TRINH_SAT, threshold=THR_DEFAULT)
         _free_img(img)
         if not ok_ts or not pt_ts:
@@ -241,30 +245,40 @@ def _do_trinh_sat_12_times(wk):
 
         # 2) bấm 'Trinh sát'
         _tap(wk, *pt_ts)
-        if not _sleep_coop(wk, 0.25): return
+        # popup 'nut-den'/'nut-dong' có thể hiện hoặc không → chờ tối đa 0.25s như cũ, hiện sớm thì đi tiếp
+        _wait_until(wk, _any_of(_tpl_visible(IMG_DEN, REG_DEN, THR_DEFAULT),
+                                _tpl_visible(IMG_DONG, REG_DONG, THR_DEFAULT)),
+                    0.25, label="Trinh sát → popup", baseline=0.25)
+        if _aborted(wk): return
 
         # 3) nếu có 'nut-den' → bấm
-        img2 = _grab_screen_np(wk)
+        img2 = _grab_screen_np(wk, region=REG_DEN)
         ok_den, p_den, _ = find_on_frame(img2, IMG_DEN, region=REG_DEN, threshold=THR_DEFAULT)
         _free_img(img2)
         if ok_den and p_den:
             _tap(wk, *p_den)
-            if not _sleep_coop(wk, 0.2): return
+            _wait_until(wk, _tpl_gone(IMG_DEN, REG_DEN, THR_DEFAULT), 0.2, region=REG_DEN,
+                        label="Trinh sát: bấm 'đến'", baseline=0.2)
+            if _aborted(wk): return
 
         # 4) nếu có 'nut-dong' → bấm
-        img3 = _grab_screen_np(wk)
+        img3 = _grab_screen_np(wk, region=REG_DONG)
         ok_dong, p_dong, _ = find_on_frame(img3, IMG_DONG, region=REG_DONG, threshold=THR_DEFAULT)
         _free_img(img3)
         if ok_dong and p_dong:
             _tap(wk, *p_dong)
-            if not _sleep_coop(wk, 0.2): return
+            _wait_until(wk, _tpl_gone(IMG_DONG, REG_DONG, THR_DEFAULT), 0.2, region=REG_DONG,
+                        label="Trinh sát: bấm 'đóng'", baseline=0.2)
+            if _aborted(wk): return
 
         done += 1
         _log(wk, f"Trinh sát thành công lần {done}/12")
 
         _mem_relief()
 
-        if not _sleep_coop(wk, 0.25): return
+        _wait_until(wk, _tpl_visible(IMG_TRINH_SAT, REG_TRINH_SAT, THR_DEFAULT), 0.25, region=REG_TRINH_SAT,
+                    label="Trinh sát: sẵn sàng lần kế", baseline=0.25)
+        if _aborted(wk): return
 
 
 def run_guild_expedition_flow(wk, log=print) -> bool:
@@ -297,23 +311,15 @@ def run_guild_expedition_flow(wk, log=print) -> bool:
 
     # ESC → chờ OUTSIDE rồi kết thúc
     _adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
-    if not _sleep_coop(wk, 1.0):
+    ok_out = _wait_until(wk, _tpl_visible(IMG_OUTSIDE, REG_OUTSIDE, THR_DEFAULT), 5.0, region=REG_OUTSIDE,
+                         label="Viễn chinh: ESC → OUTSIDE", baseline=1.0)
+    if _aborted(wk):
         _mem_relief()
         return False
-    for _ in range(20):
-        if _aborted(wk):
-            _mem_relief()
-            return False
-        img = _grab_screen_np(wk)
-        ok_out, _, _ = find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE, threshold=THR_DEFAULT)
-        _free_img(img)
-        if ok_out:
-            _log(wk, "✅ Hoàn tất Viễn chinh (đã về màn có Liên minh outside).")
-            _mem_relief()
-            return True
-        if not _sleep_coop(wk, 0.2):
-            _mem_relief()
-            return False
+    if ok_out:
+        _log(wk, "✅ Hoàn tất Viễn chinh (đã về màn có Liên minh outside).")
+        _mem_relief()
+        return True
 
     _log(wk, "ℹ️ Không xác nhận được OUTSIDE sau ESC, nhưng đã rời viễn chinh.")
     _mem_relief()
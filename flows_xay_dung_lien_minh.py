@@ -14,11 +14,16 @@ from module import (
     adb_safe as _adb_safe,
     grab_screen_np as _grab_screen_np,
     find_on_frame as _find_on_frame,
+    roi_memo as _roi_memo,
+    find_many_on_frame as _find_many_on_frame,
     tap as _tap,
     tap_center as _tap_center,
     swipe as _swipe,
     aborted as _aborted,
     sleep_coop as _sleep_coop,
+    wait_until as _wait_until,
+    tpl_visible as _tpl_visible,
+    any_of as _any_of,
     free_img as _free_img,
     mem_relief as _mem_relief,
     DEFAULT_THR as THR_DEFAULT,
@@ -56,6 +61,8 @@ IMG_NUT_BAM_XAY_DUNG    = resource_path("images/lien_minh/nut-bam-xay-dung.png")
 THR_DEFAULT = 0.86
 ESC_DELAY   = 1.5
 CLICK_DELAY = 0.5
+# Thời gian xem quảng cáo tối thiểu để nhận thưởng: chờ nội dung QC chứ không phải chờ UI → giữ cố định
+AD_WATCH_SECS = 5.0
 
 
 # ========= các bước con =========
@@ -72,7 +79,7 @@ def _open_build_menu(wk) -> bool:
     Vuốt để mở mục 'xây dựng liên minh' rồi TAP.
     """
     # check & mở ngay nếu thấy
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_BUILD_ICON)
     ok, pt, _ = _find_on_frame(img, IMG_BUILD_ICON, region=REG_BUILD_ICON, threshold=THR_DEFAULT)
     _free_img(img)
     if ok and pt:
@@ -91,8 +98,9 @@ def _open_build_menu(wk) -> bool:
 def _ensure_build_inside(wk) -> bool:
     for _ in range(8):
         if _aborted(wk): return False
-        img = _grab_screen_np(wk)
-        ok_in, _, _ = _find_on_frame(img, IMG_BUILD_INSIDE, region=REG_BUILD_INSIDE, threshold=THR_DEFAULT)
+        img = _grab_screen_np(wk, region=REG_BUILD_INSIDE)
+        ok_in, _, _ = _find_on_frame(img, IMG_BUILD_INSIDE, region=REG_BUILD_INSIDE, threshold=THR_DEFAULT,
+                                     memo=_roi_memo(wk))
         _free_img(img)
         if ok_in:
             return True
@@ -102,25 +110,29 @@ def _ensure_build_inside(wk) -> bool:
 def _watch_ads_loop(wk):
     while True:
         if _aborted(wk): return
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_XEM_QC)
         ok_qc, pt_qc, _ = _find_on_frame(img, IMG_XEM_QC, region=REG_XEM_QC, threshold=THR_DEFAULT)
         _free_img(img)
         if not ok_qc:
             break
         if pt_qc: _tap(wk, *pt_qc)
-        if not _sleep_coop(wk, 0.4): return
 
-        img2 = _grab_screen_np(wk)
-        ok_vid, pt_vid, _ = _find_on_frame(img2, IMG_XEM_VIDEO, region=REG_XEM_VIDEO, threshold=THR_DEFAULT)
-        _free_img(img2)
-        if ok_vid and pt_vid:
+        # chờ nút 'xem video' hiện & đứng yên (trước: ngủ 0.4s rồi dò 1 lần)
+        pt_vid = _wait_until(wk, _tpl_visible(IMG_XEM_VIDEO, REG_XEM_VIDEO, THR_DEFAULT, stable=True), 1.0,
+                             region=REG_XEM_VIDEO, label="QC → nút xem video", baseline=0.4)
+        if _aborted(wk): return
+        if pt_vid:
             _tap(wk, *pt_vid)
 
-        if not _sleep_coop(wk, 5.0): return
+        if not _sleep_coop(wk, AD_WATCH_SECS): return
         _tap(wk, 748, 1135)  # đóng video
-        if not _sleep_coop(wk, 0.7): return
+        # chờ quay lại màn xây dựng (nút QC kế tiếp hoặc header xây dựng) thay vì ngủ 0.7s
+        _wait_until(wk, _any_of(_tpl_visible(IMG_XEM_QC, REG_XEM_QC, THR_DEFAULT),
+                                _tpl_visible(IMG_BUILD_INSIDE, REG_BUILD_INSIDE, THR_DEFAULT)),
+                    0.7, label="Đóng video", baseline=0.7)
+        if _aborted(wk): return
 
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_BUILD_INSIDE)
     ok_build_in, _, _ = _find_on_frame(img, IMG_BUILD_INSIDE, region=REG_BUILD_INSIDE, threshold=THR_DEFAULT)
     _free_img(img)
     if ok_build_in:
@@ -129,7 +141,7 @@ def _watch_ads_loop(wk):
         _tap(wk, 450, 1191)
         if not _sleep_coop(wk, 0.4): return
 
-    img = _grab_screen_np(wk)
+    img = _grab_screen_np(wk, region=REG_BUILD_INSIDE)
     ok_build_in, _, _ = _find_on_frame(img, IMG_BUILD_INSIDE, region=REG_BUILD_INSIDE, threshold=THR_DEFAULT)
     _free_img(img)
     if ok_build_in:
@@ -142,8 +154,10 @@ def _back_to_inside(wk):
     while True:
         if _aborted(wk): return
         img = _grab_screen_np(wk)
-        ok_in, _, _ = _find_on_frame(img, IMG_INSIDE, region=REG_INSIDE, threshold=THR_DEFAULT)
-        ok_out, _, _ = _find_on_frame(img, IMG_OUTSIDE, region=REG_OUTSIDE, threshold=THR_DEFAULT)
+        (ok_in, _, _), (ok_out, _, _) = _find_many_on_frame(img, [
+            (IMG_INSIDE, REG_INSIDE, THR_DEFAULT),
+            (IMG_OUTSIDE, REG_OUTSIDE, THR_DEFAULT),
+        ])
         _free_img(img)
         if ok_in:
             return
@@ -168,7 +182,7 @@ def _build_wall(wk):
         if not _ensure_inside(wk):
             return
 
-        img = _grab_screen_np(wk)
+        img = _grab_screen_np(wk, region=REG_TUONG_THANH_ICON)
         ok_wall, pt_wall, _ = _find_on_frame(img, IMG_TUONG_THANH_ICON, region=REG_TUONG_THANH_ICON, threshold=THR_DEFAULT)
         _free_img(img)
         if ok_wall and pt_wall:
@@ -180,7 +194,7 @@ def _build_wall(wk):
             if _aborted(wk): return
             _swipe(wk, 280, 980, 920, 980, dur_ms=450)   # kéo trái->phải (nội dung trượt sang trái)
             if not _sleep_coop(wk, SWIPE_PAUSE): return
-            img = _grab_screen_np(wk)
+            img = _grab_screen_np(wk, region=REG_TUONG_THANH_ICON)
             ok_wall, pt_wall, _ = _find_on_frame(img, IMG_TUONG_THANH_ICON, region=REG_TUONG_THANH_ICON, threshold=THR_DEFAULT)
             _free_img(img)
             if ok_wall and pt_wall:
@@ -203,7 +217,7 @@ def _build_wall(wk):
     waited = 0
     while True:
         if _aborted(wk): return
-        img2 = _grab_screen_np(wk)
+        img2 = _grab_screen_np(wk, region=REG_NUT_BAM_XAY_DUNG)
         ok_btn, pt_btn, _ = _find_on_frame(img2, IMG_NUT_BAM_XAY_DUNG, region=REG_NUT_BAM_XAY_DUNG, threshold=THR_DEFAULT)
         _free_img(img2)
         if ok_btn and pt_btn:
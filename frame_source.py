@@ -0,0 +1,468 @@
+# frame_source.py
+# ==========================================================
+#  Lớp nguồn khung hình (frame source) đứng sau grab_screen_np(wk)
+#  - raw    : `adb exec-out screencap` (RGBA thô, không PNG, không file tạm)
+#  - minicap: stream JPEG qua MinicapManager (đọc nền, luôn giữ frame mới nhất)
+#  - file   : cách cũ screencap -> pull -> đọc -> rm (dự phòng)
+#  Backend được chọn theo từng thiết bị khi worker khởi động.
+#  FramePump: thread chụp nền theo thiết bị, giữ frame mới nhất (bộ đệm đôi).
+#  grab(region=...): chỉ giải mã/trả vùng cần dùng (RegionFrame có .origin).
+#  Region theo toạ độ tham chiếu 900x1600; frame giữ độ phân giải thật của nguồn (.scale).
+# ==========================================================
+from __future__ import annotations
+
+import struct
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from module import RegionFrame, _clip_region, adb_bin_safe, crop_frame, log_wk, screencap_bytes_wk, tag_frame
+from screen_space import REF_W, scale_region
+
+# Thứ tự ưu tiên khi dò backend cho 1 thiết bị
+FRAME_BACKENDS = ("minicap", "raw", "file")
+# Cứ mỗi N frame thì log thống kê fps/độ trễ một lần
+STATS_LOG_EVERY = 200
+# Pump tự nghỉ nếu không ai lấy frame trong khoảng này (giây) để không tốn CPU/băng thông
+PUMP_IDLE_AFTER = 2.0
+
+# Định dạng pixel của screencap thô (android/graphics PixelFormat)
+_RAW_FMT_RGBA_8888 = 1
+_RAW_FMT_RGBX_8888 = 2
+_RAW_FMT_BGRA_8888 = 5
+
+
+def _wk_log(wk, msg: str):
+    if hasattr(wk, "_log"):
+        wk._log(msg)
+    else:
+        log_wk(wk, msg)
+
+
+# ================== THỐNG KÊ ==================
+class FrameStats:
+    """Đếm frame, tính fps và độ trễ chụp (cửa sổ trượt) cho 1 thiết bị."""
+
+    def __init__(self, window: int = 60):
+        self._lock = threading.Lock()
+        self._samples: deque[tuple[float, float]] = deque(maxlen=window)  # (thời điểm xong, độ trễ giây)
+        self.frames = 0
+        self.failures = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self.frames += 1
+            self._samples.append((time.perf_counter(), latency))
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+            frames, failures = self.frames, self.failures
+        fps = 0.0
+        if len(samples) >= 2:
+            span = samples[-1][0] - samples[0][0]
+            if span > 0:
+                fps = (len(samples) - 1) / span
+        lat = [s[1] for s in samples]
+        return {
+            "frames": frames,
+            "failures": failures,
+            "fps": fps,
+            "avg_ms": (sum(lat) / len(lat) * 1000.0) if lat else 0.0,
+            "last_ms": (lat[-1] * 1000.0) if lat else 0.0,
+        }
+
+
+# ================== NGUỒN KHUNG HÌNH ==================
+class FrameSource:
+    """Giao diện chung: open() → grab() nhiều lần → close()."""
+    name = "base"
+
+    def __init__(self, wk):
+        self.wk = wk
+        self.stats = FrameStats()
+
+    def open(self) -> bool:
+        return True
+
+    def _grab(self, region=None) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def grab(self, region=None) -> Optional[np.ndarray]:
+        """
+        Chụp 1 frame ở độ phân giải thật của nguồn (gắn .scale nếu khác 900x1600);
+        region=(x1,y1,x2,y2) theo toạ độ tham chiếu → chỉ trả vùng đó (RegionFrame).
+        """
+        t0 = time.perf_counter()
+        try:
+            img = self._grab(region)
+        except Exception as e:
+            _wk_log(self.wk, f"[{self.name}] Lỗi chụp màn hình: {e}")
+            img = None
+        if img is None:
+            self.stats.record_failure()
+            return None
+        self.stats.record(time.perf_counter() - t0)
+        if self.stats.frames % STATS_LOG_EVERY == 0:
+            _wk_log(self.wk, self.describe())
+        return img
+
+    def describe(self) -> str:
+        s = self.stats.snapshot()
+        return (f"[{self.name}] {s['frames']} frame, lỗi {s['failures']} | "
+                f"{s['fps']:.1f} fps | trễ TB {s['avg_ms']:.0f} ms (gần nhất {s['last_ms']:.0f} ms)")
+
+    def close(self):
+        pass
+
+
+def decode_raw_screencap(data: bytes, region=None) -> Optional[np.ndarray]:
+    """
+    Giải mã output của `screencap` (không -p): header w,h,format (+ colorspace ở Android 9+)
+    rồi tới w*h*4 byte pixel. Trả ảnh BGR hoặc None nếu không hợp lệ.
+    region (toạ độ tham chiếu) → chỉ đổi màu các hàng/cột trong vùng, trả RegionFrame.
+    """
+    if not data or len(data) < 12:
+        return None
+    w, h, fmt = struct.unpack_from("<III", data, 0)
+    if w <= 0 or h <= 0:
+        return None
+    n = w * h * 4
+    header = len(data) - n
+    if header not in (12, 16):
+        return None
+    px = np.frombuffer(data, dtype=np.uint8, count=n, offset=header).reshape(h, w, 4)
+    scale = w / float(REF_W)
+    origin = None
+    if region is not None:
+        box = _clip_region(px.shape, scale_region(region, scale))
+        if box is None:
+            return None
+        x1, y1, x2, y2 = box
+        px = px[y1:y2, x1:x2]
+        origin = (x1, y1)
+    if fmt in (_RAW_FMT_RGBA_8888, _RAW_FMT_RGBX_8888):
+        img = cv2.cvtColor(px, cv2.COLOR_RGBA2BGR)
+    elif fmt == _RAW_FMT_BGRA_8888:
+        img = cv2.cvtColor(px, cv2.COLOR_BGRA2BGR)
+    else:
+        return None
+    return tag_frame(img, scale) if origin is None else RegionFrame(img, origin, scale)
+
+
+class RawScreencapSource(FrameSource):
+    """1 lệnh `exec-out screencap` mỗi frame, đọc RGBA thô trực tiếp từ stdout."""
+    name = "raw"
+
+    def _grab(self, region=None) -> Optional[np.ndarray]:
+        code, out, err = adb_bin_safe(self.wk, "exec-out", "screencap", timeout=5)
+        if code != 0 or not out:
+            return None
+        return decode_raw_screencap(out, region)
+
+
+class FileScreencapSource(FrameSource):
+    """Cách cũ (screencap ra /sdcard → pull → đọc → rm); chậm nhưng chạy được ở mọi nơi."""
+    name = "file"
+
+    def _grab(self, region=None) -> Optional[np.ndarray]:
+        raw = screencap_bytes_wk(self.wk)
+        if not raw:
+            return None
+        img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        img = tag_frame(img, img.shape[1] / float(REF_W))
+        return img if region is None else crop_frame(img, region, copy=True)
+
+
+class MinicapSource(FrameSource):
+    """
+    Stream JPEG của minicap. Minicap chỉ đẩy frame khi màn hình thay đổi nên
+    việc đọc socket chạy ở thread nền; grab() luôn trả frame mới nhất đã nhận.
+    Frame giữ NGUYÊN độ phân giải giảm của stream (không phóng lại): frame mang .scale,
+    find_on_frame/crop_frame tự đổi REG_* và dùng template đã thu nhỏ tương ứng.
+    """
+    name = "minicap"
+
+    def __init__(self, wk):
+        super().__init__(wk)
+        self._mgr = None
+        self._latest: Optional[np.ndarray] = None
+        self._seq = 0
+        self._seen = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+
+    def open(self) -> bool:
+        from minicap_manager import MinicapManager
+        self._mgr = MinicapManager(self.wk)
+        if not self._mgr.setup() or not self._mgr.start_stream():
+            self._mgr = None
+            return False
+        self._reader = threading.Thread(target=self._read_loop, name=f"Minicap-{self.wk.device_id}", daemon=True)
+        self._reader.start()
+        # chờ frame đầu tiên (minicap luôn gửi 1 frame ngay khi kết nối)
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest is not None or self._stop.is_set(), timeout=5.0)
+        return self._latest is not None
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            mgr = self._mgr
+            if mgr is None or mgr.client_socket is None:
+                break
+            img = mgr.get_frame()
+            if img is None:
+                continue
+            with self._cond:
+                self._latest = img
+                self._seq += 1
+                self._cond.notify_all()
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+
+    def _grab(self, region=None, wait_new: float = 0.1) -> Optional[np.ndarray]:
+        # chờ ngắn frame mới (màn hình đứng yên thì minicap không gửi gì → trả lại frame cũ, vẫn đúng)
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != self._seen or self._stop.is_set(), timeout=wait_new)
+            self._seen = self._seq
+            img = self._latest
+        if img is None:
+            return None
+        img = tag_frame(img, img.shape[1] / float(REF_W))
+        return img if region is None else crop_frame(img, region, copy=True)
+
+    def close(self):
+        self._stop.set()
+        mgr, self._mgr = self._mgr, None
+        if mgr is not None:
+            mgr.teardown()
+        if self._reader is not None:
+            self._reader.join(timeout=2.0)
+            self._reader = None
+
+
+_SOURCES = {
+    "minicap": MinicapSource,
+    "raw": RawScreencapSource,
+    "file": FileScreencapSource,
+}
+
+
+# ================== CHỌN / GẮN BACKEND CHO WORKER ==================
+def select_frame_source(wk, prefer=FRAME_BACKENDS) -> FrameSource:
+    """Dò lần lượt các backend, chọn cái đầu tiên mở được và trả về frame hợp lệ."""
+    for name in prefer:
+        cls = _SOURCES.get(name)
+        if cls is None:
+            continue
+        src = cls(wk)
+        try:
+            ok = src.open() and src.grab() is not None
+        except Exception as e:
+            _wk_log(wk, f"[{name}] Không dùng được: {e}")
+            ok = False
+        if ok:
+            _wk_log(wk, f"📷 Nguồn chụp màn hình: {name} ({src.describe()})")
+            return src
+        try:
+            src.close()
+        except Exception:
+            pass
+        _wk_log(wk, f"[{name}] Không khả dụng trên thiết bị này, thử backend tiếp theo…")
+    _wk_log(wk, "📷 Dùng nguồn chụp dự phòng: file")
+    return FileScreencapSource(wk)
+
+
+def attach_frame_source(wk, prefer=FRAME_BACKENDS) -> FrameSource:
+    detach_frame_source(wk)
+    src = select_frame_source(wk, prefer)
+    wk._frame_source = src
+    return src
+
+
+def detach_frame_source(wk):
+    src = getattr(wk, "_frame_source", None)
+    if src is None:
+        return
+    wk._frame_source = None
+    _wk_log(wk, src.describe())
+    try:
+        src.close()
+    except Exception:
+        pass
+
+
+def frame_stats(wk) -> Optional[dict]:
+    """Thống kê fps/độ trễ của backend đang gắn với worker (None nếu chưa gắn)."""
+    src = getattr(wk, "_frame_source", None)
+    if src is None:
+        return None
+    return dict(backend=src.name, **src.stats.snapshot())
+
+
+# ================== FRAME PUMP (chụp nền, "frame mới nhất") ==================
+class FramePump:
+    """
+    Thread chụp nền cho 1 thiết bị: liên tục lấy frame từ FrameSource vào bộ đệm đôi
+    (thread nền ghi vào buffer sau rồi đổi vai với buffer trước), người đọc luôn nhận
+    frame mới nhất mà không phải chờ chụp.
+
+    - Frame trả ra là CHỈ ĐỌC: nhiều phép so khớp có thể dùng chung 1 frame, không cần copy.
+    - Mỗi frame gắn mốc thời gian BẮT ĐẦU chụp (time.monotonic) → latest(newer_than=t)
+      đảm bảo frame được chụp sau thời điểm t (ví dụ sau lần tap gần nhất).
+    - Không ai đọc trong PUMP_IDLE_AFTER giây → pump tự nghỉ tới khi có người cần.
+    - Nếu gần đây chỉ có người hỏi theo region → pump chỉ chụp hình bao các region đó
+      (backend giải mã ít hơn); có người cần cả màn hình → chụp full.
+    """
+
+    def __init__(self, source: FrameSource, idle_after: float = PUMP_IDLE_AFTER):
+        self.source = source
+        self.idle_after = idle_after
+        self._cond = threading.Condition()
+        # mỗi buffer: (ảnh, mốc chụp, region đã chụp hoặc None = cả màn hình)
+        self._buffers: list[Optional[tuple[np.ndarray, float, Optional[tuple]]]] = [None, None]
+        self._front = 0
+        self._last_demand = 0.0
+        self._want_lock = threading.Lock()
+        self._want_full = 0.0
+        self._want_regions: dict[tuple, float] = {}
+        self._demand = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        dev = getattr(self.source.wk, "device_id", "?")
+        self._thread = threading.Thread(target=self._run, name=f"FramePump-{dev}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._demand.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def interrupt(self):
+        """Đánh thức mọi latest() đang chờ (để chúng tự kiểm tra lại token huỷ)."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _idle(self) -> bool:
+        return time.monotonic() - self._last_demand > self.idle_after
+
+    def _want(self, region, now: float):
+        with self._want_lock:
+            if region is None:
+                self._want_full = now
+            else:
+                self._want_regions[tuple(int(v) for v in region)] = now
+
+    def _capture_region(self) -> Optional[tuple]:
+        """Hình bao các region được hỏi gần đây; None nếu cần cả màn hình."""
+        now = time.monotonic()
+        with self._want_lock:
+            if now - self._want_full <= self.idle_after:
+                return None
+            self._want_regions = {r: t for r, t in self._want_regions.items() if now - t <= self.idle_after}
+            regs = list(self._want_regions)
+        if not regs:
+            return None
+        return (min(r[0] for r in regs), min(r[1] for r in regs),
+                max(r[2] for r in regs), max(r[3] for r in regs))
+
+    @staticmethod
+    def _covers(captured: Optional[tuple], region) -> bool:
+        if captured is None:
+            return True
+        if region is None:
+            return False
+        return (captured[0] <= region[0] and captured[1] <= region[1]
+                and captured[2] >= region[2] and captured[3] >= region[3])
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._idle():
+                self._demand.clear()
+                self._demand.wait(timeout=1.0)
+                continue
+            t0 = time.monotonic()
+            region = self._capture_region()
+            img = self.source.grab(region=region)
+            if img is None:
+                self._stop.wait(0.05)
+                continue
+            img.setflags(write=False)
+            back = 1 - self._front
+            self._buffers[back] = (img, t0, region)
+            with self._cond:
+                self._front = back
+                self._cond.notify_all()
+
+    def latest(self, newer_than: Optional[float] = None, timeout: float = 3.0,
+               region=None, cancel=None) -> tuple[Optional[np.ndarray], float]:
+        """
+        Trả (frame, mốc_thời_gian). Nếu có newer_than → chờ tới khi có frame chụp sau mốc đó.
+        region → chờ frame có phủ vùng đó, trả view RegionFrame (toạ độ màn hình).
+        cancel (CancelToken, đã on_cancel(pump.interrupt)) → huỷ là thôi chờ ngay.
+        Hết timeout vẫn chưa có / bị huỷ → (None, 0.0).
+        """
+        now = time.monotonic()
+        if self._idle():
+            # pump đang nghỉ → frame đang giữ đã cũ, bắt buộc chờ frame mới
+            newer_than = now if newer_than is None else max(newer_than, now)
+        self._want(region, now)
+        self._last_demand = now
+        self._demand.set()
+
+        def _ready():
+            cur = self._buffers[self._front]
+            return self._stop.is_set() or (cancel is not None and cancel.cancelled) or (
+                cur is not None
+                and (newer_than is None or cur[1] >= newer_than)
+                and self._covers(cur[2], region))
+
+        with self._cond:
+            if (not self._cond.wait_for(_ready, timeout=timeout) or self._stop.is_set()
+                    or (cancel is not None and cancel.cancelled)):
+                return None, 0.0
+            img, ts, _ = self._buffers[self._front]
+        if region is not None:
+            img = crop_frame(img, region)
+        return img, ts
+
+
+def start_frame_pump(wk, prefer=FRAME_BACKENDS) -> FramePump:
+    """Chọn backend cho thiết bị rồi bật thread chụp nền gắn vào worker (wk._frame_pump)."""
+    stop_frame_pump(wk)
+    src = getattr(wk, "_frame_source", None) or attach_frame_source(wk, prefer)
+    pump = FramePump(src)
+    pump.start()
+    wk._frame_pump = pump
+    tok = getattr(wk, "_cancel", None)
+    if tok is not None:
+        tok.on_cancel(pump.interrupt)
+    return pump
+
+
+def stop_frame_pump(wk):
+    pump = getattr(wk, "_frame_pump", None)
+    if pump is not None:
+        wk._frame_pump = None
+        pump.stop()
+    detach_frame_source(wk)
@@ -0,0 +1,178 @@
+# input_channel.py
+# ==========================================================
+#  Kênh input bền cho 1 thiết bị: giữ 1 tiến trình `adb shell` mở sẵn,
+#  ghi lệnh `input tap/swipe/keyevent/text` xuống stdin thay vì spawn
+#  1 subprocess `adb shell input ...` cho mỗi thao tác (100–300 ms trên Windows).
+#  Mỗi lệnh kèm 1 dòng sentinel `echo <mã> $?` → biết chắc lệnh đã chạy xong + exit code.
+#  Sentinel gõ vào bị tách chuỗi (__BBT""_IC_...) → dòng PTY dội lại (adbd cũ không shell_v2)
+#  không bao giờ trùng sentinel thật mà shell in ra.
+# ==========================================================
+from __future__ import annotations
+
+import itertools
+import os
+import queue
+import subprocess
+import threading
+import time
+from typing import Optional, Sequence
+
+# Tiền tố dòng sentinel (đủ lạ để không trùng output của lệnh)
+_SENTINEL = "__BBT_IC_"
+
+
+class InputChannel:
+    """
+    1 phiên `adb -s <serial> shell` giữ mở suốt vòng đời worker.
+    run(args) → (code, out, err) giống wk.adb(); trả None nếu kênh không dùng được
+    (chưa mở được / ống bị đứt) để người gọi quay về cách spawn subprocess cũ.
+    """
+
+    def __init__(self, adb_path: str, serial: str, log_cb=None):
+        self._adb = adb_path
+        self._serial = serial
+        self._log_cb = log_cb
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._reader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self.sent = 0
+        self.total_ms = 0.0
+
+    def _log(self, msg: str):
+        if self._log_cb:
+            try:
+                self._log_cb(msg)
+            except Exception:
+                pass
+
+    # ---------- vòng đời ----------
+    def is_open(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def open(self) -> bool:
+        if self.is_open():
+            return True
+        self.close()
+        try:
+            startupinfo = None
+            creationflags = 0
+            if os.name == 'nt':
+                startupinfo = subprocess.STARTUPINFO()
+                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                creationflags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+            self._proc = subprocess.Popen(
+                [self._adb, "-s", self._serial, "shell"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, encoding='utf-8', errors='ignore', bufsize=1,
+                startupinfo=startupinfo, creationflags=creationflags,
+            )
+        except Exception as e:
+            self._log(f"Không mở được kênh input (adb shell): {e}")
+            self._proc = None
+            return False
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_loop, args=(self._proc, self._lines),
+                                        name=f"Input-{self._serial}", daemon=True)
+        self._reader.start()
+        # xác nhận shell đã sẵn sàng
+        if self._exec("true", timeout=5) is None:
+            self._log("Kênh input không phản hồi, dùng lại cách cũ (1 lệnh adb mỗi thao tác).")
+            self.close()
+            return False
+        self._log("⌨️ Đã mở kênh input bền (adb shell).")
+        return True
+
+    def close(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            if proc.stdin:
+                proc.stdin.write("exit\n")
+                proc.stdin.flush()
+        except Exception:
+            pass
+        try:
+            proc.wait(timeout=1.0)
+        except Exception:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        if self._reader is not None:
+            self._reader.join(timeout=1.0)
+            self._reader = None
+
+    @staticmethod
+    def _read_loop(proc, lines):
+        try:
+            for line in proc.stdout:
+                lines.put(line.rstrip("\r\n"))
+        except Exception:
+            pass
+        lines.put(None)  # EOF
+
+    # ---------- chạy lệnh ----------
+    def _exec(self, cmd: str, timeout: float):
+        """Ghi 1 lệnh + sentinel, chờ sentinel. Trả (code, out) | None nếu kênh hỏng/timeout."""
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            return None
+        n = next(self._seq)
+        tag = f"{_SENTINEL}{n}__"
+        # chữ gõ vào KHÁC chữ in ra (chuỗi bị tách bằng ""), `echo` trống kết thúc dòng output dở
+        typed = f'{_SENTINEL[:5]}""{_SENTINEL[5:]}{n}__'
+        try:
+            proc.stdin.write(f"{cmd}; __ic=$?; echo; echo {typed}$__ic\n")
+            proc.stdin.flush()
+        except Exception:
+            return None
+        out = []
+        end = time.monotonic() + timeout
+        while True:
+            left = end - time.monotonic()
+            if left <= 0:
+                return None
+            try:
+                line = self._lines.get(timeout=left)
+            except queue.Empty:
+                return None
+            if line is None:
+                return None
+            if not line.startswith(tag):
+                out.append(line)
+                continue
+            try:
+                code = int(line[len(tag):].strip())
+            except ValueError:
+                out.append(line)  # không phải sentinel hoàn chỉnh → đọc tiếp
+                continue
+            if out and not out[-1]:
+                out.pop()  # dòng trống do `echo` chèn trước sentinel
+            return code, "\n".join(out)
+
+    def run(self, args: Sequence[str], timeout: float = 3):
+        """
+        args như sau chữ `shell` của adb (vd: ("input", "tap", "100", "200")).
+        Ghép bằng dấu cách y như `adb shell a b c` → hành vi giống hệt cách cũ.
+        """
+        with self._lock:
+            if not self.is_open():
+                return None
+            t0 = time.perf_counter()
+            res = self._exec(" ".join(str(a) for a in args), timeout=timeout)
+            if res is None:
+                # không chắc lệnh đã chạy hay chưa → KHÔNG chạy lại, chỉ đóng kênh để lần sau mở mới
+                self._log("Kênh input mất phản hồi, sẽ mở lại ở thao tác sau.")
+                self.close()
+                return 124, "", "timeout"
+            self.sent += 1
+            self.total_ms += (time.perf_counter() - t0) * 1000.0
+            code, out = res
+            return code, out, ""
+
+    def describe(self) -> str:
+        avg = self.total_ms / self.sent if self.sent else 0.0
+        return f"Kênh input: {self.sent} lệnh, TB {avg:.1f} ms/lệnh"
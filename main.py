@@ -5,14 +5,17 @@ import subprocess
 import socket
 from pathlib import Path
 from typing import Optional, List, Set
-import re
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from PySide6.QtCore import QObject, QThread, QTimer, Signal, Qt
 from PySide6.QtWidgets import QApplication, QCheckBox, QTableWidgetItem, QDialog, QMessageBox, QProgressDialog
 from config import PLATFORM_TOOLS_ADB_PATH
+from module import preload_templates, foreground_component, get_ocr_engine, get_ocr_cache, roi_memo_stats, wait_stats
+from adb_client import native_adb
+from device_tracker import DeviceTracker
 
-from ui_main import MainWindow, ADB_PATH, list_adb_ports_with_status, list_known_ports_from_data
+from ui_main import MainWindow, ADB_PATH, list_known_ports_from_data
 from ui_auth import CloudClient, AuthDialog
 
 CURRENT_VERSION = "1.0"  # Đặt phiên bản hiện tại của ứng dụng ở đây
@@ -191,12 +194,19 @@ class EmulatorWorker(QObject):
         return self._running
 
     def adb(self, *args, timeout=6):
+        # Ưu tiên nói chuyện trực tiếp với adb server (không spawn adb.exe)
+        res = native_adb(self._serial, args, timeout=timeout)
+        if res is not None:
+            return res[0], res[1].strip(), res[2].strip()
         if not self._adb: return -1, "", "adb not found"
         # Logic để chọn đúng adb.exe cho LDPlayer nếu cần
         # Hiện tại, giả định một adb chung có thể thấy tất cả devices
         return run_cmd([self._adb, "-s", self._serial, *args], timeout)
 
     def adb_no_serial(self, *args, timeout=6):
+        res = native_adb(None, args, timeout=timeout)
+        if res is not None:
+            return res[0], res[1].strip(), res[2].strip()
         if not self._adb: return -1, "", "adb not found"
         return run_cmd([self._adb, *args], timeout)
 
@@ -214,17 +224,8 @@ class EmulatorWorker(QObject):
         return code == 0 and out.strip() == "1"
 
     def _top_component_precise(self) -> str | None:
-        code, out, _ = self.adb("shell", "dumpsys", "activity", "activities", timeout=8)
-        if code == 0 and out:
-            for line in out.splitlines():
-                if "topResumedActivity" in line or "mResumedActivity" in line:
-                    if m := re.search(r"([a-zA-Z0-9_.]+/[a-zA-Z0-9_.$]+)", line): return m.group(1)
-        code, out, _ = self.adb("shell", "dumpsys", "window", "windows", timeout=8)
-        if code == 0 and out:
-            for line in out.splitlines():
-                if "mCurrentFocus" in line or "mFocusedApp" in line:
-                    if m := re.search(r"([a-zA-Z0-9_.]+/[a-zA-Z0-9_.$]+)", line): return m.group(1)
-        return None
+        # Probe nhẹ + cache theo thiết bị (module.foreground_component), không parse cả dumpsys
+        return foreground_component(self) or None
 
     def _top_package(self) -> str | None:
         comp = self._top_component_precise()
@@ -289,13 +290,29 @@ class EmulatorWorker(QObject):
                 self.emit_status("Không xác định trạng thái")
 
 
+# Số thiết bị được dò sức khoẻ (doTask) đồng thời
+PROBE_MAX_WORKERS = 4
+
+
 class AppController(QObject):
+    probeFinished = Signal(str, str)  # device_id, lỗi ("" nếu ổn)
+
     def __init__(self, window: MainWindow):
         super().__init__(window)
         self.w = window
         self.threads: dict[str, QThread] = {}  # Sửa: Key là device_id (str)
         self.workers: dict[str, EmulatorWorker] = {}  # Sửa: Key là device_id (str)
+        # doTask chạy trên pool nền (adb/dumpsys có thể treo vài giây) → GUI không bị đơ
+        self._probe_pool = ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS, thread_name_prefix="probe")
+        self._probing: set[str] = set()
+        self.probeFinished.connect(self.on_probe_finished)
         self.hook_checkboxes()
+        # Danh sách thiết bị cập nhật theo sự kiện từ adb server (host:track-devices)
+        self.tracker = DeviceTracker(self)
+        self.tracker.deviceAdded.connect(self.on_device_added)
+        self.tracker.deviceRemoved.connect(self.on_device_removed)
+        self.tracker.deviceStateChanged.connect(self.on_device_state)
+        self.tracker.start()
         self.statusTimer = QTimer(self.w);
         self.statusTimer.timeout.connect(self.on_tick);
         self.statusTimer.start(5000)
@@ -345,7 +362,16 @@ class AppController(QObject):
 
     def stop_all(self):
         if self.statusTimer: self.statusTimer.stop()
+        if self.tracker: self.tracker.stop()
+        self._probe_pool.shutdown(wait=False, cancel_futures=True)
         for did in list(self.workers.keys()): self.stop_worker(did)
+        cache = get_ocr_cache()
+        print(f"[OCR] {cache.describe()}")
+        for did, stats in roi_memo_stats().items():
+            print(f"[{did}] {stats}")
+        for label, stats in wait_stats().items():
+            print(f"[WAIT] {label}: {stats}")
+        cache.save()
 
     def get_ui_device_ids(self) -> List[str]:  # Sửa: đổi tên và logic
         if self.w.tbl_nox is None or self.w.tbl_nox.parent() is None: return []
@@ -373,50 +399,68 @@ class AppController(QObject):
         self.w.tbl_nox.setItem(r, 4, mk_item("IDLE"))
         self._hook_row_checkbox(r)
 
-    def sync_nox_table(self):
+    def _row_of(self, device_id: str) -> int:
+        for row in range(self.w.tbl_nox.rowCount()):
+            it = self.w.tbl_nox.item(row, 2)
+            if it and it.text() == device_id:
+                return row
+        return -1
+
+    def _apply_online(self, device_id: str, status: str):
+        is_online = (status == "device")
+        if is_online and device_id not in self.workers:
+            self.start_worker(device_id)
+        elif not is_online and device_id in self.workers:
+            self.stop_worker(device_id)
+
+    def on_device_added(self, device_id: str, full_status: str):
         try:
-            adb_map = list_adb_ports_with_status()  # key là device_id, value là "Tên - Trạng thái"
-            target_devices = sorted(adb_map.keys())
-            current_devices = set(self.get_ui_device_ids())
+            row = self._row_of(device_id)
+            if row < 0:
+                self.add_row_for_device(device_id, full_status)
+            else:
+                self.w.tbl_nox.item(row, 3).setText(full_status.split(' - ')[-1])
+            self._apply_online(device_id, full_status.split(' - ')[-1])
+        except RuntimeError:
+            pass
 
-            # Thêm device mới
-            for did in target_devices:
-                if did not in current_devices:
-                    self.add_row_for_device(did, adb_map.get(did, "Unknown - offline"))
+    def on_device_state(self, device_id: str, status: str):
+        try:
+            row = self._row_of(device_id)
+            if row >= 0:
+                self.w.tbl_nox.item(row, 3).setText(status)
+            self._apply_online(device_id, status)
+        except RuntimeError:
+            pass
 
-            # Cập nhật trạng thái và start/stop worker
-            rows_to_remove = []
-            for row in range(self.w.tbl_nox.rowCount()):
-                device_id_item = self.w.tbl_nox.item(row, 2)
-                if not device_id_item: continue
-                device_id = device_id_item.text()
-
-                if device_id in adb_map:
-                    full_status = adb_map[device_id]
-                    status = full_status.split(' - ')[-1]
-                    is_online = (status == "device")
-                    self.w.tbl_nox.item(row, 3).setText(status)
-                    if is_online and device_id not in self.workers:
-                        self.start_worker(device_id)
-                    elif not is_online and device_id in self.workers:
-                        self.stop_worker(device_id)
-                else:
-                    # Device đã biến mất khỏi adb list, đánh dấu để xoá
-                    rows_to_remove.append(row)
-                    if device_id in self.workers:
-                        self.stop_worker(device_id)
-
-            # Xóa các dòng không còn tồn tại
-            for row in sorted(rows_to_remove, reverse=True):
+    def on_device_removed(self, device_id: str):
+        try:
+            if device_id in self.workers:
+                self.stop_worker(device_id)
+            row = self._row_of(device_id)
+            if row >= 0:
                 self.w.tbl_nox.removeRow(row)
-
-            self.hook_checkboxes()
         except RuntimeError:
             pass
 
     def on_tick(self):
-        self.sync_nox_table()
-        for wk in self.workers.values(): wk.doTask()
+        for did, wk in list(self.workers.items()):
+            # lần dò trước của máy này chưa xong → bỏ qua nhịp này, không xếp hàng thêm
+            if did in self._probing: continue
+            self._probing.add(did)
+            try:
+                fut = self._probe_pool.submit(wk.doTask)
+            except RuntimeError:  # pool đã shutdown (đang thoát)
+                self._probing.discard(did)
+                return
+            fut.add_done_callback(
+                lambda f, did=did: self.probeFinished.emit(did, "" if f.cancelled() or f.exception() is None
+                                                            else str(f.exception())))
+
+    def on_probe_finished(self, device_id: str, error: str):
+        self._probing.discard(device_id)
+        if error:
+            print(f"[{device_id}] doTask lỗi: {error}")
 
     def on_worker_status(self, device_id: str, text: str):  # Sửa: nhận device_id
         self.update_status_cell(device_id, text)
@@ -456,6 +500,10 @@ if __name__ == "__main__":
         sys.exit(1) # Thoát chương trình
     # --- KẾT THÚC CƠ CHẾ CHẶN ---
     force_kill_adb_server()
+    # Giải mã sẵn toàn bộ template (bản xám) để find_on_frame chỉ còn chi phí matchTemplate
+    preload_templates()
+    # Dò danh sách ngôn ngữ Tesseract 1 lần cho cả phiên (OCR không gọi --list-langs nữa)
+    get_ocr_engine().langs()
     os.environ.setdefault("QT_QPA_PLATFORM", "windows")
     app = QApplication(sys.argv)
     cloud = CloudClient()
@@ -10,6 +10,7 @@ import cv2
 import numpy as np
 
 from module import resource_path
+from screen_space import parse_wm_size
 
 
 class MinicapManager:
@@ -74,10 +75,11 @@ class MinicapManager:
             self.wk._log("Đang khởi động stream Minicap...")
 
             _, size_str, _ = self.wk.adb("shell", "wm", "size")
-            real_size_str = size_str.strip().split(' ')[-1]
-            if not real_size_str or 'x' not in real_size_str: return False
+            wh = parse_wm_size(size_str)
+            if not wh: return False
 
-            real_w, real_h = map(int, real_size_str.split('x'))
+            real_w, real_h = wh
+            real_size_str = f"{real_w}x{real_h}"
             scaled_w = (real_w // 2) // 2 * 2
             scaled_h = (real_h // 2) // 2 * 2
             scaled_size_str = f"{scaled_w}x{scaled_h}"
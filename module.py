@@ -9,20 +9,29 @@ import time
 import uuid
 import shutil
 import subprocess
+import threading
 import gc
+import atexit
+import zlib
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional, Tuple, Callable
 from image_data import IMAGE_DATA # Import dictionary dữ liệu ảnh
+from adb_client import native_adb
 import base64
 import cv2
 import numpy as np
 import pytesseract
+from ocr_engine import OcrEngine
+from ocr_cache import OcrCache
+from cancel_token import CancelToken
+from screen_space import IDENTITY, REF_H, REF_W, ScreenSpace, parse_wm_size, scale_region
 
 
 # ================== CẤU HÌNH ==================
 ADB = r"D:\Program Files\Nox\bin\nox_adb.exe"
 DEVICE = "127.0.0.1:62025"
-SCREEN_W, SCREEN_H = 900, 1600
+SCREEN_W, SCREEN_H = REF_W, REF_H   # màn THAM CHIẾU của REG_*/toạ độ tap (xem screen_space.py)
 
 TESSERACT_EXE = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 TESSDATA_DIR  = r"C:\Program Files\Tesseract-OCR\tessdata"
@@ -121,10 +130,7 @@ def crop_wh(img, x, y, w, h):
 
 
 # ================== TEMPLATE MATCH (CÓ CACHE) ==================
-_template_cache: dict[str, np.ndarray] = {}
-
-
-def _load_image_from_b64(path_key: str) -> np.ndarray | None:
+def _load_image_from_b64(path_key: str, flags: int = cv2.IMREAD_COLOR) -> np.ndarray | None:
     """
     Giải mã một chuỗi Base64 từ dictionary IMAGE_DATA và chuyển thành ảnh OpenCV.
     """
@@ -141,29 +147,144 @@ def _load_image_from_b64(path_key: str) -> np.ndarray | None:
     # Chuyển dữ liệu nhị phân thành một mảng numpy
     np_array = np.frombuffer(image_bytes, np.uint8)
 
-    # Đọc mảng numpy thành ảnh màu OpenCV
-    return cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+    # Đọc mảng numpy thành ảnh OpenCV (màu hoặc xám tuỳ flags)
+    return cv2.imdecode(np_array, flags)
 
 
-# Cache vẫn giữ nguyên để tăng tốc
-_template_cache: dict[str, np.ndarray] = {}
+def _image_data_key(path: str) -> str:
+    """Đổi đường dẫn (tuyệt đối từ resource_path hoặc tương đối) về key dạng 'images/...png' của IMAGE_DATA."""
+    p = Path(path)
+    if p.is_absolute():
+        try:
+            p = p.relative_to(Path(resource_path("")))
+        except ValueError:
+            pass
+    return p.as_posix()
 
 
-def load_template(path: str) -> np.ndarray:
+class TemplateStore:
     """
-    Nâng cấp: Load ảnh từ cache, nếu không có thì giải mã từ image_data.py
+    Kho template dùng chung cho mọi thread, key = (đường dẫn, grayscale, scale).
+    - Mỗi template chỉ giải mã 1 lần (đọc file trên đĩa, nếu không có thì lấy từ IMAGE_DATA).
+    - Lưu dưới dạng mảng contiguous, chỉ đọc (an toàn khi nhiều thread cùng dùng).
+    - Biến thể scale != 1 được resize 1 lần từ bản gốc rồi cache lại.
     """
-    # Chuẩn hóa đường dẫn để khớp với key trong dictionary
-    path_key = Path(path).as_posix()
 
-    if path_key not in _template_cache:
-        # Thay vì cv2.imread, chúng ta gọi hàm giải mã mới
-        mat = _load_image_from_b64(path_key)
-        if mat is None:
-            raise RuntimeError(f"Giải mã ảnh thất bại từ key: {path_key}")
-        _template_cache[path_key] = mat
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: dict[tuple[str, bool, float], np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str, grayscale: bool, scale: float) -> tuple[str, bool, float]:
+        return os.path.normcase(os.path.abspath(path)), bool(grayscale), round(float(scale), 4)
+
+    @staticmethod
+    def _decode(path: str, grayscale: bool) -> Optional[np.ndarray]:
+        flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+        if os.path.isfile(path):
+            # np.fromfile + imdecode để đọc được cả đường dẫn có dấu trên Windows
+            mat = cv2.imdecode(np.fromfile(path, dtype=np.uint8), flags)
+        else:
+            try:
+                mat = _load_image_from_b64(_image_data_key(path), flags)
+            except FileNotFoundError:
+                mat = None
+        if mat is None or mat.size == 0:
+            return None
+        return mat
+
+    @staticmethod
+    def _freeze(mat: np.ndarray) -> np.ndarray:
+        mat = np.ascontiguousarray(mat)
+        mat.setflags(write=False)
+        return mat
+
+    def get(self, path: str, grayscale: bool = True, scale: float = 1.0) -> Optional[np.ndarray]:
+        key = self._key(path, grayscale, scale)
+        with self._lock:
+            mat = self._items.get(key)
+            if mat is not None:
+                self.hits += 1
+                return mat
+            self.misses += 1
+
+            base_key = (key[0], key[1], 1.0)
+            base = self._items.get(base_key)
+            if base is None:
+                base = self._decode(path, grayscale)
+                if base is None:
+                    return None
+                base = self._freeze(base)
+                self._items[base_key] = base
+            if key[2] == 1.0:
+                return base
+
+            th, tw = base.shape[:2]
+            size = (max(1, int(tw * key[2])), max(1, int(th * key[2])))
+            interp = cv2.INTER_AREA if key[2] < 1.0 else cv2.INTER_LINEAR
+            mat = self._freeze(cv2.resize(base, size, interpolation=interp))
+            self._items[key] = mat
+            return mat
+
+    def preload(self, root: str = IMAGES_DIR, grayscale=(True,), scale: float = 1.0) -> int:
+        """
+        Giải mã trước mọi *.png dưới `root` (và các key tương ứng trong IMAGE_DATA). Trả số template đã nạp.
+        scale != 1 → nạp luôn bộ template đã thu/phóng cho thiết bị có độ phân giải đó.
+        """
+        root_abs = Path(resource_path(root))
+        paths = {str(p) for p in root_abs.rglob("*.png")} if root_abs.is_dir() else set()
+        prefix = Path(root).as_posix().rstrip("/") + "/"
+        paths.update(resource_path(k) for k in IMAGE_DATA if k.startswith(prefix))
+        n = 0
+        for p in sorted(paths):
+            for g in grayscale:
+                if self.get(p, grayscale=g, scale=scale) is not None:
+                    n += 1
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "templates": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "bytes": sum(m.nbytes for m in self._items.values()),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_TEMPLATES = TemplateStore()
+
+
+def get_template(path: str, grayscale: bool = True, scale: float = 1.0) -> Optional[np.ndarray]:
+    return _TEMPLATES.get(path, grayscale=grayscale, scale=scale)
+
+
+def preload_templates(root: str = IMAGES_DIR, grayscale=(True,), scale: float = 1.0) -> int:
+    n = _TEMPLATES.preload(root, grayscale=grayscale, scale=scale)
+    log(f"🖼️ Đã nạp sẵn {n} template từ '{root}'" + (f" (scale {scale:.3f})." if scale != 1.0 else "."))
+    return n
+
+
+def template_cache_stats() -> dict:
+    return _TEMPLATES.stats()
+
 
-    return _template_cache[path_key]
+def load_template(path: str) -> np.ndarray:
+    """
+    Load ảnh màu từ kho template dùng chung (file trên đĩa hoặc image_data.py).
+    """
+    mat = _TEMPLATES.get(path, grayscale=False)
+    if mat is None:
+        raise RuntimeError(f"Giải mã ảnh thất bại từ key: {_image_data_key(path)}")
+    return mat
 
 def match_template(screen: np.ndarray, template: np.ndarray, thr=DEFAULT_THR
                    ) -> Tuple[bool, Optional[Tuple[int,int]], float]:
@@ -213,7 +334,7 @@ def wait_visible(template_path: str, timeout: float = 10, thr=DEFAULT_THR, inter
 
 
 # ================== OCR ==================
-def _list_langs() -> str:
+def _list_langs_uncached() -> str:
     try:
         _set_tess_prefix()
         out = _run([TESSERACT_EXE, "--list-langs"], text=True, timeout=5).stdout
@@ -222,6 +343,63 @@ def _list_langs() -> str:
         return ""
 
 
+_OCR_ENGINE: Optional[OcrEngine] = None
+_OCR_ENGINE_LOCK = threading.Lock()
+
+
+def get_ocr_engine() -> OcrEngine:
+    """Engine OCR dùng chung (handle Tesseract giữ sẵn theo thread, danh sách ngôn ngữ dò 1 lần)."""
+    global _OCR_ENGINE
+    with _OCR_ENGINE_LOCK:
+        if _OCR_ENGINE is None:
+            _set_tess_prefix()
+            _OCR_ENGINE = OcrEngine(TESSERACT_EXE, TESSDATA_DIR)
+        return _OCR_ENGINE
+
+
+def release_ocr_thread():
+    """Giải phóng handle Tesseract (ngôn ngữ + bộ nhớ native) của thread hiện tại; gọi khi runner dừng."""
+    engine = _OCR_ENGINE
+    if engine is not None:
+        engine.close_thread()
+
+
+# Cache kết quả OCR theo nội dung ROI (dùng chung mọi runner)
+OCR_CACHE_MAX = 4096
+OCR_CACHE_PERSIST = True   # lưu ra %APPDATA%/BBTKAuto/ocr_cache.json giữa các lần chạy
+OCR_CACHE_MIN_CONF = 50.0  # ocr_regions: dưới mức tin cậy này không lưu (OCR lại lần sau)
+OCR_CACHE_TTL = 7 * 24 * 3600.0  # mục cũ hơn 7 ngày bị bỏ
+OCR_CACHE_SCHEMA = 1       # tăng khi đổi tiền xử lý/ngưỡng OCR → file cache cũ tự bị bỏ
+
+_OCR_CACHE: Optional[OcrCache] = None
+
+
+def _ocr_cache_file() -> Path:
+    return Path(os.environ.get("APPDATA") or Path.home() / ".config") / "BBTKAuto" / "ocr_cache.json"
+
+
+def get_ocr_cache() -> OcrCache:
+    """Cache OCR dùng chung; lần đầu nạp từ đĩa (nếu bật OCR_CACHE_PERSIST) và tự lưu khi thoát."""
+    global _OCR_CACHE
+    backend = get_ocr_engine().backend  # lấy trước: get_ocr_engine cũng giữ _OCR_ENGINE_LOCK
+    with _OCR_ENGINE_LOCK:
+        if _OCR_CACHE is None:
+            sig = f"{OCR_CACHE_SCHEMA}|{backend}"
+            _OCR_CACHE = OcrCache(OCR_CACHE_MAX, _ocr_cache_file() if OCR_CACHE_PERSIST else None,
+                                  min_conf=OCR_CACHE_MIN_CONF, ttl=OCR_CACHE_TTL, signature=sig)
+            if OCR_CACHE_PERSIST:
+                n = _OCR_CACHE.load()
+                if n:
+                    log(f"🗂️ Nạp {n} kết quả OCR đã lưu.")
+                atexit.register(_OCR_CACHE.save)
+        return _OCR_CACHE
+
+
+def _list_langs() -> str:
+    # Dò 1 lần (OcrEngine.langs) thay vì spawn `tesseract --list-langs` mỗi lần OCR
+    return "\n".join(sorted(get_ocr_engine().langs()))
+
+
 def _lang_available(lang_code: str) -> bool:
     return lang_code.lower() in _list_langs().lower()
 
@@ -236,33 +414,163 @@ def ocr_image(img_bgr: np.ndarray, lang="vie", psm=6, whitelist: Optional[str] =
         cv2.imwrite(name, gray)
         log(f"💾 Lưu ROI debug: {name}")
 
-    # dùng TESSDATA_PREFIX, không truyền --tessdata-dir (giống pick_coords/ocr_utils)
-    cfg = f'--psm {psm} --oem 3'
-    if whitelist:
-        cfg += f' -c tessedit_char_whitelist={whitelist}'
-
-    _set_tess_prefix()
-    langs_raw = _list_langs().lower()
     # ưu tiên 'vie+eng' nếu cả hai đều có, nếu không có 'vie' thì fallback 'eng'
-    if "vie" in langs_raw and "eng" in langs_raw:
-        chosen = "vie+eng"
-    elif "vie" in langs_raw:
-        chosen = "vie"
-    elif "eng" in langs_raw:
-        chosen = "eng"
-    else:
-        # không có ngôn ngữ nào khả dụng: trả rỗng để không nổ thread
-        chosen = "eng"
-
-    txt = pytesseract.image_to_string(gray, lang=chosen, config=cfg)
-
-    return txt.strip()
+    eng = get_ocr_engine()
+    chosen = eng.choose_lang("vie+eng")
+    cache = get_ocr_cache()
+    key = cache.make_key(gray, chosen, psm, whitelist, kind="text")
+    hit = cache.get(key)
+    if hit is not None:
+        return hit[0]
+    text = eng.recognize(gray, lang=chosen, psm=psm, whitelist=whitelist)
+    cache.put(key, text)  # không có độ tin cậy → chỉ lưu khi có chữ
+    return text
 
 def ocr_region(img_bgr: np.ndarray, x1, y1, x2, y2, **kwargs) -> str:
-    roi = crop(img_bgr, x1, y1, x2, y2)
+    roi = crop_frame(img_bgr, (x1, y1, x2, y2))
+    if roi is None or roi.size == 0:
+        return ""
     return ocr_image(roi, **kwargs)
 
 
+# ---- OCR GỘP nhiều vùng trên cùng 1 frame ----
+# Khoảng trống (px) giữa các ROI trên ảnh ghép: đủ lớn để Tesseract không nhập 2 dòng làm 1
+OCR_BATCH_SEP = 24
+
+
+def _otsu_thresholds(hists: np.ndarray) -> np.ndarray:
+    """Ngưỡng Otsu cho nhiều histogram cùng lúc (N,256) → (N,), giống cv2.THRESH_OTSU."""
+    hists = hists.astype(np.float64)
+    total = hists.sum(axis=1, keepdims=True)
+    total[total == 0] = 1.0
+    p = hists / total
+    levels = np.arange(256, dtype=np.float64)
+    omega = np.cumsum(p, axis=1)
+    mu = np.cumsum(p * levels, axis=1)
+    mu_t = mu[:, -1:]
+    denom = omega * (1.0 - omega)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma_b = np.where(denom > 0, (mu_t * omega - mu) ** 2 / denom, 0.0)
+    return sigma_b.argmax(axis=1)
+
+
+def binarize_regions_stacked(img_bgr: np.ndarray, regions, sep: int = OCR_BATCH_SEP):
+    """
+    Tiền xử lý gộp: gray (1 lần cho cả frame) → ghép các ROI thành 1 ảnh dọc, cách nhau `sep` px
+    → blur 1 lần → Otsu theo từng ROI (tính vector hoá trên histogram).
+    Trả (ảnh ghép nhị phân, [(y_trên, y_dưới) của từng ROI trên ảnh ghép | None nếu ROI rỗng]).
+    """
+    sc, org = frame_scale(img_bgr), frame_origin(img_bgr)
+    gray = img_bgr if img_bgr.ndim == 2 else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    rois = []
+    for reg in regions:
+        box = _clip_region(gray.shape, scale_region(reg, sc, org)) if reg is not None else None
+        rois.append(gray[box[1]:box[3], box[0]:box[2]] if box else None)
+    live = [r for r in rois if r is not None and r.size]
+    if not live:
+        return None, [None] * len(rois)
+    width = max(r.shape[1] for r in live) + 2 * sep
+    height = sep + sum(r.shape[0] + sep for r in live)
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    labels = np.full((height, width), -1, dtype=np.int32)
+    spans, y = [], sep
+    for i, r in enumerate(rois):
+        if r is None or not r.size:
+            spans.append(None)
+            continue
+        h, w = r.shape
+        canvas[y:y + h, sep:sep + w] = r
+        labels[y:y + h, sep:sep + w] = i
+        spans.append((y, y + h))
+        y += h + sep
+    # nền khoảng trống = trung vị ảnh để blur ở mép ROI không bị kéo về đen/trắng tuyệt đối
+    canvas[labels < 0] = int(np.median(np.concatenate([r.ravel() for r in live])))
+    blurred = cv2.GaussianBlur(canvas, (3, 3), 0)
+
+    mask = labels >= 0
+    hists = np.bincount(labels[mask] * 256 + blurred[mask], minlength=len(rois) * 256).reshape(len(rois), 256)
+    thr = _otsu_thresholds(hists)
+    out = np.where(blurred > thr[np.maximum(labels, 0)], 255, 0).astype(np.uint8)
+    # khoảng trống lấy màu NỀN chiếm đa số của các ROI (để không thành dải chữ giả)
+    bg = 255 if np.count_nonzero(out[mask]) * 2 > np.count_nonzero(mask) else 0
+    out[~mask] = bg
+    return out, spans
+
+
+def ocr_regions(img_bgr: np.ndarray, regions, lang_preference: str = "vie+eng", psm: int = 6,
+                whitelist: Optional[str] = None) -> list[tuple[str, float]]:
+    """
+    OCR nhiều vùng của CÙNG 1 frame bằng 1 lần nhận dạng: ghép các ROI đã nhị phân hoá thành
+    1 ảnh dọc, OCR 1 lần rồi chia từ theo toạ độ y về từng vùng.
+    Ô nào đã có trong cache OCR (cùng nội dung ảnh) thì không OCR lại.
+    Trả list (text, độ tin cậy 0..100) theo đúng thứ tự regions.
+    """
+    if img_bgr is None:
+        return [("", 0.0)] * len(regions)
+    eng = get_ocr_engine()
+    lang = eng.choose_lang(lang_preference)
+    cache = get_ocr_cache()
+    results: list[tuple[str, float]] = [("", 0.0)] * len(regions)
+    try:
+        stacked, spans = binarize_regions_stacked(img_bgr, regions)
+        if stacked is None:
+            return results
+        # tra cache theo từng ô; chỉ ô trượt mới được ghép lại để OCR
+        keys: dict[int, str] = {}
+        for i, span in enumerate(spans):
+            if not span:
+                continue
+            key = cache.make_key(stacked[span[0]:span[1]], lang, psm, whitelist, kind="conf")
+            hit = cache.get(key)
+            if hit is not None:
+                results[i] = hit
+            else:
+                keys[i] = key
+        if not keys:
+            return results
+        sep = OCR_BATCH_SEP
+        parts, miss_spans, y = [], {}, sep
+        for i in keys:
+            y0, y1 = spans[i]
+            parts.append(stacked[y0 - sep:y1])  # kèm khoảng trống phía trên
+            miss_spans[i] = (y, y + (y1 - y0))
+            y += (y1 - y0) + sep
+        parts.append(stacked[:sep])  # khoảng trống cuối
+        canvas = parts[0] if len(parts) == 1 else np.vstack(parts)
+        words = eng.recognize_words(canvas, lang=lang, psm=psm, whitelist=whitelist)
+    except Exception as e:
+        # lỗi ghép/nhận dạng gộp → OCR từng vùng như cũ
+        log(f"OCR gộp lỗi ({e}) → OCR từng vùng.")
+        out = []
+        for reg in regions:
+            roi = crop_frame(img_bgr, reg)
+            if roi is None or roi.size == 0:
+                out.append(("", 0.0))
+                continue
+            gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+            gray = cv2.GaussianBlur(gray, (3, 3), 0)
+            gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+            out.append(eng.recognize_conf(gray, lang=lang, psm=psm, whitelist=whitelist))
+        return out
+
+    lines: dict[int, list[list[str]]] = {i: [] for i in keys}
+    confs: dict[int, list[float]] = {i: [] for i in keys}
+    half = OCR_BATCH_SEP // 2
+    for text, conf, (x, y, w, h), new_line in words:
+        cy = y + h / 2.0
+        for i, span in miss_spans.items():
+            if span[0] - half <= cy < span[1] + half:
+                if new_line or not lines[i]:
+                    lines[i].append([])
+                lines[i][-1].append(text)
+                confs[i].append(conf)
+                break
+    for i, key in keys.items():
+        results[i] = ("\n".join(" ".join(ln) for ln in lines[i]).strip(),
+                      (sum(confs[i]) / len(confs[i])) if confs[i] else 0.0)
+        cache.put(key, *results[i])
+    return results
+
 # ================== PYAUTOGUI-LIKE ==================
 def locate_and_tap_loop(template_path: str, tries: int = 5, thr=DEFAULT_THR, interval=0.8) -> bool:
     for i in range(tries):
@@ -287,7 +595,7 @@ def type_text_via_adb(text: str, clear_first: bool=False, clear_taps: int=1, cle
 # ================== CLEAR RAM / CACHE ==================
 def clear_caches():
     try:
-        _template_cache.clear()
+        _TEMPLATES.clear()
     except Exception:
         pass
     try:
@@ -312,13 +620,44 @@ def log_wk(wk, msg: str):
         pass
     print(f"[{getattr(wk,'port',-1)}] {msg}", flush=True)
 
+def _mark_input(wk, args):
+    # Ghi mốc input gần nhất để grab_frame không trả frame chụp trước thao tác
+    if wk is not None and args[:2] == ("shell", "input"):
+        try:
+            wk._last_input_ts = time.monotonic()
+        except Exception:
+            pass
+
+def _input_channel(wk):
+    # Worker có kênh `adb shell` bền (input_channel.InputChannel) → dùng cho lệnh `input ...`
+    get = getattr(wk, "input_channel", None) if wk is not None else None
+    if not callable(get):
+        return None
+    try:
+        return get()
+    except Exception:
+        return None
+
 def adb_safe(wk, *args, timeout=6):
+    if args[:2] == ("shell", "input"):
+        ch = _input_channel(wk)
+        if ch is not None:
+            res = ch.run(args[1:], timeout=timeout)
+            if res is not None:
+                _mark_input(wk, args)
+                return res
     try:
         if wk and hasattr(wk, "adb") and callable(wk.adb):
-            return wk.adb(*args, timeout=timeout)
+            res = wk.adb(*args, timeout=timeout)
+            _mark_input(wk, args)
+            return res
     except Exception as e:
         log_wk(wk, f"ADB lỗi (wk): {e}")
         return -1, "", str(e)
+    res = native_adb(DEVICE, args, timeout=timeout)
+    if res is not None:
+        _mark_input(wk, args)
+        return res
     try:
         startupinfo = None
         if os.name == 'nt':
@@ -336,6 +675,9 @@ def adb_bin_safe(wk, *args, timeout=6):
         except Exception as e:
             log_wk(wk, f"ADB(bin) lỗi (wk): {e}")
             return -1, b"", str(e).encode()
+    res = native_adb(DEVICE, args, timeout=timeout, text=False)
+    if res is not None:
+        return res
     try:
         startupinfo = None
         if os.name == 'nt':
@@ -391,7 +733,73 @@ def screencap_bytes_wk(wk) -> Optional[bytes]:
         except Exception as e:
             log_wk(wk, f"Cảnh báo: Lỗi khi dọn dẹp file tạm: {e}")
 
-def grab_screen_np(wk=None) -> Optional[np.ndarray]:
+class RegionFrame(np.ndarray):
+    """
+    Ảnh CẮT từ màn hình (chụp theo region). `origin` = (x, y) góc trên-trái của ảnh
+    trong frame đầy đủ (pixel) → find_on_frame vẫn nhận REG_*/trả điểm theo toạ độ gốc.
+    `scale` = pixel của ảnh / đơn vị toạ độ tham chiếu (900x1600); 1.0 như cũ.
+    Lưu ý: cắt tiếp bằng slicing thì origin KHÔNG tự cập nhật — dùng crop_frame().
+    """
+
+    def __new__(cls, arr, origin=(0, 0), scale: float = 1.0):
+        obj = np.asarray(arr).view(cls)
+        obj.origin = (int(origin[0]), int(origin[1]))
+        obj.scale = float(scale)
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.origin = getattr(obj, "origin", (0, 0))
+        self.scale = getattr(obj, "scale", 1.0)
+
+
+def frame_origin(img) -> Tuple[int, int]:
+    """Góc trên-trái của ảnh trong frame đầy đủ, tính bằng pixel ((0,0) với frame đầy đủ)."""
+    return getattr(img, "origin", (0, 0))
+
+
+def frame_scale(img) -> float:
+    """Pixel của ảnh / đơn vị toạ độ tham chiếu (ảnh thường, không gắn scale → 1.0)."""
+    return getattr(img, "scale", 1.0)
+
+
+def tag_frame(img, scale: float):
+    """Gắn scale cho frame đầy đủ chụp ở độ phân giải khác 900x1600 (scale 1.0 → trả nguyên ảnh)."""
+    if img is None or scale == 1.0:
+        return img
+    return RegionFrame(img, (0, 0), scale)
+
+
+def crop_frame(img, region, copy: bool = False):
+    """
+    Cắt region (toạ độ tham chiếu) từ frame đầy đủ hoặc RegionFrame → RegionFrame.
+    Mặc định là view (không copy). Trả None nếu region nằm ngoài ảnh.
+    """
+    if img is None or region is None:
+        return img
+    ox, oy = frame_origin(img)
+    sc = frame_scale(img)
+    box = _clip_region(img.shape, scale_region(region, sc, (ox, oy)))
+    if box is None:
+        return None
+    cx1, cy1, cx2, cy2 = box
+    roi = np.asarray(img)[cy1:cy2, cx1:cx2]
+    if copy:
+        roi = np.ascontiguousarray(roi)
+    return RegionFrame(roi, (ox + cx1, oy + cy1), sc)
+
+
+def point_roi(img, x: int, y: int, r: int = 1):
+    """Ô vuông (2r+1)x(2r+1) quanh điểm (x, y) theo toạ độ tham chiếu (kẹp mép ảnh); None nếu ngoài ảnh."""
+    return crop_frame(img, (x - r, y - r, x + r + 1, y + r + 1))
+
+
+def _grab_screen_direct(wk=None, region=None) -> Optional[np.ndarray]:
+    # Ưu tiên nguồn khung hình đã gắn cho worker (xem frame_source.attach_frame_source)
+    src = getattr(wk, "_frame_source", None) if wk is not None else None
+    if src is not None:
+        img = src.grab(region=region)
+        if img is not None:
+            return img
     try:
         raw = screencap_bytes_wk(wk) if wk is not None else screencap_bytes()
         if not raw:
@@ -400,7 +808,12 @@ def grab_screen_np(wk=None) -> Optional[np.ndarray]:
             else:
                 log("Không chụp được màn hình.")
             return None
-        return cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+        img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        img = tag_frame(img, img.shape[1] / float(REF_W))
+        # PNG không giải mã từng phần được → cắt + copy để nhả bộ đệm full-frame
+        return crop_frame(img, region, copy=True) if region is not None else img
     except Exception as e:
         if wk is not None:
             log_wk(wk, f"imdecode lỗi: {e}")
@@ -409,56 +822,133 @@ def grab_screen_np(wk=None) -> Optional[np.ndarray]:
         return None
 
 
-def find_on_frame(
-        frame_bgr_or_gray,
-        template_path: str,
-        *,
-        region: tuple[int, int, int, int] | None = None,
-        threshold: float = 0.85,
-        grayscale: bool = True,
-        allow_downscale: bool = False,
-        max_dim: int = 1280,
-):
+def grab_frame(wk=None, newer_than: Optional[float] = None,
+               timeout: float = 3.0, region=None) -> Tuple[Optional[np.ndarray], float]:
     """
-    Khớp template trên 1 frame (hoặc ROI).
-    Trả: (ok: bool, point: (x,y) | None, score: float) - Point là TÂM của vùng khớp.
+    Lấy (frame, mốc time.monotonic lúc bắt đầu chụp).
+    - Worker có FramePump (frame_source.start_frame_pump): trả ngay frame mới nhất, không chờ chụp.
+      Mặc định chỉ nhận frame chụp SAU lần input (tap/swipe/keyevent) gần nhất của worker;
+      truyền newer_than để chờ frame mới hơn một mốc bất kỳ.
+    - Không có pump: chụp đồng bộ như cũ.
+    - region=(x1,y1,x2,y2): chỉ cần vùng này → backend chỉ giải mã phần đó, trả RegionFrame
+      (có .origin) để find_on_frame vẫn dùng toạ độ màn hình đầy đủ.
     """
-    import cv2
-    import numpy as np
+    pump = getattr(wk, "_frame_pump", None) if wk is not None else None
+    if pump is not None:
+        if newer_than is None:
+            newer_than = getattr(wk, "_last_input_ts", None)
+        tok = cancel_token(wk)
+        if tok is not None:
+            timeout = tok.clamp(timeout)
+        img, ts = pump.latest(newer_than=newer_than, timeout=timeout, region=region, cancel=tok)
+        if img is None and not aborted(wk):
+            log_wk(wk, "Không nhận được frame mới từ FramePump.")
+        return img, ts
+    t0 = time.monotonic()
+    return _grab_screen_direct(wk, region=region), t0
+
+
+def grab_screen_np(wk=None, newer_than: Optional[float] = None, region=None) -> Optional[np.ndarray]:
+    return grab_frame(wk, newer_than=newer_than, region=region)[0]
+
+
+def _clip_region(shape, region):
+    """Kẹp region (x1,y1,x2,y2) vào kích thước ảnh. Trả None nếu region rỗng/sai."""
+    try:
+        x1, y1, x2, y2 = region
+    except Exception:
+        return None
+    h, w = shape[:2]
+    x1 = max(0, min(int(x1), w));
+    x2 = max(0, min(int(x2), w))
+    y1 = max(0, min(int(y1), h));
+    y2 = max(0, min(int(y2), h))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
 
-    if frame_bgr_or_gray is None:
-        return False, None, 0.0
 
-    tpl = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
-    if tpl is None or tpl.size == 0:
-        return False, None, 0.0
+# ---- Khớp THÔ → TINH (pyramid) cho vùng tìm lớn ----
+PYRAMID_SCALE = 0.25          # tầng thô: 1/4 kích thước
+PYRAMID_TOPK = 3              # số ứng viên ở tầng thô đem đi xác minh
+PYRAMID_MIN_AREA = 120_000    # vùng tìm (px) nhỏ hơn → khớp thẳng full-res (đã đủ nhanh)
+PYRAMID_MIN_TPL = 8           # cạnh nhỏ nhất của template ở tầng thô (px), nhỏ hơn → mất chi tiết
+PYRAMID_REJECT_MARGIN = 0.25  # điểm thô < threshold - margin → chắc chắn không có, khỏi quét full-res
+PYRAMID_TIE_MARGIN = 0.05     # đỉnh thô chưa xét cách đỉnh thắng < margin → coi là hoà, quét full-res
 
-    img = frame_bgr_or_gray
 
-    if grayscale and img.ndim == 3:
-        try:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        except Exception:
-            return False, None, 0.0
+def _match_pyramid(img, tpl, tpl_small, threshold):
+    """
+    Tìm trên ảnh 1/4 → lấy top-k đỉnh → xác minh từng đỉnh ở full-res trong cửa sổ nhỏ quanh nó.
+    Trả (score, top_left) theo full-res như cv2.minMaxLoc trên toàn ảnh; None nếu không kết luận được
+    (người gọi quét full-res như cũ → kết quả luôn trùng cách cũ khi có khớp).
+    Đỉnh thô chưa xét gần bằng đỉnh thắng (PYRAMID_TIE_MARGIN) → template mơ hồ (nền trơn / hoạ tiết lặp),
+    đỉnh full-res cao nhất có thể nằm ngoài top-k → None để quét full-res (không trả vị trí khác cách cũ).
+    """
+    s = PYRAMID_SCALE
+    ih, iw = img.shape[:2]
+    th, tw = tpl.shape[:2]
+    small = cv2.resize(img, (max(1, int(iw * s)), max(1, int(ih * s))), interpolation=cv2.INTER_AREA)
+    sh, sw = tpl_small.shape[:2]
+    if small.shape[0] < sh or small.shape[1] < sw:
+        return None
+    res = cv2.matchTemplate(small, tpl_small, cv2.TM_CCOEFF_NORMED)
+
+    pad = int(round(1.0 / s)) + 2  # sai số làm tròn của 1 px ở tầng thô
+    best_score, best_loc, coarse_best, coarse_win = -1.0, None, -1.0, -1.0
+    for _ in range(PYRAMID_TOPK):
+        _, cv, _, (cx, cy) = cv2.minMaxLoc(res)
+        coarse_best = max(coarse_best, cv)
+        if cv < threshold - PYRAMID_REJECT_MARGIN:
+            break
+        # che đỉnh vừa lấy (nửa kích thước template) để đỉnh sau là vị trí khác
+        res[max(0, cy - sh // 2):cy + sh // 2 + 1, max(0, cx - sw // 2):cx + sw // 2 + 1] = -1.0
+        x0 = max(0, int(cx / s) - pad)
+        y0 = max(0, int(cy / s) - pad)
+        x1 = min(iw, int(cx / s) + tw + pad)
+        y1 = min(ih, int(cy / s) + th + pad)
+        if x1 - x0 < tw or y1 - y0 < th:
+            continue
+        r = cv2.matchTemplate(img[y0:y1, x0:x1], tpl, cv2.TM_CCOEFF_NORMED)
+        _, v, _, (lx, ly) = cv2.minMaxLoc(r)
+        if v > best_score:
+            best_score, best_loc, coarse_win = float(v), (x0 + lx, y0 + ly), cv
+    else:
+        # đã xét đủ top-k mà đỉnh thô còn lại vẫn ngang đỉnh thắng → không chắc đỉnh tốt nhất đã được xác minh
+        rest = cv2.minMaxLoc(res)[1]
+        if rest >= threshold - PYRAMID_REJECT_MARGIN and rest >= coarse_win - PYRAMID_TIE_MARGIN:
+            return None
+
+    if best_score >= threshold:
+        return best_score, best_loc
+    if coarse_best < threshold - PYRAMID_REJECT_MARGIN:
+        return max(best_score, float(coarse_best)), None  # chắc chắn không có
+    return None
 
-    offx = offy = 0
+
+def _match_in(img, template_path, region, threshold, grayscale,
+              allow_downscale=False, max_dim=1280, origin=(0, 0), pyramid=None, fscale=1.0):
+    """
+    Lõi khớp template dùng chung cho find_on_frame / find_many_on_frame.
+    `img` đã ở đúng hệ màu (gray nếu grayscale=True). ROI là view, không copy.
+    `origin`: góc trên-trái của img trong frame đầy đủ (pixel, khi img là ảnh chụp theo region).
+    `fscale`: pixel của img / đơn vị tham chiếu → region vào và điểm ra vẫn theo toạ độ tham chiếu,
+    template dùng bản đã thu/phóng sẵn theo scale (TemplateStore cache theo scale).
+    """
+    tpl = get_template(template_path, grayscale=grayscale, scale=fscale)
+    if tpl is None:
+        return False, None, 0.0
+
+    offx, offy = origin
     if region is not None:
-        try:
-            x1, y1, x2, y2 = region
-        except Exception:
+        box = _clip_region(img.shape, scale_region(region, fscale, (offx, offy)))
+        if box is None:
             return False, None, 0.0
-        h, w = img.shape[:2]
-        x1 = max(0, min(int(x1), w));
-        x2 = max(0, min(int(x2), w))
-        y1 = max(0, min(int(y1), h));
-        y2 = max(0, min(int(y2), h))
-        if x2 <= x1 or y2 <= y1:
+        x1, y1, x2, y2 = box
+        img = img[y1:y2, x1:x2]
+        if img.size == 0:
             return False, None, 0.0
-        roi = img[y1:y2, x1:x2]
-        if roi is None or roi.size == 0:
-            return False, None, 0.0
-        img = roi.copy()
-        offx, offy = x1, y1
+        offx, offy = offx + x1, offy + y1
 
     scale = 1.0
     ih, iw = img.shape[:2]
@@ -467,8 +957,7 @@ def find_on_frame(
         new_w = max(1, int(iw * scale));
         new_h = max(1, int(ih * scale))
         img_use = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        th, tw = tpl.shape[:2]
-        tpl_use = cv2.resize(tpl, (max(1, int(tw * scale)), max(1, int(th * scale))), interpolation=cv2.INTER_AREA)
+        tpl_use = get_template(template_path, grayscale=grayscale, scale=scale * fscale)
     else:
         img_use = img
         tpl_use = tpl
@@ -478,29 +967,405 @@ def find_on_frame(
     if th <= 0 or tw <= 0 or ih < th or iw < tw:
         return False, None, 0.0
 
-    try:
-        res = cv2.matchTemplate(img_use, tpl_use, cv2.TM_CCOEFF_NORMED)
-    except Exception:
-        return False, None, 0.0
-
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-    score = float(max_val)
+    # pyramid: None = tự bật khi vùng tìm lớn và template đủ to ở tầng 1/4
+    if pyramid is None:
+        pyramid = ih * iw >= PYRAMID_MIN_AREA and min(th, tw) * PYRAMID_SCALE >= PYRAMID_MIN_TPL
+    found = None
+    if pyramid and scale == 1.0:
+        try:
+            tpl_small = get_template(template_path, grayscale=grayscale, scale=PYRAMID_SCALE * fscale)
+            found = _match_pyramid(img_use, tpl_use, tpl_small, threshold) if tpl_small is not None else None
+        except Exception:
+            found = None
+    if found is not None:
+        score, max_loc = found
+        if max_loc is None:
+            return False, None, score
+    else:
+        try:
+            res = cv2.matchTemplate(img_use, tpl_use, cv2.TM_CCOEFF_NORMED)
+        except Exception:
+            return False, None, 0.0
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        score = float(max_val)
     if score < float(threshold):
         return False, None, score
 
     # (SỬA LỖI) Tính toán tọa độ TÂM thay vì góc trên trái
-    # Lấy kích thước của template đã được scale (tpl_use)
-    th_scaled, tw_scaled = tpl_use.shape[:2]
-
-    # Tọa độ tâm trên ảnh đã scale
-    center_x_scaled = max_loc[0] + tw_scaled // 2
-    center_y_scaled = max_loc[1] + th_scaled // 2
+    # Tọa độ tâm trên ảnh đã scale (theo kích thước template đã scale)
+    center_x_scaled = max_loc[0] + tw // 2
+    center_y_scaled = max_loc[1] + th // 2
 
     # Chuyển đổi về tọa độ gốc và cộng với offset của vùng region
     center_x_original = int(center_x_scaled / scale) + offx
     center_y_original = int(center_y_scaled / scale) + offy
+    if fscale != 1.0:
+        # pixel của frame → toạ độ tham chiếu
+        center_x_original = int(round(center_x_original / fscale))
+        center_y_original = int(round(center_y_original / fscale))
 
     return True, (center_x_original, center_y_original), score
+
+
+# ---- Nhớ kết quả khớp theo ROI: vòng poll gặp lại đúng vùng pixel cũ → khỏi matchTemplate ----
+ROI_MEMO_MAX = 256  # số (template, vùng) nhớ cho mỗi thiết bị
+
+
+class RoiMemo:
+    """
+    Kết quả find_on_frame gần nhất cho từng (template, region, ngưỡng...) của 1 thiết bị,
+    kèm crc32 pixel ROI lúc khớp. Lần sau ROI y hệt (crc trùng) → trả lại kết quả cũ.
+    """
+
+    def __init__(self, max_entries: int = ROI_MEMO_MAX):
+        self.max_entries = max(1, int(max_entries))
+        self._data: "OrderedDict[tuple, tuple[int, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, crc: int):
+        with self._lock:
+            val = self._data.get(key)
+            if val is None or val[0] != crc:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return val[1]
+
+    def put(self, key: tuple, crc: int, result: tuple):
+        with self._lock:
+            self._data[key] = (crc, result)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def describe(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits * 100.0 / total if total else 0.0
+        return f"ROI memo: bỏ qua {self.hits}/{total} lần khớp ({rate:.0f}%)"
+
+
+_ROI_MEMOS: dict[str, RoiMemo] = {}
+_ROI_MEMOS_LOCK = threading.Lock()
+
+
+def roi_memo(wk) -> Optional[RoiMemo]:
+    """Memo riêng của thiết bị (theo device_id); wk=None → None (không nhớ)."""
+    if not wk:
+        return None
+    key = _device_key(wk)
+    with _ROI_MEMOS_LOCK:
+        memo = _ROI_MEMOS.get(key)
+        if memo is None:
+            memo = _ROI_MEMOS[key] = RoiMemo()
+        return memo
+
+
+def roi_memo_stats() -> dict[str, str]:
+    with _ROI_MEMOS_LOCK:
+        return {key: memo.describe() for key, memo in _ROI_MEMOS.items()}
+
+
+def _roi_checksum(img, region, fscale, origin) -> Optional[int]:
+    """crc32 pixel của đúng vùng sẽ đem khớp (ảnh gốc, trước khi đổi gray)."""
+    if region is not None:
+        box = _clip_region(img.shape, scale_region(region, fscale, origin))
+        if box is None:
+            return None
+        x1, y1, x2, y2 = box
+        img = img[y1:y2, x1:x2]
+    if img.size == 0:
+        return None
+    crc = zlib.crc32(np.ascontiguousarray(img).data)
+    return zlib.crc32(repr(img.shape).encode(), crc)
+
+
+def _prepare_frame(frame_bgr_or_gray, grayscale):
+    """Chuyển frame sang gray 1 lần (nếu cần). Trả None nếu lỗi."""
+    img = frame_bgr_or_gray
+    if img is None:
+        return None
+    if grayscale and img.ndim == 3:
+        try:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        except Exception:
+            return None
+    return img
+
+
+def find_on_frame(
+        frame_bgr_or_gray,
+        template_path: str,
+        *,
+        region: tuple[int, int, int, int] | None = None,
+        threshold: float = 0.85,
+        grayscale: bool = True,
+        allow_downscale: bool = False,
+        max_dim: int = 1280,
+        pyramid: Optional[bool] = None,
+        memo: Optional[RoiMemo] = None,
+):
+    """
+    Khớp template trên 1 frame (hoặc ROI).
+    Frame có thể là RegionFrame (grab_screen_np(wk, region=...)): region/điểm trả về vẫn theo toạ độ màn hình.
+    pyramid: None = tự dùng khớp thô→tinh khi vùng tìm lớn (region=None...); False = luôn quét full-res.
+    memo: roi_memo(wk) → ROI không đổi pixel so với lần khớp trước (cùng template) thì trả kết quả cũ.
+    Trả: (ok: bool, point: (x,y) | None, score: float) - Point là TÂM của vùng khớp.
+    """
+    if frame_bgr_or_gray is None:
+        return False, None, 0.0
+    origin, fscale = frame_origin(frame_bgr_or_gray), frame_scale(frame_bgr_or_gray)
+    crc = key = None
+    if memo is not None:
+        crc = _roi_checksum(frame_bgr_or_gray, region, fscale, origin)
+        if crc is not None:
+            key = (template_path, region, float(threshold), grayscale, allow_downscale, max_dim, fscale, origin)
+            cached = memo.get(key, crc)
+            if cached is not None:
+                return cached
+    img = _prepare_frame(frame_bgr_or_gray, grayscale)
+    if img is None:
+        return False, None, 0.0
+    result = _match_in(img, template_path, region, threshold, grayscale,
+                       allow_downscale=allow_downscale, max_dim=max_dim,
+                       origin=origin, pyramid=pyramid, fscale=fscale)
+    if key is not None:
+        memo.put(key, crc, result)
+    return result
+
+
+# ---- Tìm MỌI vị trí của 1 template (nhiều đối tượng giống nhau) ----
+def _nms(xs, ys, scores, tw: int, th: int, max_hits: Optional[int] = None, overlap: float = 0.3):
+    """NMS tham lam theo IoU giữa các khung cùng kích thước (tw, th); phép giao tính vector. Trả index giữ lại."""
+    order = np.argsort(-scores, kind="stable")
+    xs, ys = xs[order], ys[order]
+    keep = []
+    alive = np.ones(xs.size, dtype=bool)
+    area = float(tw * th)
+    for i in range(xs.size):
+        if not alive[i]:
+            continue
+        keep.append(order[i])
+        if max_hits is not None and len(keep) >= max_hits:
+            break
+        iw = np.clip(tw - np.abs(xs[i + 1:] - xs[i]), 0, None)
+        ih = np.clip(th - np.abs(ys[i + 1:] - ys[i]), 0, None)
+        inter = iw * ih
+        alive[i + 1:] &= inter / (2.0 * area - inter) <= overlap
+    return np.asarray(keep, dtype=np.intp)
+
+
+def _peaks_nms(res: np.ndarray, threshold: float, tw: int, th: int,
+               max_hits: Optional[int] = None, overlap: float = 0.3):
+    """
+    Đỉnh cục bộ của bản đồ matchTemplate (dilate nửa cỡ template → giữ điểm bằng max lân cận, ≥ ngưỡng),
+    rồi NMS. Trả (xs, ys, scores) sort theo score giảm dần.
+    """
+    kernel = np.ones((max(1, th // 2) | 1, max(1, tw // 2) | 1), np.uint8)
+    peaks = (res >= threshold) & (res >= cv2.dilate(res, kernel))
+    ys, xs = np.nonzero(peaks)
+    if xs.size == 0:
+        return xs, ys, np.empty(0, np.float32)
+    scores = res[ys, xs]
+    keep = _nms(xs, ys, scores, tw, th, max_hits=max_hits, overlap=overlap)
+    return xs[keep], ys[keep], scores[keep]
+
+
+def _find_all_coarse(img, small, coarse, template_path, grayscale, fscale, threshold,
+                     max_hits, overlap):
+    """
+    Tầng thô: `small` = ảnh xám đã thu nhỏ `coarse` → ứng viên (ngưỡng nới PYRAMID_REJECT_MARGIN);
+    tầng tinh: khớp lại từng ứng viên ở full-res (đúng hệ màu yêu cầu) trong cửa sổ nhỏ.
+    Trả (xs, ys, scores, tw, th) theo pixel của img; None nếu template quá to cho tầng thô.
+    """
+    tpl = get_template(template_path, grayscale=grayscale, scale=fscale)
+    tpl_c = get_template(template_path, grayscale=True, scale=fscale * coarse)
+    th, tw = tpl.shape[:2]
+    ih, iw = img.shape[:2]
+    sh, sw = tpl_c.shape[:2]
+    if small.shape[0] < sh or small.shape[1] < sw:
+        return None
+    res = cv2.matchTemplate(small, tpl_c, cv2.TM_CCOEFF_NORMED)
+    cap = 4 * max_hits if max_hits else 256
+    cxs, cys, _ = _peaks_nms(res, threshold - PYRAMID_REJECT_MARGIN, sw, sh, max_hits=cap, overlap=overlap)
+
+    pad = int(round(1.0 / coarse)) + 2
+    xs, ys, scores = [], [], []
+    for cx, cy in zip(cxs, cys):
+        x0 = max(0, int(cx / coarse) - pad)
+        y0 = max(0, int(cy / coarse) - pad)
+        x1 = min(iw, int(cx / coarse) + tw + pad)
+        y1 = min(ih, int(cy / coarse) + th + pad)
+        if x1 - x0 < tw or y1 - y0 < th:
+            continue
+        r = cv2.matchTemplate(img[y0:y1, x0:x1], tpl, cv2.TM_CCOEFF_NORMED)
+        _, v, _, (lx, ly) = cv2.minMaxLoc(r)
+        if v >= threshold:
+            xs.append(x0 + lx)
+            ys.append(y0 + ly)
+            scores.append(v)
+    xs, ys, scores = np.asarray(xs, np.intp), np.asarray(ys, np.intp), np.asarray(scores, np.float32)
+    if xs.size:
+        keep = _nms(xs, ys, scores, tw, th, max_hits=max_hits, overlap=overlap)
+        xs, ys, scores = xs[keep], ys[keep], scores[keep]
+    return xs, ys, scores, tw, th
+
+
+def find_all_many_on_frame(
+        frame_bgr_or_gray,
+        specs,
+        *,
+        grayscale: bool = True,
+        overlap: float = 0.3,
+        coarse: float = 1.0,
+) -> list[list[tuple[int, int, float]]]:
+    """
+    Tìm TẤT CẢ vị trí khớp của nhiều template (đối tượng lặp lại: mồi, tường...) trên cùng 1 frame.
+    specs: list (template_path, region, threshold[, max_hits]) — threshold bỏ trống = 0.85.
+    - Template lấy từ kho dùng chung (không đọc file mỗi frame); lọc đỉnh + NMS bằng numpy.
+    - Chuyển màu / cắt ROI / thu nhỏ làm 1 lần cho mỗi region, dùng chung cho mọi template.
+    - coarse < 1 (vd 0.5): dò ứng viên trên ảnh xám thu nhỏ rồi xác minh từng cái ở full-res
+      (nhanh hơn nhiều với template màu trên vùng lớn; toạ độ vẫn lấy từ bước full-res).
+    Trả list (theo thứ tự specs) các list (x, y, score) — TÂM theo toạ độ tham chiếu, score giảm dần.
+    """
+    specs = list(specs)
+    img_full = _prepare_frame(frame_bgr_or_gray, grayscale)
+    if img_full is None:
+        return [[] for _ in specs]
+    fscale = frame_scale(frame_bgr_or_gray)
+    origin = frame_origin(frame_bgr_or_gray)
+    prepared = {}  # region -> (img, small, offx, offy) | None
+
+    def _prep(region):
+        if region in prepared:
+            return prepared[region]
+        img, (offx, offy) = img_full, origin
+        if region is not None:
+            box = _clip_region(img.shape, scale_region(region, fscale, origin))
+            if box is None:
+                prepared[region] = None
+                return None
+            img = img[box[1]:box[3], box[0]:box[2]]
+            offx, offy = offx + box[0], offy + box[1]
+        small = None
+        if coarse < 1.0:
+            gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            ih, iw = gray.shape[:2]
+            small = cv2.resize(gray, (max(1, int(iw * coarse)), max(1, int(ih * coarse))),
+                               interpolation=cv2.INTER_AREA)
+        prepared[region] = (img, small, offx, offy)
+        return prepared[region]
+
+    out = []
+    for spec in specs:
+        path, region = spec[0], (tuple(spec[1]) if spec[1] is not None else None)
+        thr = float(spec[2]) if len(spec) > 2 and spec[2] is not None else 0.85
+        max_hits = spec[3] if len(spec) > 3 else None
+        tpl = get_template(path, grayscale=grayscale, scale=fscale)
+        prep = _prep(region) if tpl is not None else None
+        if prep is None:
+            out.append([])
+            continue
+        img, small, offx, offy = prep
+        th, tw = tpl.shape[:2]
+        if img.shape[0] < th or img.shape[1] < tw:
+            out.append([])
+            continue
+        try:
+            found = None
+            if small is not None:
+                found = _find_all_coarse(img, small, coarse, path, grayscale, fscale, thr, max_hits, overlap)
+            if found is None:
+                res = cv2.matchTemplate(img, tpl, cv2.TM_CCOEFF_NORMED)
+                found = _peaks_nms(res, thr, tw, th, max_hits=max_hits, overlap=overlap) + (tw, th)
+        except Exception:
+            out.append([])
+            continue
+        xs, ys, scores, tw, th = found
+        cx = xs + (tw // 2 + offx)
+        cy = ys + (th // 2 + offy)
+        if fscale != 1.0:
+            cx = np.rint(cx / fscale).astype(int)
+            cy = np.rint(cy / fscale).astype(int)
+        out.append([(int(x), int(y), float(sc)) for x, y, sc in zip(cx, cy, scores)])
+    return out
+
+
+def find_all_on_frame(
+        frame_bgr_or_gray,
+        template_path: str,
+        *,
+        region: tuple[int, int, int, int] | None = None,
+        threshold: float = 0.85,
+        grayscale: bool = True,
+        max_hits: Optional[int] = None,
+        overlap: float = 0.3,
+        coarse: float = 1.0,
+) -> list[tuple[int, int, float]]:
+    """
+    Tìm TẤT CẢ vị trí khớp 1 template (xem find_all_many_on_frame).
+    Trả list (x, y, score) — (x, y) là TÂM theo toạ độ tham chiếu, sort theo score giảm dần.
+    """
+    return find_all_many_on_frame(frame_bgr_or_gray, [(template_path, region, threshold, max_hits)],
+                                  grayscale=grayscale, overlap=overlap, coarse=coarse)[0]
+
+
+# ---- Khớp NHIỀU template trên CÙNG 1 frame ----
+MATCH_POOL_WORKERS = 4
+_MATCH_POOL = None
+_MATCH_POOL_LOCK = threading.Lock()
+
+
+def _match_pool():
+    global _MATCH_POOL
+    with _MATCH_POOL_LOCK:
+        if _MATCH_POOL is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _MATCH_POOL = ThreadPoolExecutor(max_workers=MATCH_POOL_WORKERS,
+                                             thread_name_prefix="match")
+        return _MATCH_POOL
+
+
+def find_many_on_frame(
+        frame_bgr_or_gray,
+        specs,
+        *,
+        grayscale: bool = True,
+        parallel: bool = False,
+):
+    """
+    Khớp nhiều template trên 1 frame trong 1 lần gọi.
+    specs: list các (template_path, region, threshold) — threshold có thể bỏ (mặc định 0.85).
+    Chuyển gray đúng 1 lần, ROI là view dùng chung (không copy).
+    parallel=True: chạy các lần khớp trên thread pool (OpenCV nhả GIL khi matchTemplate).
+    Trả: list (ok, point, score) theo đúng thứ tự specs.
+    """
+    specs = list(specs)
+    img = _prepare_frame(frame_bgr_or_gray, grayscale)
+    if img is None:
+        return [(False, None, 0.0)] * len(specs)
+
+    jobs = []
+    for spec in specs:
+        path, region = spec[0], spec[1]
+        thr = spec[2] if len(spec) > 2 and spec[2] is not None else 0.85
+        jobs.append((path, region, thr))
+
+    origin = frame_origin(frame_bgr_or_gray)
+    fscale = frame_scale(frame_bgr_or_gray)
+    if parallel and len(jobs) > 1:
+        pool = _match_pool()
+        futs = [pool.submit(_match_in, img, p, r, t, grayscale, origin=origin, fscale=fscale) for p, r, t in jobs]
+        return [f.result() for f in futs]
+    return [_match_in(img, p, r, t, grayscale, origin=origin, fscale=fscale) for p, r, t in jobs]
+
+
 # ==== CLOUD API (chuẩn dùng chung cho toàn app) ====
 import os, json, platform, hashlib, uuid, requests
 from pathlib import Path
@@ -632,8 +1497,65 @@ def api_license_status() -> dict:
     return data
 
 
+# ---- Hệ toạ độ theo thiết bị: flows viết theo 900x1600, tap/swipe tự đổi ra pixel thật ----
+_SPACES: dict[str, ScreenSpace] = {}
+_SPACES_LOCK = threading.Lock()
+# Đo `wm size` lỗi → tạm dùng 900x1600, chỉ đo lại sau chừng này giây (không đo lại ở mỗi tap/swipe)
+CALIBRATE_RETRY_SECS = 60.0
+_SPACES_RETRY_AT: dict[str, float] = {}
+
+
+def calibrate_screen(wk, force: bool = False) -> ScreenSpace:
+    """
+    Đo độ phân giải thiết bị 1 lần (`wm size`) và nhớ theo device_id.
+    Độ phân giải khác 900x1600 → nạp sẵn bộ template đã thu/phóng theo scale đó.
+    Không đo được → tạm coi như 900x1600 (có cache), CALIBRATE_RETRY_SECS giây sau mới đo lại.
+    """
+    if not wk:
+        return IDENTITY
+    key = _device_key(wk)
+    now = time.monotonic()
+    with _SPACES_LOCK:
+        sp = None if force else _SPACES.get(key)
+        retry_at = _SPACES_RETRY_AT.get(key)
+        if sp is not None and retry_at is not None and retry_at <= now:
+            sp = None  # lần đo trước lỗi và đã tới hạn đo lại
+    if sp is None:
+        code, out, _ = adb_safe(wk, "shell", "wm", "size", timeout=4)
+        wh = parse_wm_size(out) if code == 0 else None
+        with _SPACES_LOCK:
+            if wh is None:
+                sp = _SPACES[key] = IDENTITY
+                _SPACES_RETRY_AT[key] = now + CALIBRATE_RETRY_SECS
+            else:
+                sp = _SPACES[key] = ScreenSpace(*wh)
+                _SPACES_RETRY_AT.pop(key, None)
+        if wh is None:
+            log_wk(wk, f"Không đọc được `wm size` → dùng toạ độ 900x1600, đo lại sau {CALIBRATE_RETRY_SECS:.0f}s.")
+        else:
+            log_wk(wk, f"📐 Màn hình {sp.describe()}")
+            if not sp.is_identity:
+                preload_templates(scale=sp.scale)
+    try:
+        wk._screen_space = sp
+    except Exception:
+        pass
+    return sp
+
+
+def screen_space(wk) -> ScreenSpace:
+    if not wk:
+        return IDENTITY
+    sp = getattr(wk, "_screen_space", None)
+    retry_at = _SPACES_RETRY_AT.get(_device_key(wk))
+    if sp is None or (retry_at is not None and retry_at <= time.monotonic()):
+        return calibrate_screen(wk)
+    return sp
+
+
 def tap(wk, x, y):
     if wk:
+        x, y = screen_space(wk).to_dev(x, y)
         adb_safe(wk, "shell", "input", "tap", str(x), str(y), timeout=3)
     else:
         tap_global(x, y)
@@ -644,21 +1566,33 @@ def tap_center(wk, reg):
 
 def swipe(wk, x1, y1, x2, y2, dur_ms=450):
     if wk:
+        sp = screen_space(wk)
+        x1, y1 = sp.to_dev(x1, y1)
+        x2, y2 = sp.to_dev(x2, y2)
         adb_safe(wk, "shell", "input", "swipe", str(x1), str(y1), str(x2), str(y2), str(dur_ms), timeout=3)
     else:
         swipe_global(x1, y1, x2, y2, dur_ms)
 
+def cancel_token(wk) -> Optional[CancelToken]:
+    """Token huỷ/hạn chót gắn trên worker (AccountRunner tạo); None với worker cũ chỉ có cờ _abort."""
+    return getattr(wk, "_cancel", None) if wk is not None else None
+
 def aborted(wk) -> bool:
-    return bool(getattr(wk, "_abort", False))
+    tok = cancel_token(wk)
+    return bool(getattr(wk, "_abort", False)) or (tok is not None and tok.cancelled)
 
 def sleep_coop(wk, secs: float) -> bool:
-    step = 0.2
-    n = int(max(1, secs / step))
-    for _ in range(n):
-        if aborted(wk):
-            return False
-        time.sleep(step)
-    return True
+    """Ngủ secs giây; False nếu bị huỷ. Có token → chờ trên Event (thức ngay khi huỷ / chạm hạn chót)."""
+    tok = cancel_token(wk)
+    if tok is not None:
+        return tok.sleep(secs) and not aborted(wk)
+    end = time.monotonic() + secs
+    while not aborted(wk):
+        left = end - time.monotonic()
+        if left <= 0:
+            return True
+        time.sleep(min(0.2, left))
+    return False
 
 def free_img(*imgs):
     for im in imgs:
@@ -681,24 +1615,110 @@ def back(wk, times: int = 1, wait_each: float = 0.2):
         adb_safe(wk, "shell", "input", "keyevent", "4", timeout=2)
         time.sleep(wait_each)
 
-def state_simple(wk, package_hint: str = "com.phsgdbz.vn") -> str:
+# ---- Activity foreground: probe nhẹ + cache theo thiết bị ----
+# Cache sống bao lâu khi chỉ có probe (giây)
+FG_CACHE_TTL = 1.0
+# Khi có ActivityWatcher (logcat events) đẩy thay đổi → tin cache lâu hơn, chỉ probe lại định kỳ
+FG_WATCH_TTL = 5.0
+_COMP_RE = re.compile(r"([a-zA-Z0-9_.]+/[a-zA-Z0-9_.$]+)")
+
+
+class _ForegroundEntry:
+    __slots__ = ("comp", "ts", "seq", "watched")
+
+    def __init__(self):
+        self.comp = ""
+        self.ts = 0.0
+        self.seq = 0
+        self.watched = False
+
+
+_FG: dict[str, _ForegroundEntry] = {}
+_FG_COND = threading.Condition()
+
+
+def _device_key(wk) -> str:
+    return str(getattr(wk, "device_id", None) or getattr(wk, "_serial", None) or DEVICE)
+
+
+def _fg_entry(key: str) -> _ForegroundEntry:
+    ent = _FG.get(key)
+    if ent is None:
+        ent = _FG[key] = _ForegroundEntry()
+    return ent
+
+
+def publish_foreground(device_id: str, comp: str):
+    """Ghi activity foreground mới (từ probe hoặc từ logcat events) và đánh thức người đang chờ."""
+    with _FG_COND:
+        ent = _fg_entry(device_id)
+        changed = comp != ent.comp
+        ent.comp, ent.ts = comp, time.monotonic()
+        if changed:
+            ent.seq += 1
+            _FG_COND.notify_all()
+
+
+def set_foreground_watched(device_id: str, watched: bool):
+    with _FG_COND:
+        _fg_entry(device_id).watched = watched
+        _FG_COND.notify_all()
+
+
+def invalidate_foreground(wk):
+    with _FG_COND:
+        _fg_entry(_device_key(wk)).ts = 0.0
+
+
+def _probe_foreground(wk) -> str:
+    """Lấy component đang foreground bằng lệnh rẻ nhất có thể (không kéo cả MB dumpsys về)."""
     code, out, _ = adb_safe(wk, "shell", "cmd", "activity", "get-foreground-activity", timeout=5)
-    comp = ""
     if code == 0 and out and "ComponentInfo{" in out:
         try:
-            comp = out.split("ComponentInfo{", 1)[1].split("}", 1)[0]
+            return out.split("ComponentInfo{", 1)[1].split("}", 1)[0]
         except Exception:
-            comp = ""
-    if not comp:
-        c2, out2, _ = adb_safe(wk, "shell", "dumpsys", "window", "windows", timeout=6)
+            pass
+    # Lọc ngay trên thiết bị: chỉ vài dòng chứa activity đang resume/focus quay về
+    for cmd in ("dumpsys activity activities | grep -E 'topResumedActivity|mResumedActivity'",
+                "dumpsys window | grep -E 'mCurrentFocus|mFocusedApp'"):
+        c2, out2, _ = adb_safe(wk, "shell", cmd, timeout=6)
         if c2 == 0 and out2:
-            for line in out2.splitlines():
-                if package_hint in line and "/" in line:
-                    m = re.search(r"([a-zA-Z0-9_.]+/[a-zA-Z0-9_.$]+)", line)
-                    if m:
-                        comp = m.group(1)
-                        break
+            m = _COMP_RE.search(out2)
+            if m:
+                return m.group(1)
+    return ""
+
+
+def foreground_component(wk, max_age: Optional[float] = None) -> str:
+    """
+    Component (pkg/Activity) đang foreground của thiết bị, có cache theo thiết bị (dùng chung
+    giữa các worker cùng device_id). Cache bị thay ngay khi ActivityWatcher thấy activity đổi.
+    """
+    key = _device_key(wk)
+    with _FG_COND:
+        ent = _fg_entry(key)
+        if max_age is None:
+            max_age = FG_WATCH_TTL if ent.watched else FG_CACHE_TTL
+        if ent.ts and time.monotonic() - ent.ts <= max_age:
+            return ent.comp
+    comp = _probe_foreground(wk)
+    publish_foreground(key, comp)
+    return comp
+
 
+def foreground_seq(wk) -> int:
+    with _FG_COND:
+        return _fg_entry(_device_key(wk)).seq
+
+
+def wait_foreground_change(wk, seq: int, timeout: float) -> bool:
+    """Chờ tới khi activity foreground đổi so với mốc seq (chỉ có ý nghĩa khi có ActivityWatcher)."""
+    key = _device_key(wk)
+    with _FG_COND:
+        return _FG_COND.wait_for(lambda: _fg_entry(key).seq != seq, timeout=timeout)
+
+
+def _state_of(comp: str) -> str:
     if "com.bbt.android.sdk.login.HWLoginActivity" in comp:
         return "need_login"
     if "org.cocos2dx.javascript.GameTwActivity" in comp:
@@ -706,6 +1726,31 @@ def state_simple(wk, package_hint: str = "com.phsgdbz.vn") -> str:
     return "unknown"
 
 
+def state_simple(wk, package_hint: str = "com.phsgdbz.vn") -> str:
+    return _state_of(foreground_component(wk))
+
+
+def wait_state(wk, target: str = "need_login", timeout: float = 6.0, interval: float = 0.25) -> bool:
+    """
+    Đợi tới khi `state_simple(wk)` == target.
+    Có ActivityWatcher → ngủ chờ sự kiện đổi activity thay vì poll adb mỗi `interval`.
+    """
+    end = time.time() + timeout
+    while True:
+        seq = foreground_seq(wk)
+        if state_simple(wk) == target:
+            return True
+        left = end - time.time()
+        if left <= 0 or aborted(wk):
+            return False
+        with _FG_COND:
+            watched = _fg_entry(_device_key(wk)).watched
+        if watched:
+            wait_foreground_change(wk, seq, min(left, 1.0))
+        elif not sleep_coop(wk, min(left, interval)):
+            return False
+
+
 # ================== (NEW) HELPERS DÙNG CHUNG BỔ SUNG ==================
 def pt_in_region(pt: Optional[Tuple[int,int]], reg: Tuple[int,int,int,int]) -> bool:
     if not pt:
@@ -727,13 +1772,15 @@ def is_green_pixel(wk, x: int, y: int, h_range=(35,85), s_min=80, v_min=80, samp
     try:
         if img is None:
             return False
+        sc = frame_scale(img)
+        x, y = int(x * sc), int(y * sc)  # toạ độ tham chiếu → pixel của frame
         h, w = img.shape[:2]
         if not (0 <= x < w and 0 <= y < h):
             return False
         r = max(1, sample//2)
         x1, y1 = max(0, x - r), max(0, y - r)
         x2, y2 = min(w, x + r + 1), min(h, y + r + 1)
-        roi = img[y1:y2, x1:x2].copy()
+        roi = np.asarray(img)[y1:y2, x1:x2].copy()
         hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
         H = float(np.mean(hsv[..., 0]))
         S = float(np.mean(hsv[..., 1]))
@@ -742,16 +1789,6 @@ def is_green_pixel(wk, x: int, y: int, h_range=(35,85), s_min=80, v_min=80, samp
     finally:
         free_img(img)
 
-def wait_state(wk, target: str = "need_login", timeout: float = 6.0, interval: float = 0.25) -> bool:
-    """Đợi tới khi `state_simple(wk)` == target."""
-    end = time.time() + timeout
-    while time.time() < end:
-        st = state_simple(wk)
-        if st == target:
-            return True
-        time.sleep(interval)
-    return False
-
 # ---------- BỔ SUNG CHO CÁC FLOW ----------
 def wait_visible_region(wk, tpl_path: str, region: Optional[Tuple[int,int,int,int]] = None,
                         timeout: float = 10.0, thr: float = DEFAULT_THR, interval: float = 0.3) -> bool:
@@ -760,8 +1797,8 @@ def wait_visible_region(wk, tpl_path: str, region: Optional[Tuple[int,int,int,in
     """
     end = time.time() + timeout
     while time.time() < end:
-        img = grab_screen_np(wk)
-        ok, _, _ = find_on_frame(img, tpl_path, region=region, threshold=thr)
+        img = grab_screen_np(wk, region=region)
+        ok, _, _ = find_on_frame(img, tpl_path, region=region, threshold=thr, memo=roi_memo(wk))
         free_img(img)
         if ok:
             return True
@@ -769,6 +1806,173 @@ def wait_visible_region(wk, tpl_path: str, region: Optional[Tuple[int,int,int,in
             return False
     return False
 
+# ---------- CHỜ THEO ĐIỀU KIỆN TRÊN LUỒNG FRAME ----------
+# Thay cho sleep_coop(cố định) sau mỗi thao tác: đánh giá điều kiện trên từng frame mới
+# (FramePump: chỉ frame chụp SAU input gần nhất) → đi tiếp ngay khi UI sẵn sàng.
+WAIT_MIN_INTERVAL = 0.08   # khoảng cách tối thiểu giữa 2 lần đánh giá (s)
+SETTLE_TOL = 1.5           # chênh lệch mức xám trung bình giữa 2 frame liên tiếp coi là "đứng yên"
+CHANGE_TOL = 6.0           # chênh lệch so với frame tham chiếu coi là "đã đổi"
+_SIG_WIDTH = 64            # ảnh thu nhỏ để so sánh frame (rẻ, ít nhạy nhiễu)
+
+
+class WaitStats:
+    """Thống kê wait_until theo nhãn bước: số lần, tổng thời gian chờ thật, tổng thời gian tiết kiệm."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps: dict[str, list] = {}
+
+    def add(self, label: str, waited: float, saved: float, ok: bool):
+        with self._lock:
+            st = self._steps.setdefault(label, [0, 0, 0.0, 0.0])
+            st[0] += 1
+            st[1] += int(ok)
+            st[2] += waited
+            st[3] += saved
+
+    def describe(self) -> dict[str, str]:
+        with self._lock:
+            return {label: f"{n} lần ({ok} đạt), chờ TB {waited / n:.2f}s, tiết kiệm {saved:.1f}s"
+                    for label, (n, ok, waited, saved) in self._steps.items()}
+
+
+_WAIT_STATS = WaitStats()
+
+
+def wait_stats() -> dict[str, str]:
+    return _WAIT_STATS.describe()
+
+
+def _frame_sig(img, region=None) -> Optional[np.ndarray]:
+    """Ảnh xám thu nhỏ (rộng _SIG_WIDTH) của region — chữ ký rẻ để so 2 frame."""
+    roi = crop_frame(img, region) if region is not None else img
+    if roi is None or roi.size == 0:
+        return None
+    roi = np.asarray(roi)
+    if roi.ndim == 3:
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    h, w = roi.shape[:2]
+    if w > _SIG_WIDTH:
+        roi = cv2.resize(roi, (_SIG_WIDTH, max(1, h * _SIG_WIDTH // w)), interpolation=cv2.INTER_AREA)
+    return roi.astype(np.int16)
+
+
+def _sig_diff(a, b) -> float:
+    if a is None or b is None or a.shape != b.shape:
+        return float("inf")
+    return float(np.abs(a - b).mean())
+
+
+def tpl_visible(tpl_path: str, region=None, thr: float = DEFAULT_THR, stable: bool = False,
+                memo: Optional[RoiMemo] = None):
+    """
+    Điều kiện: template xuất hiện → trả điểm tâm (truthy).
+    stable=True: chỉ nhận khi 2 frame liên tiếp khớp CÙNG vị trí (hết trượt/animation → tap trúng).
+    """
+    last = [None]
+
+    def _pred(img):
+        ok, pt, _ = find_on_frame(img, tpl_path, region=region, threshold=thr, memo=memo)
+        if not ok or not pt:
+            last[0] = None
+            return None
+        if stable and last[0] != pt:
+            last[0] = pt
+            return None
+        return pt
+    return _pred
+
+
+def tpl_gone(tpl_path: str, region=None, thr: float = DEFAULT_THR, memo: Optional[RoiMemo] = None):
+    """Điều kiện: template biến mất."""
+    return lambda img: not find_on_frame(img, tpl_path, region=region, threshold=thr, memo=memo)[0]
+
+
+def roi_changed(ref, region=None, tol: float = CHANGE_TOL):
+    """Điều kiện: region khác frame tham chiếu `ref` (chụp TRƯỚC thao tác)."""
+    base = _frame_sig(ref, region) if ref is not None else None
+    return lambda img: base is not None and _sig_diff(_frame_sig(img, region), base) > tol
+
+
+def screen_settled(region=None, ref=None, frames: int = 2, tol: float = SETTLE_TOL,
+                   change_tol: float = CHANGE_TOL):
+    """
+    Điều kiện: region đứng yên `frames` frame liên tiếp (hết animation / cuộn quán tính).
+    ref (frame trước thao tác): phải THẤY đổi so với ref trước đã, tránh nhận nhầm màn cũ khi game chưa kịp phản hồi.
+    """
+    base = _frame_sig(ref, region) if ref is not None else None
+    state = {"prev": None, "still": 0, "moved": base is None}
+
+    def _pred(img):
+        sig = _frame_sig(img, region)
+        if not state["moved"]:
+            state["moved"] = _sig_diff(sig, base) > change_tol
+        if _sig_diff(sig, state["prev"]) <= tol:
+            state["still"] += 1
+        else:
+            state["still"] = 0
+        state["prev"] = sig
+        return state["moved"] and state["still"] >= frames - 1
+    return _pred
+
+
+def any_of(*preds):
+    """Điều kiện hợp: trả giá trị truthy đầu tiên (mọi điều kiện đều được đánh giá để giữ trạng thái)."""
+    def _pred(img):
+        vals = [p(img) for p in preds]
+        return next((v for v in vals if v), None)
+    return _pred
+
+
+def wait_until(wk, predicate: Callable, timeout: float = 5.0, min_interval: float = WAIT_MIN_INTERVAL, *,
+               region=None, label: Optional[str] = None, baseline: Optional[float] = None):
+    """
+    Chờ tới khi predicate(frame) trả giá trị truthy → trả giá trị đó; hết timeout / bị huỷ → None
+    (phân biệt bằng aborted(wk)). Mỗi lần đánh giá dùng 1 frame MỚI hơn frame trước.
+    region: chỉ chụp/giải mã vùng này (điều kiện cũng phải nằm trong vùng).
+    label/baseline: tên bước + độ trễ cố định cũ (s) → log & thống kê thời gian tiết kiệm (wait_stats()).
+    """
+    t0 = time.monotonic()
+    end = t0 + max(0.0, timeout)
+    newer_than = None
+    result = None
+    while not aborted(wk):
+        left = end - time.monotonic()
+        img, ts = grab_frame(wk, newer_than=newer_than, timeout=min(3.0, max(left, 0.05)), region=region)
+        t_eval = time.monotonic()
+        if img is not None:
+            result = predicate(img)
+            free_img(img)
+            if result:
+                break
+            newer_than = ts + 1e-6 if getattr(wk, "_frame_pump", None) is not None else None
+        if t_eval >= end:
+            break
+        pause = min(t_eval + min_interval, end) - time.monotonic()
+        if pause > 0 and not sleep_coop(wk, pause):
+            break
+    if label:
+        waited = time.monotonic() - t0
+        saved = (baseline - waited) if baseline is not None else 0.0
+        _WAIT_STATS.add(label, waited, saved, bool(result))
+        if baseline is not None:
+            log_wk(wk, f"⏱️ {label}: {'sẵn sàng' if result else 'hết hạn'} sau {waited:.2f}s "
+                       f"(trước chờ cố định {baseline:.1f}s, {'tiết kiệm' if saved >= 0 else 'chậm hơn'} {abs(saved):.2f}s)")
+    return result or None
+
+
+def tap_and_settle(wk, x, y, timeout: float = 1.0, region=None, label: Optional[str] = None) -> bool:
+    """
+    Tap rồi chờ màn (region) ĐỔI so với trước tap và đứng yên lại; tối đa timeout (= độ trễ cố định cũ).
+    False nếu bị huỷ.
+    """
+    ref = grab_screen_np(wk, region=region)
+    tap(wk, x, y)
+    wait_until(wk, screen_settled(region, ref=ref), timeout, region=region, label=label, baseline=timeout)
+    free_img(ref)
+    return not aborted(wk)
+
+
 def ensure_inside_generic(wk,
                           img_outside: str, reg_outside: Tuple[int,int,int,int],
                           img_inside: str,  reg_inside: Tuple[int,int,int,int],
@@ -781,8 +1985,10 @@ def ensure_inside_generic(wk,
             return False
 
         img = grab_screen_np(wk)
-        ok_in, _, _  = find_on_frame(img, img_inside,  region=reg_inside,  threshold=DEFAULT_THR)
-        ok_out, _, _ = find_on_frame(img, img_outside, region=reg_outside, threshold=DEFAULT_THR)
+        (ok_in, _, _), (ok_out, _, _) = find_many_on_frame(img, [
+            (img_inside,  reg_inside,  DEFAULT_THR),
+            (img_outside, reg_outside, DEFAULT_THR),
+        ])
         free_img(img)
 
         if ok_in:
@@ -805,7 +2011,7 @@ def open_by_swiping(wk, tpl_path: str, region: Tuple[int,int,int,int],
     Tìm template theo pattern 'check trước → swipe → check sau' theo danh sách swipes.
     """
     # check ngay
-    img = grab_screen_np(wk)
+    img = grab_screen_np(wk, region=region)
     ok, pt, _ = find_on_frame(img, tpl_path, region=region, threshold=thr)
     free_img(img)
     if ok and pt:
@@ -819,7 +2025,7 @@ def open_by_swiping(wk, tpl_path: str, region: Tuple[int,int,int,int],
             if aborted(wk):
                 return False
             # check trước swipe
-            img = grab_screen_np(wk)
+            img = grab_screen_np(wk, region=region)
             ok, pt, _ = find_on_frame(img, tpl_path, region=region, threshold=thr)
             free_img(img)
             if ok and pt:
@@ -833,7 +2039,7 @@ def open_by_swiping(wk, tpl_path: str, region: Tuple[int,int,int,int],
             if not sleep_coop(wk, 0.3):
                 return False
 
-            img = grab_screen_np(wk)
+            img = grab_screen_np(wk, region=region)
             ok, pt, _ = find_on_frame(img, tpl_path, region=region, threshold=thr)
             free_img(img)
             if ok and pt:
@@ -854,7 +2060,7 @@ def reopen_until_visible(wk, open_fn: Callable[[], bool], check_tpl: str,
         if open_fn():
             # sau khi open thành công, xác nhận thấy template
             for _ in range(int(3 / max(wait, 0.1))):
-                img = grab_screen_np(wk)
+                img = grab_screen_np(wk, region=region)
                 ok, _, _ = find_on_frame(img, check_tpl, region=region, threshold=thr)
                 free_img(img)
                 if ok:
@@ -885,53 +2091,25 @@ def ocr_text_in_region(wk, y1: int, y2: int, x1: int, x2: int,
     Returns:
         str: text đã OCR (strip). Trả "" nếu lỗi/không có gì.
     """
-    img = grab_screen_np(wk)
+    img = grab_screen_np(wk, region=(x1, y1, x2, y2))
     if img is None:
         return ""
 
     try:
-        # Clamp to bounds & kiểm tra hợp lệ
-        h, w = img.shape[:2]
-        y1c, y2c = max(0, min(y1, h)), max(0, min(y2, h))
-        x1c, x2c = max(0, min(x1, w)), max(0, min(x2, w))
-        if y2c <= y1c or x2c <= x1c:
+        # Clamp to bounds & kiểm tra hợp lệ, cắt ROI (copy)
+        roi = crop_frame(img, (x1, y1, x2, y2), copy=True)
+        if roi is None or roi.size == 0:
             return ""
 
-        # Cắt ROI (copy) và tiền xử lý: gray -> blur -> Otsu
-        roi = img[y1c:y2c, x1c:x2c].copy()
+        # Tiền xử lý: gray -> blur -> Otsu
         gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
         gray = cv2.GaussianBlur(gray, (3, 3), 0)
         gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
 
-        # Chọn ngôn ngữ: ưu tiên vie+eng -> vie -> eng
-        langs_avail = (_list_langs() or "").lower()
-        def _has(lang_code: str) -> bool:
-            return lang_code and lang_code.lower() in langs_avail
-
-        chosen = None
-        # nếu lang_preference là combo kiểu 'a+b'
-        if "+" in (lang_preference or ""):
-            parts = [p.strip().lower() for p in lang_preference.split("+") if p.strip()]
-            if parts and all(_has(p) for p in parts):
-                chosen = "+".join(parts)
-        # nếu chưa chọn được thì thử mặc định chuỗi ưu tiên
-        if not chosen:
-            if _has("vie") and _has("eng"):
-                chosen = "vie+eng"
-            elif _has("vie"):
-                chosen = "vie"
-            elif _has("eng"):
-                chosen = "eng"
-            else:
-                chosen = "eng"  # fallback an toàn
-
-        # Cấu hình Tesseract (không lưu file nào)
-        cfg = f'--psm {psm} --oem 3 --tessdata-dir "{TESSDATA_DIR}"'
-        if whitelist:
-            cfg += f' -c tessedit_char_whitelist={whitelist}'
-
-        text = pytesseract.image_to_string(gray, lang=chosen, config=cfg)
-        return (text or "").strip()
+        # Chọn ngôn ngữ: combo ưu tiên -> vie+eng -> vie -> eng (dò ngôn ngữ 1 lần)
+        eng = get_ocr_engine()
+        chosen = eng.choose_lang(lang_preference)
+        return eng.recognize(gray, lang=chosen, psm=psm, whitelist=whitelist)
 
     except Exception:
         return ""
@@ -0,0 +1,182 @@
+# ocr_cache.py
+# ==========================================================
+#  Bộ nhớ đệm kết quả OCR theo NỘI DUNG ảnh: khoá = hash cảm nhận (perceptual hash)
+#  của ROI đã nhị phân → cùng 1 dòng tên xuất hiện lại (trang cuộn chồng nhau,
+#  tài khoản khác chúc cùng target trong ngày) thì trả ngay, không gọi Tesseract.
+#  LRU giới hạn số mục, dùng chung mọi AccountRunner (có khoá), tuỳ chọn lưu ra đĩa.
+#  Chỉ nhận kết quả có chữ và đủ độ tin cậy (frame chuyển cảnh/mờ không bị "đóng băng" vào cache);
+#  mục có hạn dùng (ttl) và file lưu kèm chữ ký (signature) → đổi engine/tiền xử lý là bỏ cache cũ.
+# ==========================================================
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# Kích thước chuẩn hoá khi băm (đủ nét để phân biệt dấu tiếng Việt, đủ thô để bỏ qua lệch 1–2 px)
+HASH_W = 96
+HASH_H = 24
+_FILE_VERSION = 2
+
+
+def roi_hash(binary: np.ndarray) -> str:
+    """
+    Hash cảm nhận của ROI nhị phân (0/255): cắt sát vùng chữ (màu thiểu số) → resize về
+    HASH_W x HASH_H → 1 bit/ô. Dịch ROI vài px (trang cuộn lệch) không đổi khoá.
+    """
+    if binary is None or binary.size == 0:
+        return "empty"
+    ink = binary < 128
+    if np.count_nonzero(ink) * 2 > ink.size:  # chữ là màu chiếm ít hơn
+        ink = ~ink
+    ink = ink.astype(np.uint8)
+    # bỏ các mảng chạm mép ROI (viền/hoạ tiết bị cắt dở, thay đổi theo vị trí cuộn)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    if n > 1:
+        h, w = ink.shape
+        x, y, bw, bh = stats[1:, 0], stats[1:, 1], stats[1:, 2], stats[1:, 3]
+        inner = (x > 0) & (y > 0) & (x + bw < w) & (y + bh < h)
+        if inner.any():
+            keep = np.zeros(n, dtype=np.uint8)
+            keep[1:][inner] = 1
+            ink = keep[labels]
+    ys = np.flatnonzero(ink.any(axis=1))
+    xs = np.flatnonzero(ink.any(axis=0))
+    if ys.size == 0:
+        return "blank"
+    glyphs = ink[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1] * 255
+    h, w = glyphs.shape
+    small = cv2.resize(glyphs, (HASH_W, HASH_H), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small >= 128)
+    aspect = int(round(w * 4.0 / max(h, 1)))  # tỉ lệ khung (bước 1/4) để tên dài/ngắn không trùng
+    return hashlib.blake2b(bits.tobytes() + aspect.to_bytes(4, "little"), digest_size=16).hexdigest()
+
+
+class OcrCache:
+    """
+    get(key) / put(key, text, conf) an toàn đa luồng; key tạo bằng make_key().
+    path=None → chỉ giữ trong RAM; có path → load() lúc tạo, save() khi thoát.
+    min_conf: put() bỏ qua kết quả có độ tin cậy thấp hơn (conf=None: không rõ → chỉ cần có chữ).
+    ttl (giây): mục cũ hơn coi như trượt; signature: khác chữ ký trong file → load() bỏ cả file.
+    """
+
+    def __init__(self, max_entries: int = 4096, path: Optional[Path] = None, min_conf: float = 0.0,
+                 ttl: Optional[float] = None, signature: str = ""):
+        self.max_entries = max(1, int(max_entries))
+        self.path = Path(path) if path else None
+        self.min_conf = float(min_conf)
+        self.ttl = ttl
+        self.signature = signature
+        # key → (text, conf | None, thời điểm ghi time.time())
+        self._data: "OrderedDict[str, tuple[str, Optional[float], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(binary: np.ndarray, lang: str, psm: int, whitelist: Optional[str] = None,
+                 kind: str = "text") -> str:
+        # kind: "text" (ocr_image, chỉ có chữ) / "conf" (ocr_regions, có độ tin cậy) — không lẫn nhau
+        return f"{kind}|{lang}|{int(psm)}|{whitelist or ''}|{roi_hash(binary)}"
+
+    def accepts(self, text: str, conf: Optional[float] = None) -> bool:
+        """Kết quả đáng lưu: có chữ, và (nếu biết) độ tin cậy >= min_conf."""
+        return bool(text and text.strip()) and (conf is None or conf >= self.min_conf)
+
+    def _expired(self, ts: float, now: float) -> bool:
+        return self.ttl is not None and now - ts > self.ttl
+
+    def get(self, key: str) -> Optional[tuple[str, Optional[float]]]:
+        with self._lock:
+            val = self._data.get(key)
+            if val is not None and self._expired(val[2], time.time()):
+                del self._data[key]
+                self._dirty = True
+                val = None
+            if val is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return val[0], val[1]
+
+    def put(self, key: str, text: str, conf: Optional[float] = None) -> bool:
+        """Lưu kết quả; trả False (không lưu) nếu rỗng / độ tin cậy dưới min_conf."""
+        if not self.accepts(text, conf):
+            return False
+        with self._lock:
+            self._data[key] = (text, None if conf is None else float(conf), time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            self._dirty = True
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # ---------- thống kê ----------
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe(self) -> str:
+        return (f"OCR cache: {self.hits} trúng / {self.misses} trượt "
+                f"({self.hit_rate() * 100:.0f}%), {len(self._data)} mục")
+
+    # ---------- lưu đĩa ----------
+    def load(self) -> int:
+        if not self.path or not self.path.exists():
+            return 0
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            return 0
+        if not isinstance(raw, dict) or raw.get("v") != _FILE_VERSION or raw.get("sig") != self.signature:
+            return 0  # file cũ / engine khác → bỏ, lần save() sau ghi đè
+        now = time.time()
+        with self._lock:
+            for item in raw.get("entries", [])[-self.max_entries:]:
+                try:
+                    key, text, conf, ts = item
+                    text, ts = str(text), float(ts)
+                    conf = None if conf is None else float(conf)
+                except (TypeError, ValueError):
+                    continue
+                if self._expired(ts, now) or not self.accepts(text, conf):
+                    continue
+                self._data[str(key)] = (text, conf, ts)
+            self._dirty = False
+            return len(self._data)
+
+    def save(self) -> bool:
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return True
+            entries = [[k, t, c, ts] for k, (t, c, ts) in self._data.items()]
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"v": _FILE_VERSION, "sig": self.signature, "entries": entries}, ensure_ascii=False),
+                           encoding="utf-8")
+            os.replace(tmp, self.path)
+            return True
+        except Exception:
+            return False
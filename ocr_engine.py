@@ -0,0 +1,258 @@
+# ocr_engine.py
+# ==========================================================
+#  Lớp OCR dùng chung: giữ sẵn handle Tesseract (tesserocr.PyTessBaseAPI) đã nạp model,
+#  mỗi thread 1 handle cho mỗi tổ hợp (lang, psm, whitelist) → không spawn tesseract.exe,
+#  không ghi file tạm cho từng ROI. Nhận thẳng numpy (gray/nhị phân uint8).
+#  Không có tesserocr → dùng pytesseract như cũ (vẫn bỏ được lệnh --list-langs mỗi lần).
+#  Benchmark: python ocr_engine.py [ảnh.png]
+# ==========================================================
+from __future__ import annotations
+
+import os
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+try:
+    import tesserocr
+except ImportError:  # tuỳ chọn: pip install tesserocr
+    tesserocr = None
+
+import pytesseract
+
+
+class OcrEngine:
+    """
+    recognize(img) → text; recognize_conf(img) → (text, độ tin cậy 0..100).
+    Handle tesserocr sống theo thread (threading.local), nên nhiều AccountRunner OCR song song
+    không tranh nhau 1 handle.
+    """
+
+    def __init__(self, tesseract_cmd: str, tessdata_dir: str):
+        self.tesseract_cmd = tesseract_cmd
+        self.tessdata_dir = tessdata_dir
+        self._langs: Optional[set[str]] = None
+        self._langs_lock = threading.Lock()
+        self._chosen: dict[str, str] = {}
+        self._local = threading.local()
+
+    @property
+    def backend(self) -> str:
+        return "tesserocr" if tesserocr is not None else "pytesseract"
+
+    def _tessdata_prefix(self) -> str:
+        prefix = str(self.tessdata_dir)
+        if not prefix.endswith(("\\", "/")):
+            prefix += os.sep
+        return prefix
+
+    # ---------- ngôn ngữ (dò 1 lần) ----------
+    def langs(self) -> set[str]:
+        with self._langs_lock:
+            if self._langs is None:
+                self._langs = self._detect_langs()
+            return self._langs
+
+    def _detect_langs(self) -> set[str]:
+        if tesserocr is not None:
+            try:
+                return {l.lower() for l in tesserocr.get_languages(self._tessdata_prefix())[1]}
+            except Exception:
+                pass
+        try:
+            startupinfo = None
+            if os.name == 'nt':
+                startupinfo = subprocess.STARTUPINFO()
+                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            out = subprocess.run([self.tesseract_cmd, "--list-langs"], capture_output=True, text=True,
+                                 timeout=5, startupinfo=startupinfo).stdout or ""
+        except Exception:
+            return set()
+        return {ln.strip().lower() for ln in out.splitlines()[1:] if ln.strip()}
+
+    def choose_lang(self, preference: str = "vie+eng") -> str:
+        """Chọn ngôn ngữ: combo ưu tiên nếu đủ → vie+eng → vie → eng (cache theo preference)."""
+        pref = (preference or "").lower()
+        chosen = self._chosen.get(pref)
+        if chosen:
+            return chosen
+        have = self.langs()
+        parts = [p.strip() for p in pref.split("+") if p.strip()]
+        if "+" in pref and parts and all(p in have for p in parts):
+            chosen = "+".join(parts)
+        elif "vie" in have and "eng" in have:
+            chosen = "vie+eng"
+        elif "vie" in have:
+            chosen = "vie"
+        else:
+            chosen = "eng"  # fallback an toàn
+        self._chosen[pref] = chosen
+        return chosen
+
+    # ---------- handle theo thread ----------
+    def _api(self, lang: str, psm: int, whitelist: Optional[str]):
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        key = (lang, int(psm), whitelist or "")
+        api = apis.get(key)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(path=self._tessdata_prefix(), lang=lang, psm=int(psm))
+            if whitelist:
+                api.SetVariable("tessedit_char_whitelist", whitelist)
+            apis[key] = api
+        return api
+
+    def close_thread(self):
+        """Giải phóng các handle của thread hiện tại (gọi khi thread worker kết thúc)."""
+        apis = getattr(self._local, "apis", None) or {}
+        self._local.apis = {}
+        for api in apis.values():
+            try:
+                api.End()
+            except Exception:
+                pass
+
+    # ---------- nhận dạng ----------
+    def recognize_conf(self, img: np.ndarray, lang: str = "eng", psm: int = 6,
+                       whitelist: Optional[str] = None) -> tuple[str, float]:
+        """img: ảnh gray/nhị phân uint8 (hoặc BGR). Trả (text đã strip, độ tin cậy trung bình 0..100)."""
+        if img is None or img.size == 0:
+            return "", 0.0
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        if tesserocr is not None:
+            api = self._api(lang, psm, whitelist)
+            h, w = img.shape[:2]
+            bpp = 1 if img.ndim == 2 else img.shape[2]
+            api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+            text = api.GetUTF8Text() or ""
+            conf = float(api.MeanTextConf())
+            api.Clear()
+            return text.strip(), max(conf, 0.0)
+        cfg = f'--psm {psm} --oem 3'
+        if whitelist:
+            cfg += f' -c tessedit_char_whitelist={whitelist}'
+        data = pytesseract.image_to_data(img, lang=lang, config=cfg, output_type=pytesseract.Output.DICT)
+        words, confs = [], []
+        line_key, lines = None, []
+        for i, word in enumerate(data.get("text", [])):
+            c = float(data["conf"][i])
+            if c < 0 or not word.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            if key != line_key and words:
+                lines.append(" ".join(words))
+                words = []
+            line_key = key
+            words.append(word)
+            confs.append(c)
+        if words:
+            lines.append(" ".join(words))
+        return "\n".join(lines).strip(), (sum(confs) / len(confs) if confs else 0.0)
+
+    def recognize_words(self, img: np.ndarray, lang: str = "eng", psm: int = 6,
+                        whitelist: Optional[str] = None) -> list[tuple[str, float, tuple[int, int, int, int], bool]]:
+        """
+        Nhận dạng 1 lần, trả từng TỪ: (text, conf 0..100, (x, y, w, h), bắt_đầu_dòng_mới).
+        Dùng cho OCR gộp nhiều ROI trên 1 ảnh ghép rồi chia lại theo toạ độ y.
+        """
+        if img is None or img.size == 0:
+            return []
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        words = []
+        if tesserocr is not None:
+            api = self._api(lang, psm, whitelist)
+            h, w = img.shape[:2]
+            bpp = 1 if img.ndim == 2 else img.shape[2]
+            api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+            api.Recognize()
+            ri = api.GetIterator()
+            level = tesserocr.RIL.WORD
+            if ri is not None:
+                while True:
+                    text = ri.GetUTF8Text(level) or ""
+                    if text.strip():
+                        x1, y1, x2, y2 = ri.BoundingBox(level)
+                        words.append((text.strip(), float(ri.Confidence(level)), (x1, y1, x2 - x1, y2 - y1),
+                                      bool(ri.IsAtBeginningOf(tesserocr.RIL.TEXTLINE))))
+                    if not ri.Next(level):
+                        break
+            api.Clear()
+            return words
+        cfg = f'--psm {psm} --oem 3'
+        if whitelist:
+            cfg += f' -c tessedit_char_whitelist={whitelist}'
+        data = pytesseract.image_to_data(img, lang=lang, config=cfg, output_type=pytesseract.Output.DICT)
+        line_key = None
+        for i, word in enumerate(data.get("text", [])):
+            c = float(data["conf"][i])
+            if c < 0 or not word.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            words.append((word.strip(), c, (data["left"][i], data["top"][i], data["width"][i], data["height"][i]),
+                          key != line_key))
+            line_key = key
+        return words
+
+    def recognize(self, img: np.ndarray, lang: str = "eng", psm: int = 6,
+                  whitelist: Optional[str] = None) -> str:
+        if img is None or img.size == 0:
+            return ""
+        if tesserocr is not None:
+            return self.recognize_conf(img, lang=lang, psm=psm, whitelist=whitelist)[0]
+        cfg = f'--psm {psm} --oem 3'
+        if whitelist:
+            cfg += f' -c tessedit_char_whitelist={whitelist}'
+        return (pytesseract.image_to_string(img, lang=lang, config=cfg) or "").strip()
+
+
+# ================== BENCHMARK ==================
+if __name__ == "__main__":
+    import sys
+    import cv2
+    import module
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "screen.png"
+    frame = cv2.imread(path)
+    if frame is None:
+        sys.exit(f"Không đọc được ảnh: {path}")
+    # 7 ô tên của bảng xếp hạng (flows_chuc_phuc.OCR_SLOTS) làm mẫu ROI
+    rois = [(330, 203, 540, 260), (330, 343, 540, 421), (330, 493, 540, 573), (330, 646, 540, 721),
+            (330, 795, 540, 880), (330, 945, 540, 1013), (330, 1098, 540, 1170)]
+    rounds = int(os.environ.get("OCR_BENCH_ROUNDS", "3"))
+
+    def _prep(roi):
+        g = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        g = cv2.GaussianBlur(g, (3, 3), 0)
+        return cv2.threshold(g, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+    def _old(roi):
+        # đường cũ: --list-langs + pytesseract (1 process tesseract / ROI)
+        module._list_langs_uncached()
+        return pytesseract.image_to_string(_prep(roi), lang="vie+eng", config="--psm 6 --oem 3")
+
+    eng = module.get_ocr_engine()
+    lang = eng.choose_lang("vie+eng")
+
+    def _new(roi):
+        return eng.recognize(_prep(roi), lang=lang, psm=6)
+
+    for name, fn in (("pytesseract (cũ)", _old), (f"OcrEngine/{eng.backend}", _new)):
+        fn(frame[rois[0][1]:rois[0][3], rois[0][0]:rois[0][2]])  # làm nóng
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for x1, y1, x2, y2 in rois:
+                fn(frame[y1:y2, x1:x2])
+        ms = (time.perf_counter() - t0) * 1000.0 / (rounds * len(rois))
+        print(f"{name:28s}: {ms:8.1f} ms/ROI")
+
+    # cả trang 7 ô: 1 lần nhận dạng gộp (module.ocr_regions)
+    module.ocr_regions(frame, rois)  # làm nóng
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        module.ocr_regions(frame, rois)
+    ms = (time.perf_counter() - t0) * 1000.0 / (rounds * len(rois))
+    print(f"{'ocr_regions (gộp 7 ô)':28s}: {ms:8.1f} ms/ROI")
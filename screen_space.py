@@ -0,0 +1,86 @@
+# screen_space.py
+# ==========================================================
+#  Hệ toạ độ THAM CHIẾU cho flows_*: mọi REG_*, điểm tap, template đều viết theo
+#  màn 900x1600. Mỗi thiết bị được đo 1 lần (`wm size`) → ScreenSpace đổi
+#  toạ độ tham chiếu ↔ pixel thật, nên máy ảo chạy độ phân giải thấp hơn
+#  (ít pixel/frame → chụp + khớp nhanh hơn) mà không phải sửa flow nào.
+# ==========================================================
+from __future__ import annotations
+
+import math
+import re
+from typing import Optional, Tuple
+
+# Màn tham chiếu (toạ độ đang viết trong flows_*)
+REF_W, REF_H = 900, 1600
+
+_SIZE_RE = re.compile(r"(Physical|Override) size:\s*(\d+)\s*x\s*(\d+)")
+
+
+def parse_wm_size(text: str) -> Optional[Tuple[int, int]]:
+    """
+    Đọc output `wm size` → (w, h) đang dùng (ưu tiên Override nếu có).
+    """
+    sizes = {}
+    for kind, w, h in _SIZE_RE.findall(text or ""):
+        sizes[kind] = (int(w), int(h))
+    return sizes.get("Override") or sizes.get("Physical")
+
+
+def scale_region(region, scale: float, origin=(0, 0)):
+    """Region tham chiếu → pixel của ảnh có `scale` (px / đơn vị tham chiếu), trừ origin (px)."""
+    x1, y1, x2, y2 = region
+    ox, oy = origin
+    if scale == 1.0:
+        return x1 - ox, y1 - oy, x2 - ox, y2 - oy
+    # làm tròn RA NGOÀI để vùng thu nhỏ vẫn phủ trọn vùng tham chiếu
+    return (math.floor(x1 * scale) - ox, math.floor(y1 * scale) - oy,
+            math.ceil(x2 * scale) - ox, math.ceil(y2 * scale) - oy)
+
+
+class ScreenSpace:
+    """
+    Ánh xạ toạ độ tham chiếu (REF_W x REF_H) ↔ pixel thiết bị.
+    scale = pixel thiết bị / đơn vị tham chiếu (1.0 với máy 900x1600 như cũ).
+    """
+
+    def __init__(self, dev_w: int = REF_W, dev_h: int = REF_H):
+        self.dev_w = int(dev_w)
+        self.dev_h = int(dev_h)
+        self.sx = self.dev_w / float(REF_W)
+        self.sy = self.dev_h / float(REF_H)
+        # game giữ tỉ lệ 9:16 → dùng 1 hệ số chung (theo chiều ngang) cho template
+        self.scale = self.sx
+
+    @property
+    def is_identity(self) -> bool:
+        return self.dev_w == REF_W and self.dev_h == REF_H
+
+    @property
+    def aspect_ok(self) -> bool:
+        return abs(self.sx - self.sy) <= 0.01 * self.sx
+
+    def to_dev(self, x, y) -> Tuple[int, int]:
+        if self.is_identity:
+            return int(x), int(y)
+        return int(round(x * self.sx)), int(round(y * self.sy))
+
+    def to_ref(self, x, y) -> Tuple[int, int]:
+        if self.is_identity:
+            return int(x), int(y)
+        return int(round(x / self.sx)), int(round(y / self.sy))
+
+    def region_to_dev(self, region):
+        x1, y1 = self.to_dev(region[0], region[1])
+        x2, y2 = self.to_dev(region[2], region[3])
+        return x1, y1, x2, y2
+
+    def describe(self) -> str:
+        note = "" if self.aspect_ok else " (KHÁC tỉ lệ 9:16, toạ độ có thể lệch)"
+        return f"{self.dev_w}x{self.dev_h} (x{self.scale:.3f} so với {REF_W}x{REF_H}){note}"
+
+    def __repr__(self) -> str:
+        return f"ScreenSpace({self.dev_w}x{self.dev_h})"
+
+
+IDENTITY = ScreenSpace()
@@ -0,0 +1,205 @@
+# snake_planner.py
+# ==========================================================
+#  Lập lộ trình cho game rắn trên lưới (mặc định 15x15):
+#   - ô đánh số phẳng i = r * cols + c; mặt nạ cột dựng sẵn theo kích thước lưới
+#   - BFS song song theo bit (mỗi tầng BFS = 1 số nguyên Python, 1 bit / ô) từ đầu rắn + từng mồi
+#     → khoảng cách mọi cặp (đầu, mồi, cửa) tính 1 lần / bàn, đường đi dựng lại từ các tầng
+#   - thứ tự ăn mồi = TSP đường hở: láng giềng gần nhất + 2-opt, điểm cuối là cửa ra gần nhất
+#   - ghép đường đi thật từng chặng; chặng nào đâm vào thân rắn thì BFS lại, chặn thân rút dần theo đuôi
+#  Thay cho A* theo dict tuple, gọi lại cho từng miếng mồi còn lại (O(mồi × A*)).
+# ==========================================================
+from __future__ import annotations
+
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+Cell = tuple[int, int]
+INF = 1 << 30
+
+
+@lru_cache(maxsize=8)
+def _column_masks(rows: int, cols: int) -> tuple[int, int]:
+    """Mặt nạ bit "không ở cột đầu" / "không ở cột cuối" — chặn tràn sang hàng khác khi dịch bit ±1."""
+    c = np.arange(rows * cols) % cols
+    not_first = sum(1 << int(i) for i in np.flatnonzero(c != 0))
+    not_last = sum(1 << int(i) for i in np.flatnonzero(c != cols - 1))
+    return not_first, not_last
+
+
+class GridPlanner:
+    """
+    Lưới đã biết tường (grid == 1). `passable` = các ô cho phép đi dù là tường (vd cửa ở viền).
+    levels()/unwind_levels() làm việc trên chỉ số phẳng; route() trả danh sách ô (hàng, cột).
+    """
+
+    def __init__(self, grid, passable: Iterable[Cell] = ()):
+        grid = np.asarray(grid)
+        self.rows, self.cols = grid.shape
+        free = grid.reshape(-1) != 1
+        for rc in passable:
+            free[self.idx(rc)] = True
+        self.free = free
+        self.free_bits = sum(1 << int(i) for i in np.flatnonzero(free))
+        self._masks = _column_masks(self.rows, self.cols)
+
+    def idx(self, rc: Cell) -> int:
+        return int(rc[0]) * self.cols + int(rc[1])
+
+    def cell(self, i: int) -> Cell:
+        return divmod(int(i), self.cols)
+
+    # ---------- BFS theo bit ----------
+    def levels(self, src: int, body: Sequence[int] = ()) -> list[int]:
+        """
+        Các tầng BFS từ src: levels[k] = mặt nạ bit các ô cách src đúng k bước.
+        body: thân rắn từ ĐUÔI tới cổ — đốt thứ i chỉ trống từ bước i + 1 (thân rút dần theo đuôi).
+        """
+        not_first, not_last = self._masks
+        cols, free = self.cols, self.free_bits
+        # held[t] = các ô thân còn chiếm ở bước t (hợp các đốt từ t trở đi)
+        held = [0] * (len(body) + 1)
+        for i in range(len(body) - 1, -1, -1):
+            held[i] = held[i + 1] | (1 << body[i])
+        front = seen = 1 << src
+        out = [front]
+        while True:
+            nxt = (front << cols) | (front >> cols) | ((front << 1) & not_first) | ((front >> 1) & not_last)
+            front = nxt & free & ~seen
+            t = len(out)
+            if t < len(held):
+                front &= ~held[t]
+            if not front:
+                return out
+            seen |= front
+            out.append(front)
+
+    @staticmethod
+    def level_of(levels: Sequence[int], v: int) -> int:
+        bit = 1 << v
+        for k, f in enumerate(levels):
+            if f & bit:
+                return k
+        return INF
+
+    @staticmethod
+    def dist_row(levels: Sequence[int], targets: Sequence[int]) -> list[int]:
+        """Khoảng cách tới nhiều ô trong 1 lượt duyệt tầng."""
+        bits = [1 << v for v in targets]
+        want = 0
+        for b in bits:
+            want |= b
+        row = [INF] * len(bits)
+        for k, f in enumerate(levels):
+            if f & want:
+                for j, b in enumerate(bits):
+                    if f & b:
+                        row[j] = k
+                want &= ~f
+                if not want:
+                    break
+        return row
+
+    def unwind_levels(self, levels: Sequence[int], dst: int) -> Optional[list[int]]:
+        """Dựng lại đường src → dst (gồm cả 2 đầu) bằng cách lùi từ tầng của dst về tầng 0."""
+        k = self.level_of(levels, dst)
+        if k >= INF:
+            return None
+        out = [dst]
+        cur = dst
+        for k in range(k - 1, -1, -1):
+            f = levels[k]
+            r, c = divmod(cur, self.cols)
+            for u, ok in ((cur - self.cols, r > 0), (cur + self.cols, r < self.rows - 1),
+                          (cur - 1, c > 0), (cur + 1, c < self.cols - 1)):
+                if ok and (f >> u) & 1:
+                    cur = u
+                    break
+            out.append(cur)
+        return out[::-1]
+
+    # ---------- thứ tự ăn mồi ----------
+    @staticmethod
+    def order(dist: np.ndarray, exit_cost: np.ndarray, two_opt: bool = True) -> list[int]:
+        """
+        TSP đường hở trên ma trận dist (nút 0 = đầu rắn, 1..n = mồi), cộng exit_cost[nút cuối].
+        Láng giềng gần nhất rồi 2-opt (đảo đoạn) tới khi không cải thiện. Trả thứ tự mồi (1..n).
+        """
+        d = dist.tolist()
+        e = exit_cost.tolist()
+        n = len(d) - 1
+        left = set(range(1, n + 1))
+        tour, cur = [0], 0
+        while left:
+            row = d[cur]
+            cur = min(left, key=lambda j: (row[j], j))
+            tour.append(cur)
+            left.remove(cur)
+        if two_opt and n >= 2:
+            improved = True
+            while improved:
+                improved = False
+                for i in range(1, n):
+                    for j in range(i + 1, n + 1):
+                        a, b, c = tour[i - 1], tour[i], tour[j]
+                        if j == n:   # đoạn cuối: cạnh "ra cửa" đổi theo nút kết thúc
+                            delta = d[a][c] + e[b] - d[a][b] - e[c]
+                        else:
+                            nx = tour[j + 1]
+                            delta = d[a][c] + d[b][nx] - d[a][b] - d[c][nx]
+                        if delta < 0:
+                            tour[i:j + 1] = tour[i:j + 1][::-1]
+                            improved = True
+        return tour[1:]
+
+    def route(self, start: Cell, foods: Sequence[Cell], gates: Sequence[Cell], *,
+              grow: int = 1, two_opt: bool = True) -> Optional[list[Cell]]:
+        """
+        Lộ trình ăn hết `foods` rồi ra 1 trong `gates` (không gồm ô xuất phát), None nếu kẹt.
+        Thân rắn = `grow` ô / mồi đã ăn, bám theo sau đầu; khi ghép từng chặng, ô thân chỉ đi được
+        sau khi đuôi đã rút khỏi đó.
+        """
+        s = self.idx(start)
+        nodes = [s] + [self.idx(f) for f in foods]
+        gate_idx = [self.idx(g) for g in gates]
+        lv = [self.levels(u) for u in nodes]                      # 1 BFS / nút, dùng lại khi ghép đường
+        dist = np.array([self.dist_row(l, nodes) for l in lv], dtype=np.int64)
+        if (dist[0, 1:] >= INF).any():
+            return None
+        exit_cost = np.array([min(self.dist_row(l, gate_idx), default=INF) for l in lv], dtype=np.int64)
+
+        seq = self.order(dist, exit_cost, two_opt=two_opt) if len(nodes) > 1 else []
+        last = seq[-1] if seq else 0
+        legs = [(k, nodes[k]) for k in seq]
+        if gate_idx:                                              # chặng cuối: cửa gần mồi cuối nhất
+            gate = min(gate_idx, key=lambda g: self.level_of(lv[last], g))
+            if self.level_of(lv[last], gate) >= INF:
+                return None
+            legs.append((None, gate))
+
+        body: deque[int] = deque()
+        out: list[int] = []
+        src, src_lv = s, lv[0]
+        for leg, (k, dst) in enumerate(legs):
+            seg = self.unwind_levels(src_lv, dst)
+            # đuôi (đầu deque) rời ô sau 1 bước, đốt kế tiếp sau 2 bước...
+            free_at = {v: i + 1 for i, v in enumerate(body)}
+            if seg is None or any(step < free_at.get(v, 0) for step, v in enumerate(seg[1:], 1)):
+                seg = self.unwind_levels(self.levels(src, body), dst)  # đường ngắn nhất đâm vào thân → BFS lại
+                if seg is None:
+                    return None
+            body.extend(seg[:-1])
+            while len(body) > min(leg + 1, len(seq)) * grow:
+                body.popleft()
+            out.extend(seg[1:])
+            if k is not None:
+                src, src_lv = dst, lv[k]
+        return [self.cell(i) for i in out]
+
+
+def plan_route(grid, start: Cell, foods: Sequence[Cell], gates: Sequence[Cell], *,
+               grow: int = 1, two_opt: bool = True) -> Optional[list[Cell]]:
+    """Lối tắt: dựng GridPlanner (cửa luôn đi được) rồi route()."""
+    return GridPlanner(grid, passable=gates).route(start, foods, gates, grow=grow, two_opt=two_opt)
@@ -0,0 +1,208 @@
+# File: bench_snake_grid.py
+# So sánh phân tích bàn rắn: quét template (analyze_scene_with_templates) với phân loại theo ô (analyze_scene_grid).
+#   1) Ảnh chụp THẬT không phải bàn rắn (screen.png, test/screen.png, test/debug_grid_and_objects.png):
+#      mọi cách phải báo KHÔNG có đầu rắn (nếu không flow sẽ lập kế hoạch trên màn khác / báo lệch giả).
+#   2) Ảnh chụp THẬT bàn rắn: đặt vào test/snake_boards/*.png (chụp 900x1600 khi đang chơi).
+#      Không có đáp án → so phân loại theo ô (hiệu chỉnh từ template) với template trên cùng ảnh.
+#   3) Bàn GIẢ LẬP (biết trước đáp án): nền bàn + nhiễu + lệch sáng, dán head/bait/ice lệch tâm ±1 px,
+#      thân rắn màu da. Chỉ để đo tốc độ / độ bền, KHÔNG thay cho (2) vì chữ ký mặc định lấy từ chính template.
+#   Mỗi phần chạy ở 900x1600 và frame thu nhỏ 1/2.
+# Chạy: python test/bench_snake_grid.py [số_bàn]
+
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)  # SNAKE_IMAGES là đường dẫn tương đối
+
+import flows_snake_game as fsg  # noqa: E402
+from module import tag_frame  # noqa: E402
+
+ROUNDS = int(os.environ.get("SNAKE_BENCH_ROUNDS", "5"))
+AREA = fsg.GAME_AREA_COORDS
+DIMS = fsg.GRID_DIMENSIONS
+SCALES = (1.0, 0.5)
+NON_BOARD = ("screen.png", "test/screen.png", "test/debug_grid_and_objects.png")
+BOARD_DIR = ROOT / "test" / "snake_boards"
+
+
+def _scaled(img, scale):
+    if scale == 1.0:
+        return img
+    return tag_frame(cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale)
+
+
+def _time_ms(fn, rounds=ROUNDS):
+    fn()  # làm nóng (cache template / chữ ký)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        out = fn()
+    return (time.perf_counter() - t0) * 1000.0 / rounds, out
+
+
+def _calibrated(img):
+    """Như flow: quét template đầu màn → chữ ký của bàn (None nếu không thấy đầu rắn)."""
+    objects = fsg.analyze_scene_with_templates(img, DIMS, AREA)[1]
+    return fsg.calibrate_signatures(img, objects, DIMS, AREA)
+
+
+# ---------- 1) ảnh thật không phải bàn rắn ----------
+def bench_non_board():
+    print("== Ảnh thật KHÔNG phải bàn rắn (phải báo không có đầu rắn) ==")
+    for rel in NON_BOARD:
+        img = cv2.imread(str(ROOT / rel))
+        if img is None:
+            print(f"  {rel}: không đọc được, bỏ qua")
+            continue
+        for scale in SCALES:
+            im = _scaled(img, scale)
+            res = {
+                'template': fsg.analyze_scene_with_templates(im, DIMS, AREA)[1],
+                'theo ô': fsg.analyze_scene_grid(im, DIMS, AREA)[1],
+                'analyze_scene': fsg.analyze_scene(im, DIMS, AREA)[1],
+            }
+            parts = []
+            for name, o in res.items():
+                bad = o['snake_head'] is not None or o['snake_body'] or o['food'] or o['wall']
+                parts.append(f"{name} {'SAI ' + str(o['snake_head']) if bad else 'ok'}")
+            print(f"  {rel} x{scale:.1f}: " + " | ".join(parts))
+
+
+# ---------- 2) ảnh thật bàn rắn ----------
+def bench_real_boards():
+    print("== Ảnh thật bàn rắn (test/snake_boards) ==")
+    paths = sorted(BOARD_DIR.glob("*.png")) if BOARD_DIR.is_dir() else []
+    if not paths:
+        print("  (chưa có ảnh) chụp màn hình 900x1600 lúc đang chơi rắn vào test/snake_boards/ để đo trên bàn thật")
+        return
+    for p in paths:
+        img = cv2.imread(str(p))
+        if img is None:
+            continue
+        for scale in SCALES:
+            im = _scaled(img, scale)
+            ms_t, (_, o_t) = _time_ms(lambda: fsg.analyze_scene_with_templates(im, DIMS, AREA))
+            sig = fsg.calibrate_signatures(im, o_t, DIMS, AREA)
+            ms_g, (_, o_g) = _time_ms(lambda: fsg.analyze_scene_grid(im, DIMS, AREA, sig))
+            same = (o_g['snake_head'] == o_t['snake_head']
+                    and sorted(o_g['food']) == sorted(o_t['food'])
+                    and sorted(o_g['wall']) == sorted(o_t['wall']))
+            print(f"  {p.name} x{scale:.1f}: template đầu {o_t['snake_head']} mồi {len(o_t['food'])} "
+                  f"băng {len(o_t['wall'])} ({ms_t:.1f} ms) | theo ô (hiệu chỉnh) "
+                  f"{'khớp' if same else 'KHÁC: đầu ' + str(o_g['snake_head'])} ({ms_g:.1f} ms)")
+
+
+# ---------- 3) bàn giả lập ----------
+_TPL = None
+
+
+def _templates():
+    global _TPL
+    if _TPL is None:
+        _TPL = {k: cv2.imread(fsg.SNAKE_IMAGES[k]) for k in ('head', 'food', 'wall')}
+    return _TPL
+
+
+def _border_color(img, k=3):
+    m = np.zeros(img.shape[:2], dtype=bool)
+    m[:k, :] = m[-k:, :] = m[:, :k] = m[:, -k:] = True
+    return np.median(img[m].reshape(-1, 3), axis=0)
+
+
+def make_board(layout_seed, palette_seed, n_food=8, n_ice=10, n_body=4):
+    """
+    Bàn giả lập trên nền screen.png: màu nền bàn (viền template mồi) + nhiễu, lệch sáng theo palette_seed
+    (cùng palette_seed = cùng "màn", khác layout_seed = rắn đã đi chỗ khác). Trả (ảnh, đáp án).
+    """
+    rng = random.Random(layout_seed)
+    prng = np.random.default_rng(palette_seed)
+    tpl = _templates()
+    gain = float(prng.uniform(0.85, 1.15))
+    field = _border_color(tpl['food']) * gain
+    img = cv2.imread(str(ROOT / "screen.png"))
+    x1, y1, x2, y2 = AREA
+    noise = np.random.default_rng(layout_seed).normal(0, 4, (y2 - y1, x2 - x1, 3))
+    img[y1:y2, x1:x2] = np.clip(field + noise, 0, 255).astype(np.uint8)
+    rows, cols = DIMS
+    cw, ch = (x2 - x1) / cols, (y2 - y1) / rows
+    cells = [(r, c) for r in range(2, rows - 2) for c in range(2, cols - 2)]
+    rng.shuffle(cells)
+    head = cells.pop()
+    # thân nối sau đầu, chỉ dùng ô còn trống
+    body, cur = [], head
+    for _ in range(n_body):
+        nxt = next((n for n in ((cur[0], cur[1] - 1), (cur[0] + 1, cur[1]), (cur[0] - 1, cur[1]))
+                    if n in cells), None)
+        if nxt is None:
+            break
+        cells.remove(nxt)
+        body.append(nxt)
+        cur = nxt
+    truth = {'snake_head': head, 'snake_body': body, 'food': cells[:n_food], 'wall': cells[n_food:n_food + n_ice]}
+    skin = _border_color(tpl['head'])
+
+    def paste(patch, rc):
+        h, w = patch.shape[:2]
+        cx = int(x1 + (rc[1] + 0.5) * cw) + rng.randint(-1, 1)
+        cy = int(y1 + (rc[0] + 0.5) * ch) + rng.randint(-1, 1)
+        adj = np.clip(patch.astype(np.float32) * gain, 0, 255).astype(np.uint8)
+        img[cy - h // 2:cy - h // 2 + h, cx - w // 2:cx - w // 2 + w] = adj
+
+    paste(tpl['head'], head)
+    for rc in body:
+        paste(np.full((int(ch) - 8, int(cw) - 8, 3), skin, dtype=np.float32), rc)
+    for rc in truth['food']:
+        paste(tpl['food'], rc)
+    for rc in truth['wall']:
+        paste(tpl['wall'], rc)
+    return img, truth
+
+
+def _correct(objects, truth, body=False):
+    ok = (objects['snake_head'] == truth['snake_head']
+          and sorted(objects['food']) == sorted(truth['food'])
+          and sorted(objects['wall']) == sorted(truth['wall']))
+    return ok and (not body or sorted(objects['snake_body']) == sorted(truth['snake_body']))
+
+
+def bench_synthetic(boards):
+    print("== Bàn GIẢ LẬP (template dán lên nền, đáp án biết trước) ==")
+    for scale in SCALES:
+        ok = {'template': 0, 'theo ô mặc định': 0, 'theo ô hiệu chỉnh': 0}
+        ms = dict.fromkeys(ok, 0.0)
+        body_ok = 0
+        for seed in range(boards):
+            # hiệu chỉnh trên bàn đầu màn, đo trên bàn sau khi rắn đã di chuyển (cùng palette)
+            start, _ = make_board(seed + 1000, palette_seed=seed)
+            sig = _calibrated(_scaled(start, scale))
+            img, truth = make_board(seed, palette_seed=seed)
+            im = _scaled(img, scale)
+            runs = {
+                'template': lambda: fsg.analyze_scene_with_templates(im, DIMS, AREA),
+                'theo ô mặc định': lambda: fsg.analyze_scene_grid(im, DIMS, AREA),
+                'theo ô hiệu chỉnh': lambda: fsg.analyze_scene_grid(im, DIMS, AREA, sig),
+            }
+            for name, fn in runs.items():
+                t, (_, o) = _time_ms(fn)
+                ms[name] += t
+                ok[name] += _correct(o, truth)
+                if name == 'theo ô hiệu chỉnh':
+                    body_ok += _correct(o, truth, body=True)
+        base = ms['template'] / boards
+        parts = [f"{k} {ok[k]}/{boards} ({ms[k] / boards:.1f} ms, x{base / max(ms[k] / boards, 1e-6):.1f})"
+                 for k in ok]
+        print(f"  x{scale:.1f}: " + " | ".join(parts) + f" | thân đúng (hiệu chỉnh) {body_ok}/{boards}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    bench_non_board()
+    bench_real_boards()
+    bench_synthetic(n)
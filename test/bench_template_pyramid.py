@@ -0,0 +1,117 @@
+# File: bench_template_pyramid.py
+# So sánh khớp template full-res (cách cũ) với khớp thô→tinh (pyramid) trên cả khung 900x1600.
+#   - Độ chính xác: cùng ok / cùng toạ độ tâm với cách cũ
+#   - Tốc độ: ms/lần tìm
+#   Các nhóm ca:
+#   - "có mặt":      mảnh cắt từ chính frame (phải thấy, đúng vị trí)
+#   - "vắng (đảo)":  mảnh cắt đó bị đảo màu + lật ngang (chắc chắn không có trên frame)
+#   - "màn khác":    mảnh cắt từ ảnh màn hình KHÁC tìm trên frame này
+#   - "images/":     template thật của repo (đa số không thuộc màn đang xét)
+#   Nhóm âm: pyramid phải KHÔNG báo thấy ở chỗ full-res không thấy (dương tính giả).
+# Chạy: python test/bench_template_pyramid.py [screen.png ...]
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import module  # noqa: E402
+
+ROUNDS = int(os.environ.get("PYR_BENCH_ROUNDS", "5"))
+THRESHOLD = 0.85
+
+
+def _time_ms(fn, rounds=ROUNDS):
+    fn()  # làm nóng (cache template / scale)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        out = fn()
+    return (time.perf_counter() - t0) * 1000.0 / rounds, out
+
+
+def _crop_templates(frame, out_dir, n=12, seed=7, tag="crop", mangle=False):
+    """
+    Cắt ngẫu nhiên vài mảnh từ frame làm template (chắc chắn có mặt, biết trước vị trí).
+    mangle=True: đảo màu + lật ngang mảnh cắt → chắc chắn KHÔNG có trên frame.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = frame.shape[:2]
+    paths = []
+    for i in range(n):
+        tw, th = int(rng.integers(48, 220)), int(rng.integers(40, 160))
+        x, y = int(rng.integers(0, w - tw)), int(rng.integers(0, h - th))
+        crop = frame[y:y + th, x:x + tw]
+        if mangle:
+            crop = cv2.flip(255 - crop, 1)
+        p = Path(out_dir) / f"{tag}_{i}_{x}_{y}.png"
+        cv2.imwrite(str(p), crop)
+        paths.append(str(p))
+    return paths
+
+
+def _run_group(frame, name, paths, expect_found):
+    """expect_found: True (phải thấy) / False (phải không thấy) / None (lấy full-res làm chuẩn)."""
+    same = total = fp_full = fp_pyr = miss_full = miss_pyr = 0
+    t_full = t_pyr = 0.0
+    for path in paths:
+        if module.get_template(path) is None:
+            continue
+        ms_full, r_full = _time_ms(lambda: module.find_on_frame(frame, path, threshold=THRESHOLD, pyramid=False))
+        ms_pyr, r_pyr = _time_ms(lambda: module.find_on_frame(frame, path, threshold=THRESHOLD, pyramid=True))
+        total += 1
+        t_full += ms_full
+        t_pyr += ms_pyr
+        ok = (r_full[0] == r_pyr[0]) and (r_full[1] == r_pyr[1])
+        same += ok
+        if expect_found is False:
+            fp_full += bool(r_full[0])
+            fp_pyr += bool(r_pyr[0])
+        elif expect_found is True:
+            miss_full += not r_full[0]
+            miss_pyr += not r_pyr[0]
+        if not ok or r_full[0] or r_pyr[0]:
+            print(f"  {'OK ' if ok else 'KHÁC'} {Path(path).name:36s} full={r_full[0]!s:5} {r_full[1]} "
+                  f"{r_full[2]:.3f} pyr={r_pyr[0]!s:5} {r_pyr[1]} {r_pyr[2]:.3f} | {ms_full:6.1f} → {ms_pyr:5.1f} ms")
+    if not total:
+        return
+    extra = ""
+    if expect_found is False:
+        extra = f" | dương tính giả: full-res {fp_full}, pyramid {fp_pyr}"
+    elif expect_found is True:
+        extra = f" | bỏ sót: full-res {miss_full}, pyramid {miss_pyr}"
+    print(f"[{name}] trùng kết quả {same}/{total}{extra} | TB full-res {t_full / total:.1f} ms, "
+          f"pyramid {t_pyr / total:.1f} ms (x{t_full / max(t_pyr, 1e-6):.1f})")
+
+
+def bench(screen_path, templates, others=()):
+    frame = cv2.imread(str(screen_path))
+    if frame is None:
+        print(f"Không đọc được ảnh: {screen_path}")
+        return
+    print(f"\n=== {screen_path} ({frame.shape[1]}x{frame.shape[0]}) ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        _run_group(frame, "có mặt", _crop_templates(frame, tmp), True)
+        _run_group(frame, "vắng (đảo)", _crop_templates(frame, tmp, seed=11, tag="neg", mangle=True), False)
+        for j, other in enumerate(others):
+            img = cv2.imread(str(other))
+            if img is None or Path(other).resolve() == Path(screen_path).resolve():
+                continue
+            # màn khác: kết quả đúng chưa biết trước (mảng nền trơn có thể trùng) → so với full-res
+            _run_group(frame, f"màn khác: {Path(other).resolve().relative_to(ROOT)}",
+                       _crop_templates(img, tmp, seed=23 + j, tag=f"other{j}"), None)
+        _run_group(frame, "images/", templates, None)
+
+
+if __name__ == "__main__":
+    screens = sys.argv[1:] or [ROOT / "screen.png", ROOT / "test" / "screen.png",
+                               ROOT / "test" / "debug_grid_and_objects.png"]
+    tpls = sorted(str(p) for p in (ROOT / "images").rglob("*.png"))
+    for s in screens:
+        bench(s, tpls, others=screens)
@@ -0,0 +1,293 @@
+# fake_adb_server.py
+# ==========================================================
+#  adb server GIẢ (tcp, cổng ngẫu nhiên) nói đúng giao thức host của ADB,
+#  dùng để kiểm thử adb_client.py khi không có adb.exe / máy ảo:
+#    host:version, host:devices, host-serial:<s>:features|get-state|forward|killforward,
+#    host:transport:<s> → shell,v2,raw: / shell: (adbd cũ) / exec: / sync: (SEND, RECV).
+#  Thiết bị giả: FakeDevice(serial, shell_v2, commands={lệnh: (code, stdout, stderr)}, files={đường dẫn: bytes},
+#               streams={lệnh: [(giây chờ, bytes), ...]} — lệnh chạy lâu (logcat), giữ kết nối tới khi client đóng).
+#  Chạy tay: python test/fake_adb_server.py  → in cổng, Ctrl+C để dừng.
+# ==========================================================
+from __future__ import annotations
+
+import socket
+import struct
+import threading
+from typing import Optional
+
+_V2_STDOUT = 1
+_V2_STDERR = 2
+_V2_EXIT = 3
+_LEGACY_TAG = ";echo __ADBRC__$?"
+
+
+class FakeDevice:
+    def __init__(self, serial: str, shell_v2: bool = True, state: str = "device",
+                 commands: Optional[dict] = None, files: Optional[dict] = None, streams: Optional[dict] = None):
+        self.serial = serial
+        self.shell_v2 = shell_v2
+        self.state = state
+        self.commands: dict[str, tuple[int, bytes, bytes]] = dict(commands or {})
+        self.files: dict[str, bytes] = dict(files or {})
+        self.streams: dict[str, list[tuple[float, bytes]]] = dict(streams or {})
+        self.forwards: dict[str, str] = {}
+        self.requests: list[str] = []  # dịch vụ đã nhận (shell,v2,raw:... / exec:... / sync:)
+
+    def features(self) -> str:
+        return "shell_v2,cmd,stat_v2" if self.shell_v2 else "cmd"
+
+    def run(self, cmd: str) -> tuple[int, bytes, bytes]:
+        res = self.commands.get(cmd)
+        if res is None:
+            name = cmd.split()[0] if cmd.split() else cmd
+            return 127, b"", f"/system/bin/sh: {name}: not found\n".encode()
+        return res
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("client đóng kết nối")
+        buf += chunk
+    return bytes(buf)
+
+
+def _read_request(sock: socket.socket) -> str:
+    n = int(_recv_exact(sock, 4), 16)
+    return _recv_exact(sock, n).decode("utf-8")
+
+
+def _okay(sock: socket.socket, block: Optional[str] = None):
+    data = b"OKAY"
+    if block is not None:
+        raw = block.encode("utf-8")
+        data += b"%04x" % len(raw) + raw
+    sock.sendall(data)
+
+
+def _fail(sock: socket.socket, msg: str):
+    raw = msg.encode("utf-8")
+    sock.sendall(b"FAIL" + b"%04x" % len(raw) + raw)
+
+
+class FakeAdbServer:
+    """with FakeAdbServer(devices) as srv: AdbClient(port=srv.port) ..."""
+
+    def __init__(self, devices=(), host: str = "127.0.0.1"):
+        self.devices: dict[str, FakeDevice] = {d.serial: d for d in devices}
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, 0))
+        self._sock.listen(16)
+        self._sock.settimeout(0.1)  # close() không đánh thức accept() trên Linux → kiểm tra _stop định kỳ
+        self.host, self.port = self._sock.getsockname()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.connections = 0
+        self._idle: set[socket.socket] = set()  # đã qua host:transport, đang chờ yêu cầu dịch vụ
+        self._idle_lock = threading.Lock()
+
+    # ---------- vòng đời ----------
+    def start(self) -> "FakeAdbServer":
+        self._thread = threading.Thread(target=self._accept_loop, name="FakeAdbServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_device(self, dev: FakeDevice):
+        self.devices[dev.serial] = dev
+
+    def drop_idle(self) -> int:
+        """Đóng mọi socket đã gắn transport mà chưa gửi dịch vụ (như adb server khi máy ảo khởi động lại)."""
+        with self._idle_lock:
+            idle, self._idle = self._idle, set()
+        for conn in idle:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError:
+                pass
+        return len(idle)
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.settimeout(None)
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        try:
+            self._handle(conn)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    # ---------- host:* ----------
+    def _device_or_fail(self, conn: socket.socket, serial: str) -> Optional[FakeDevice]:
+        dev = self.devices.get(serial)
+        if dev is None:
+            _fail(conn, f"device '{serial}' not found")
+        return dev
+
+    def _handle(self, conn: socket.socket):
+        req = _read_request(conn)
+        if req == "host:version":
+            return _okay(conn, "0029")
+        if req == "host:devices":
+            return _okay(conn, "".join(f"{d.serial}\t{d.state}\n" for d in self.devices.values()))
+        if req.startswith("host:transport:"):
+            dev = self._device_or_fail(conn, req[len("host:transport:"):])
+            if dev is not None:
+                _okay(conn)
+                with self._idle_lock:
+                    self._idle.add(conn)
+                try:
+                    svc = _read_request(conn)
+                finally:
+                    with self._idle_lock:
+                        self._idle.discard(conn)
+                self._service(conn, dev, svc)
+            return
+        if req.startswith("host-serial:"):
+            serial, _, what = req[len("host-serial:"):].partition(":")
+            dev = self._device_or_fail(conn, serial)
+            if dev is None:
+                return
+            if what == "features":
+                return _okay(conn, dev.features())
+            if what == "get-state":
+                return _okay(conn, dev.state)
+            if what.startswith("forward:"):
+                local, _, remote = what[len("forward:"):].partition(";")
+                dev.forwards[local] = remote
+                return conn.sendall(b"OKAYOKAY")
+            if what.startswith("killforward:"):
+                if dev.forwards.pop(what[len("killforward:"):], None) is None:
+                    return _fail(conn, "listener not found")
+                return _okay(conn)
+            if what == "killforward-all":
+                dev.forwards.clear()
+                return _okay(conn)
+        _fail(conn, f"unknown host service '{req}'")
+
+    # ---------- dịch vụ trên thiết bị ----------
+    def _service(self, conn: socket.socket, dev: FakeDevice, svc: str):
+        dev.requests.append(svc)
+        if svc.startswith("shell,v2,raw:"):
+            if not dev.shell_v2:
+                return _fail(conn, "closed")
+            code, out, err = dev.run(svc[len("shell,v2,raw:"):])
+            _okay(conn)
+            pkt = b""
+            if out:
+                pkt += struct.pack("<BI", _V2_STDOUT, len(out)) + out
+            if err:
+                pkt += struct.pack("<BI", _V2_STDERR, len(err)) + err
+            conn.sendall(pkt + struct.pack("<BI", _V2_EXIT, 1) + bytes([code & 0xFF]))
+            return
+        if svc.startswith("shell:") and svc[len("shell:"):] in dev.streams:
+            _okay(conn)
+            for delay, data in dev.streams[svc[len("shell:"):]]:
+                if self._stop.wait(delay):
+                    return
+                conn.sendall(data.replace(b"\n", b"\r\n"))
+            while conn.recv(4096):  # lệnh không tự kết thúc (như logcat): giữ tới khi client đóng
+                pass
+            return
+        if svc.startswith("shell:"):
+            # adbd cũ: stdout+stderr chung 1 luồng (pty), không có exit code; sh chạy luôn đuôi `;echo TAG$?`
+            cmd = svc[len("shell:"):]
+            has_tag = cmd.endswith(_LEGACY_TAG)
+            if has_tag:
+                cmd = cmd[:-len(_LEGACY_TAG)]
+            code, out, err = dev.run(cmd)
+            data = out + err + (b"__ADBRC__%d\n" % code if has_tag else b"")
+            _okay(conn)
+            conn.sendall(data.replace(b"\n", b"\r\n"))
+            return
+        if svc.startswith("exec:"):
+            _, out, _ = dev.run(svc[len("exec:"):])
+            _okay(conn)
+            conn.sendall(out)
+            return
+        if svc == "sync:":
+            _okay(conn)
+            return self._sync(conn, dev)
+        _fail(conn, f"unknown service '{svc}'")
+
+    def _sync(self, conn: socket.socket, dev: FakeDevice):
+        while True:
+            head = _recv_exact(conn, 8)
+            tag, n = head[:4], struct.unpack("<I", head[4:])[0]
+            if tag == b"QUIT":
+                return
+            arg = _recv_exact(conn, n).decode("utf-8")
+            if tag == b"SEND":
+                path = arg.rsplit(",", 1)[0]
+                data = bytearray()
+                while True:
+                    h = _recv_exact(conn, 8)
+                    t, m = h[:4], struct.unpack("<I", h[4:])[0]
+                    if t == b"DATA":
+                        data += _recv_exact(conn, m)
+                    elif t == b"DONE":
+                        break
+                    else:
+                        return
+                if path.startswith("/readonly/"):
+                    msg = b"couldn't create file: Read-only file system"
+                    conn.sendall(b"FAIL" + struct.pack("<I", len(msg)) + msg)
+                    continue
+                dev.files[path] = bytes(data)
+                conn.sendall(b"OKAY" + struct.pack("<I", 0))
+            elif tag == b"RECV":
+                data = dev.files.get(arg)
+                if data is None:
+                    msg = f"remote object '{arg}' does not exist".encode()
+                    conn.sendall(b"FAIL" + struct.pack("<I", len(msg)) + msg)
+                    continue
+                for i in range(0, len(data), 64 * 1024):
+                    chunk = data[i:i + 64 * 1024]
+                    conn.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                conn.sendall(b"DONE" + struct.pack("<I", 0))
+            else:
+                return
+
+
+if __name__ == "__main__":
+    import time
+
+    demo = FakeDevice("emulator-5554", commands={"echo hi": (0, b"hi\n", b"")})
+    with FakeAdbServer([demo]) as srv:
+        print(f"Fake adb server: {srv.host}:{srv.port} (ANDROID_ADB_SERVER_PORT={srv.port})")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,220 @@
+# test_adb_client.py
+# ==========================================================
+#  Kiểm thử adb_client.py với adb server giả (test/fake_adb_server.py), không cần adb.exe/máy ảo.
+#  Chạy: python -m pytest test/test_adb_client.py   hoặc   python test/test_adb_client.py
+# ==========================================================
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+import adb_client  # noqa: E402
+from adb_client import AdbClient, AdbError, native_adb  # noqa: E402
+from fake_adb_server import FakeAdbServer, FakeDevice  # noqa: E402
+
+V2 = "emulator-5554"
+LEGACY = "127.0.0.1:62001"  # Nox đời cũ: adbd không có shell_v2
+
+
+def _free_port() -> int:
+    import socket
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class AdbClientTest(unittest.TestCase):
+    def setUp(self):
+        cmds = {
+            "echo hi": (0, b"hi\n", b""),
+            "ls /nope": (1, b"", b"ls: /nope: No such file or directory\n"),
+            "exit 3": (3, b"", b""),
+            "screencap": (0, b"\x89PNG\r\n\x1a\n\x00\x01\n\r", b""),
+            "wm size": (0, b"Physical size: 900x1600\n", b""),
+        }
+        self.dev_v2 = FakeDevice(V2, shell_v2=True, commands=cmds)
+        self.dev_old = FakeDevice(LEGACY, shell_v2=False, commands=cmds)
+        self.srv = FakeAdbServer([self.dev_v2, self.dev_old]).start()
+        self.cli = AdbClient(port=self.srv.port, timeout=3)
+        self._old_client = adb_client._CLIENT
+        adb_client._CLIENT = self.cli  # native_adb dùng client toàn cục
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        adb_client._CLIENT = self._old_client
+        self.cli.close()
+        self.srv.stop()
+        self.tmp.cleanup()
+
+    # ---------- host ----------
+    def test_devices(self):
+        self.assertEqual(self.cli.devices(), [(V2, "device"), (LEGACY, "device")])
+        code, out, err = native_adb(None, ["devices"])
+        self.assertEqual(code, 0)
+        self.assertIn(f"{V2}\tdevice", out)
+
+    def test_get_state_and_forward(self):
+        self.assertEqual(native_adb(V2, ["get-state"]), (0, "device\n", ""))
+        self.assertEqual(native_adb(V2, ["forward", "tcp:1313", "localabstract:minicap"])[0], 0)
+        self.assertEqual(self.dev_v2.forwards, {"tcp:1313": "localabstract:minicap"})
+        self.assertEqual(native_adb(V2, ["forward", "--remove", "tcp:1313"])[0], 0)
+        self.assertEqual(native_adb(V2, ["forward", "--remove", "tcp:1313"])[0], 1)
+
+    # ---------- shell ----------
+    def test_shell_v2_exit_codes(self):
+        self.assertEqual(self.cli.shell(V2, "echo hi"), (0, b"hi\n", b""))
+        code, out, err = self.cli.shell(V2, "ls /nope")
+        self.assertEqual((code, out), (1, b""))
+        self.assertIn(b"No such file", err)  # v2 tách stderr
+        self.assertEqual(self.cli.shell(V2, "exit 3")[0], 3)
+        self.assertEqual(self.cli.shell(V2, "missing-tool")[0], 127)
+        self.assertTrue(all(r.startswith("shell,v2,raw:") for r in self.dev_v2.requests))
+
+    def test_shell_legacy_exit_codes(self):
+        code, out, err = self.cli.shell(LEGACY, "echo hi")
+        self.assertEqual(code, 0)
+        self.assertEqual(out.replace(b"\r\n", b"\n"), b"hi\n")  # sentinel bị cắt khỏi stdout
+        self.assertEqual(self.cli.shell(LEGACY, "exit 3")[0], 3)
+        code, out, _ = self.cli.shell(LEGACY, "ls /nope")
+        self.assertEqual(code, 1)
+        self.assertIn(b"No such file", out)  # pty: stderr chung luồng stdout
+        self.assertTrue(all(r.startswith("shell:") for r in self.dev_old.requests))
+
+    def test_native_shell_text(self):
+        self.assertEqual(native_adb(LEGACY, ["shell", "wm", "size"]), (0, "Physical size: 900x1600\n", ""))
+        self.assertEqual(native_adb(V2, ["shell", "wm", "size"]), (0, "Physical size: 900x1600\n", ""))
+
+    def test_stale_pooled_socket_retried(self):
+        # socket ấm trong pool bị server bỏ (máy ảo khởi động lại) → lệnh sau vẫn chạy, không trả lỗi
+        self.assertEqual(self.cli.shell(V2, "echo hi"), (0, b"hi\n", b""))
+        pool = self.cli._pool(V2)
+        deadline = time.monotonic() + 3
+        while len(pool._idle) < adb_client.POOL_WARM_PER_DEVICE and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(len(pool._idle), adb_client.POOL_WARM_PER_DEVICE)
+        self.assertGreaterEqual(self.srv.drop_idle(), adb_client.POOL_WARM_PER_DEVICE)
+        time.sleep(0.05)
+        self.assertEqual(native_adb(V2, ["shell", "echo", "hi"]), (0, "hi\n", ""))
+        self.assertEqual(native_adb(V2, ["exec-out", "screencap"], text=False)[0], 0)
+
+    # ---------- luồng chạy lâu ----------
+    def test_shell_stream_survives_idle(self):
+        # logcat im lặng lâu hơn timeout của client (0.5 s) vẫn phải đọc tiếp được, không bị socket.timeout
+        self.dev_v2.streams["logcat -b events"] = [(0, b"a\n"), (1.2, b"b\n")]
+        cli = AdbClient(port=self.srv.port, timeout=0.5)
+        sock = cli.shell_stream(V2, "logcat -b events")
+        try:
+            t0, data = time.monotonic(), b""
+            while b"b" not in data:
+                chunk = sock.recv(4096)
+                self.assertTrue(chunk)
+                data += chunk
+            self.assertGreaterEqual(time.monotonic() - t0, 1.0)
+        finally:
+            sock.close()
+            cli.close()
+
+    def test_activity_watcher_survives_idle_logcat(self):
+        import activity_watcher
+        import module
+
+        first = b"I/am_resume_activity( 812): [0,1,5,com.pkg/.MainActivity]\n"
+        second = b"I/am_resume_activity( 812): [0,2,5,com.pkg/.GameActivity]\n"
+        self.dev_v2.streams[activity_watcher._LOGCAT_CMD] = [(0, first), (1.5, second)]
+        adb_client._CLIENT = cli = AdbClient(port=self.srv.port, timeout=0.5)
+
+        class Wk:
+            device_id = V2
+            logs = []
+
+            def _log(self, msg):
+                self.logs.append(msg)
+
+        wk = Wk()
+        watcher = activity_watcher.ActivityWatcher(wk)
+        watcher.start()
+        try:
+            deadline = time.monotonic() + 5
+            while module._fg_entry(V2).comp != "com.pkg/com.pkg.GameActivity" and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(module._fg_entry(V2).comp, "com.pkg/com.pkg.GameActivity")
+            self.assertTrue(module._fg_entry(V2).watched)
+            self.assertFalse(any("dừng" in m for m in wk.logs))
+        finally:
+            watcher.stop()
+            cli.close()
+        self.assertFalse(module._fg_entry(V2).watched)
+
+    # ---------- exec-out ----------
+    def test_exec_out_binary_untouched(self):
+        code, out, err = native_adb(V2, ["exec-out", "screencap"], text=False)
+        self.assertEqual((code, out, err), (0, b"\x89PNG\r\n\x1a\n\x00\x01\n\r", b""))
+
+    # ---------- sync ----------
+    def test_push_pull_roundtrip(self):
+        src = os.path.join(self.tmp.name, "minicap.so")
+        data = os.urandom(200 * 1024 + 7)  # > 1 chunk 64 KB
+        with open(src, "wb") as f:
+            f.write(data)
+        self.assertEqual(native_adb(V2, ["push", src, "/data/local/tmp/minicap.so"])[0], 0)
+        self.assertEqual(self.dev_v2.files["/data/local/tmp/minicap.so"], data)
+
+        dst = os.path.join(self.tmp.name, "back.so")
+        self.assertEqual(native_adb(V2, ["pull", "/data/local/tmp/minicap.so", dst])[0], 0)
+        with open(dst, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_pull_missing_and_push_fail(self):
+        dst = os.path.join(self.tmp.name, "x.bin")
+        code, _, err = native_adb(V2, ["pull", "/sdcard/none.bin", dst])
+        self.assertEqual(code, 1)
+        self.assertIn("does not exist", err)
+        self.assertFalse(os.path.exists(dst) or os.path.exists(dst + ".part"))
+
+        src = os.path.join(self.tmp.name, "a.txt")
+        with open(src, "wb") as f:
+            f.write(b"abc")
+        code, _, err = native_adb(V2, ["push", src, "/readonly/a.txt"])
+        self.assertEqual(code, 1)
+        self.assertIn("Read-only", err)
+
+    # ---------- lỗi ----------
+    def test_device_not_found(self):
+        code, out, err = native_adb("emulator-9999", ["shell", "echo", "hi"])
+        self.assertEqual((code, out), (1, ""))
+        self.assertIn("not found", err)
+        with self.assertRaises(AdbError):
+            self.cli.exec_out("emulator-9999", "screencap")
+
+    def test_device_attached_later_uses_shell_v2(self):
+        late = "emulator-5556"
+        self.assertEqual(native_adb(late, ["shell", "echo", "hi"])[0], 1)
+        self.srv.add_device(FakeDevice(late, shell_v2=True, commands={"exit 3": (3, b"", b"")}))
+        self.assertEqual(self.cli.shell(late, "exit 3")[0], 3)
+        self.assertTrue(self.srv.devices[late].requests[-1].startswith("shell,v2,raw:"))
+
+    def test_unsupported_command_falls_back(self):
+        self.assertIsNone(native_adb(V2, ["install", "app.apk"]))
+        self.assertIsNone(native_adb(None, ["shell", "echo", "hi"]))
+
+    def test_server_down_falls_back(self):
+        adb_client._CLIENT = down = AdbClient(port=_free_port(), timeout=1)
+        try:
+            self.assertIsNone(native_adb(V2, ["shell", "echo", "hi"]))
+            # đã đánh dấu server chết → lần sau bỏ qua ngay, không connect lại
+            t0 = time.monotonic()
+            self.assertIsNone(native_adb(V2, ["exec-out", "screencap"], text=False))
+            self.assertLess(time.monotonic() - t0, 0.05)
+            self.assertGreater(down._down_until, time.monotonic())
+        finally:
+            down.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -108,11 +108,77 @@ def find_and_draw_objects(image, grid_dims, game_area):
         log_wk(None, f"  Tìm thấy {count} đối tượng '{name}'")
 
 
+# ==============================================================================
+# ## --- BENCHMARK LẬP LỘ TRÌNH (python test/test_snake_game.py bench [số_bàn]) ---
+# ==============================================================================
+
+def random_board(seed, n_walls=18):
+    """Bàn 15x15 ngẫu nhiên: viền là tường, vài ô băng, đầu rắn + 6..14 mồi, cửa vào ngẫu nhiên."""
+    import random
+    rng = random.Random(seed)
+    rows, cols = GRID_DIMENSIONS
+    grid = np.zeros(GRID_DIMENSIONS, dtype=int)
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 1
+    cells = [(r, c) for r in range(1, rows - 1) for c in range(1, cols - 1)]
+    rng.shuffle(cells)
+    for rc in cells[:n_walls]:
+        grid[rc] = 1
+    foods = cells[n_walls + 1:n_walls + 1 + rng.randint(6, 14)]
+    return grid, cells[n_walls], foods, rng.choice(['LEFT', 'RIGHT', 'UP', 'DOWN'])
+
+
+def bench_planner(boards=300):
+    """Số bàn/giây: A* tham lam cũ (1 lần A* / mồi còn lại) so với snake_planner (BFS mọi cặp + NN/2-opt)."""
+    root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(root))
+    import flows_snake_game as fsg
+    from snake_planner import plan_route
+
+    def legacy(grid, start, foods, side):
+        grid = grid.copy()
+        for gate in fsg.GATES[side]:
+            grid[gate] = 0  # cửa nằm trên viền (tường) → mở ra để so cùng điều kiện
+        cur, body, left, out = start, [], list(foods), []
+        while left:
+            left.sort(key=lambda f: fsg.heuristic(cur, f))
+            seg = target = None
+            for f in left:
+                seg = fsg.a_star_pathfinding(grid, cur, f, body)
+                if seg:
+                    target = f
+                    break
+            if not target:
+                return None
+            out += seg
+            cur, body = target, seg[:-1]
+            left.remove(target)
+        gate = min(fsg.GATES[side], key=lambda g: fsg.heuristic(cur, g))
+        tail = fsg.a_star_pathfinding(grid, cur, gate, body)
+        return out + tail if tail else None
+
+    def planner(grid, start, foods, side):
+        return plan_route(grid, start, foods, fsg.GATES[side])
+
+    data = [random_board(seed) for seed in range(boards)]
+    for name, fn in (("A* tham lam (cũ)", legacy), ("snake_planner", planner)):
+        t0 = time.perf_counter()
+        results = [fn(*b) for b in data]
+        dt = time.perf_counter() - t0
+        ok = [r for r in results if r]
+        avg = sum(len(r) for r in ok) / max(len(ok), 1)
+        print(f"{name:18s}: {boards / dt:8.1f} bàn/giây | có lộ trình {len(ok)}/{boards}, TB {avg:.1f} nước")
+
+
 # ==============================================================================
 # ## --- PHẦN THỰC THI CHÍNH ---
 # ==============================================================================
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench_planner(int(sys.argv[2]) if len(sys.argv) > 2 else 300)
+        sys.exit(0)
+
+
     class MockWorker:
         def __init__(self, port, device_serial):
             self.port = port
@@ -23,6 +23,8 @@ from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 import requests
 from module import resource_path
+from adb_client import native_adb
+from account_scheduler import get_account_scheduler
 from PySide6.QtCore import Qt, QPoint, QSize
 from PySide6.QtGui import QCloseEvent, QTextCursor, QIcon, QPixmap
 from PySide6.QtWidgets import (
@@ -65,6 +67,14 @@ BLESS_COL_NAME, BLESS_COL_LAST = range(2)
 
 # ---------------- Helpers & Dialogs (SỬA ĐỔI LOGIC NHẬN DIỆN) ----------------
 def _run_quiet(cmd: list[str], timeout: int = 8) -> str:
+    # Lệnh adb (`<adb> [-s serial] ...`) → thử qua adb server trực tiếp trước
+    args = [str(c) for c in cmd[1:]]
+    serial = None
+    if args[:1] == ["-s"] and len(args) >= 2:
+        serial, args = args[1], args[2:]
+    res = native_adb(serial, args, timeout=timeout)
+    if res is not None:
+        return res[1]
     try:
         startupinfo = None
         if os.name == 'nt':
@@ -77,7 +87,36 @@ def _run_quiet(cmd: list[str], timeout: int = 8) -> str:
         return ""
 
 
-# Dán để thay thế hàm cũ trong ui_main.py
+def _adb_sources() -> list[tuple[str, str]]:
+    """
+    (Tên máy ảo, đường dẫn adb) cần quét, theo thứ tự ưu tiên LDPlayer → Nox.
+    Bỏ các bản trùng: Nox/LDPlayer đang dùng chung 1 adb thì chỉ quét 1 lần.
+    """
+    res, seen = [], set()
+    for name, path in (("LDPlayer", LDPLAYER_ADB_PATH), ("Nox", NOX_ADB_PATH)):
+        p = Path(path)
+        if not p.exists():
+            continue
+        try:
+            key = os.path.normcase(str(p.resolve()))
+        except OSError:
+            key = os.path.normcase(str(p))
+        if key in seen:
+            continue
+        seen.add(key)
+        res.append((name, str(p)))
+    return res
+
+
+def emulator_label(device_id: str) -> str:
+    """Tên hiển thị cho thiết bị do adb_client.track_devices báo về (cùng quy ước với list_adb_ports_with_status)."""
+    sources = _adb_sources()
+    return sources[0][0] if sources else "Unknown"
+
+
+def is_emulator_serial(device_id: str) -> bool:
+    return "emulator-" in device_id or "127.0.0.1:" in device_id
+
 
 def list_adb_ports_with_status() -> dict[str, str]:
     """
@@ -86,37 +125,21 @@ def list_adb_ports_with_status() -> dict[str, str]:
     """
     result: dict[str, str] = {}
 
-    # 1. Quét bằng LDPlayer ADB trước
-    try:
-        if Path(LDPLAYER_ADB_PATH).exists():
-            ld_text = _run_quiet([str(LDPLAYER_ADB_PATH), "devices"], timeout=6)
-            for line in ld_text.splitlines():
-                s = line.strip()
-                if not s or s.startswith("List of devices"): continue
-                if "emulator-" in s or "127.0.0.1:" in s:
-                    parts = s.split()
-                    device_id = parts[0]
-                    status = parts[1] if len(parts) > 1 else "unknown"
-                    result[device_id] = f"LDPlayer - {status}"
-    except Exception as e:
-        print(f"Lỗi khi quét LDPlayer ADB: {e}")
-
-    # 2. Quét bằng Nox ADB
-    try:
-        if Path(NOX_ADB_PATH).exists():
-            nox_text = _run_quiet([str(NOX_ADB_PATH), "devices"], timeout=6)
-            for line in nox_text.splitlines():
+    for name, path in _adb_sources():
+        try:
+            text = _run_quiet([path, "devices"], timeout=6)
+            for line in text.splitlines():
                 s = line.strip()
                 if not s or s.startswith("List of devices"): continue
-                if "emulator-" in s or "127.0.0.1:" in s:
+                if is_emulator_serial(s):
                     parts = s.split()
                     device_id = parts[0]
-                    # CHỈ THÊM NẾU MÁY ẢO NÀY CHƯA ĐƯỢC LDPLAYER NHẬN DIỆN
+                    # CHỈ THÊM NẾU MÁY ẢO NÀY CHƯA ĐƯỢC ADB ƯU TIÊN HƠN NHẬN DIỆN
                     if device_id not in result:
                         status = parts[1] if len(parts) > 1 else "unknown"
-                        result[device_id] = f"Nox - {status}"
-    except Exception as e:
-        print(f"Lỗi khi quét Nox ADB: {e}")
+                        result[device_id] = f"{name} - {status}"
+        except Exception as e:
+            print(f"Lỗi khi quét {name} ADB: {e}")
 
     return result
 
@@ -432,6 +455,7 @@ class MainWindow(QMainWindow):
             self.log_msg("Đang tải và làm mới danh sách tài khoản từ server...")
             QApplication.setOverrideCursor(Qt.WaitCursor)
             self.online_accounts = self.cloud.get_game_accounts()
+            get_account_scheduler().notify_changed()  # runner đang chờ mốc → làm mới ngay
 
             # BƯỚC 2: Truyền danh sách đã lưu vào hàm populate
             self.populate_accounts_table(checked_emails)